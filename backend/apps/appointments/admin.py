@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Appointment
+from .models import Appointment, Notification, SlotHold
+from .outbox import requeue_dead
 
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
@@ -7,7 +8,7 @@ class AppointmentAdmin(admin.ModelAdmin):
     list_filter = ('status', 'priority', 'service__department', 'appointment_datetime', 'created_at')
     search_fields = ('token_code', 'citizen__first_name', 'citizen__last_name', 'citizen__email')
     list_editable = ('status',)
-    readonly_fields = ('id', 'token_code', 'predicted_wait_minutes', 'created_at', 'updated_at')
+    readonly_fields = ('id', 'token_code', 'predicted_wait_minutes', 'prediction_model_version', 'confirmation_sent_at', 'created_at', 'updated_at')
     
     fieldsets = (
         ('Appointment Info', {
@@ -17,9 +18,30 @@ class AppointmentAdmin(admin.ModelAdmin):
             'fields': ('status', 'priority')
         }),
         ('Wait Times', {
-            'fields': ('predicted_wait_minutes', 'actual_wait_minutes')
+            'fields': ('predicted_wait_minutes', 'prediction_model_version', 'actual_wait_minutes')
         }),
         ('Additional Info', {
-            'fields': ('notes', 'created_at', 'updated_at')
+            'fields': ('notes', 'confirmation_sent_at', 'created_at', 'updated_at')
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(SlotHold)
+class SlotHoldAdmin(admin.ModelAdmin):
+    list_display = ('slot', 'citizen', 'expires_at', 'created_at')
+    list_filter = ('expires_at',)
+    search_fields = ('citizen__email',)
+    readonly_fields = ('id', 'created_at')
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('to_email', 'subject', 'dedupe_key')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected dead notifications')
+    def requeue(self, request, queryset):
+        count = requeue_dead(list(queryset.values_list('id', flat=True)))
+        self.message_user(request, f'{count} notifications requeued')
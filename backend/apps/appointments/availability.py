@@ -0,0 +1,327 @@
+# apps/appointments/availability.py
+"""
+Open slots per service and local day, served from cache.
+
+Slots are virtual: a service's OpeningHours template defines when slots
+start and how many bookings each takes, and a ServiceSlot row exists only
+once a booking or hold has touched that slot (ServiceSlot.for_booking).
+A day is the template's slots overlaid with the rows of that day: a row
+replaces the template slot at its datetime, so booked, held or blocked
+(is_available=False) capacity is taken off, and rows outside the
+template are kept as they are.
+
+A day is stored as a tuple of (slot_id, datetime, current_bookings,
+max_capacity) rows, one per open slot in time order; slot_id is None for
+a slot that has not been materialized. Entries are keyed by the day's
+slots version and the service's template version, so a committed
+reservation, cancellation or template edit is never answered from an
+older entry. hooks.slot_changed() also deletes the entry explicitly so
+it does not linger until CACHE_TTL.
+
+Lookups go through a small per-process LRU, then the shared cache, and
+only on a miss to the database: the day's template rows and a range
+query on (service, datetime) that the unique index covers. Without a
+shared cache (versions.is_shared()) every lookup goes to the database,
+since a worker would not see the version bumps made by the others.
+
+Month calendars (per-day open slot counts and remaining capacity for one
+or more services) are cached the same way under a digest of all the
+versions they cover, and likewise only with a shared cache.
+
+next_available() finds the earliest open slots across services without
+probing day by day: it reads the templates once and the rows of a time
+window with one range query, widening the window only when it holds
+fewer slots than asked for.
+"""
+import calendar
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import date as date_cls, datetime, time, timedelta, timezone as dt_timezone
+from django.core.cache import cache
+from django.utils import timezone
+from apps.services.models import OpeningHours, Service
+from . import versions
+from .models import ServiceSlot
+
+CACHE_TTL = 3600
+LOCAL_SIZE = 512
+MAX_CALENDAR_SERVICES = 50
+SEARCH_WINDOW_DAYS = 7
+MAX_SEARCH_DAYS = 90
+MAX_SEARCH_RESULTS = 50
+MAX_SEARCH_SERVICES = 200
+
+# Dates the endpoints accept; keeps day, month and search window arithmetic
+# (and the conversion to UTC) clear of date.min and date.max
+MIN_DATE = date_cls(1900, 1, 1)
+MAX_DATE = date_cls(9998, 12, 31)
+
+
+def date_in_range(date):
+    return MIN_DATE <= date <= MAX_DATE
+
+
+def cache_key(service_id, date, version):
+    return f'availability:{service_id}:{date.isoformat()}:{version}'
+
+
+def day_bounds(date):
+    """[start, end) of the local day as aware datetimes"""
+    start = timezone.make_aware(datetime.combine(date, time.min))
+    end = timezone.make_aware(datetime.combine(date + timedelta(days=1), time.min))
+    return start, end
+
+
+def day_version(service_id, date):
+    """(version, last_modified) of the service-day, covering its slots and its template"""
+    keys = [versions.slots_key(service_id, date), versions.template_key(service_id)]
+    day_versions, last_modified = versions.get_many(keys)
+    return '.'.join(str(day_versions[key]) for key in keys), last_modified
+
+
+def load_templates(service_ids):
+    """{service_id: {weekday: [(local time, capacity)]}} from the services' opening hours"""
+    templates = defaultdict(lambda: defaultdict(list))
+    for hours in OpeningHours.objects.filter(service_id__in=service_ids):
+        templates[hours.service_id][hours.weekday].extend(
+            (slot_time, hours.capacity) for slot_time in hours.slot_times()
+        )
+    return templates
+
+
+def template_slots(weekdays, date):
+    """[(UTC datetime, capacity)] of the template slots on date"""
+    tz = timezone.get_current_timezone()
+    return [
+        (datetime.combine(date, slot_time, tzinfo=tz).astimezone(dt_timezone.utc), capacity)
+        for slot_time, capacity in weekdays.get(date.weekday(), ())
+    ]
+
+
+def load_day(service_id, date):
+    start, end = day_bounds(date)
+    rows = ServiceSlot.objects.filter(
+        service_id=service_id, datetime__gte=start, datetime__lt=end
+    ).values_list('id', 'datetime', 'current_bookings', 'max_capacity', 'is_available')
+    materialized = set()
+    slots = []
+    for slot_id, slot_datetime, current_bookings, max_capacity, is_available in rows:
+        materialized.add(slot_datetime)
+        if is_available:
+            slots.append((slot_id, slot_datetime, current_bookings, max_capacity))
+    slots.extend(
+        (None, slot_datetime, 0, capacity)
+        for slot_datetime, capacity in template_slots(load_templates([service_id])[service_id], date)
+        if slot_datetime not in materialized
+    )
+    slots.sort(key=lambda slot: slot[1])
+    return tuple(slots)
+
+
+class LocalCache:
+    """A thread-safe LRU of at most size entries"""
+
+    def __init__(self, size=LOCAL_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LocalCache()
+
+
+def load_existing_day(service_id, date):
+    """load_day(), or None if there is no such service"""
+    slots = load_day(service_id, date)
+    if not slots and not Service.objects.filter(id=service_id).exists():
+        return None
+    return slots
+
+
+def get_day(service_id, date, version=None):
+    """
+    The open slot rows of the service on date, or None if there is no
+    such service. Pass the version from day_version() when the caller
+    already has it.
+    """
+    if not versions.is_shared():
+        return load_existing_day(service_id, date)
+    if version is None:
+        version, _ = day_version(service_id, date)
+    key = cache_key(service_id, date, version)
+    slots = local_cache.get(key)
+    if slots is not None:
+        return slots
+    slots = cache.get(key)
+    if slots is None:
+        slots = load_existing_day(service_id, date)
+        if slots is None:
+            return None
+        cache.set(key, slots, CACHE_TTL)
+    local_cache.put(key, slots)
+    return slots
+
+
+def invalidate(service_id, date):
+    """Drop the cached entry for the current version of the day"""
+    version, _ = day_version(service_id, date)
+    cache.delete(cache_key(service_id, date, version))
+
+
+def as_dicts(slots):
+    return [
+        {
+            "id": slot_id,
+            "datetime": slot_datetime,
+            "current_bookings": current_bookings,
+            "max_capacity": max_capacity,
+        }
+        for slot_id, slot_datetime, current_bookings, max_capacity in slots
+    ]
+
+
+def month_days(year, month):
+    return [date_cls(year, month, day) for day in range(1, calendar.monthrange(year, month)[1] + 1)]
+
+
+def month_versions(service_ids, year, month):
+    """(digest of the versions, last_modified) for the services' month"""
+    keys = [versions.slots_key(service_id, day) for service_id in service_ids for day in month_days(year, month)]
+    keys += [versions.template_key(service_id) for service_id in service_ids]
+    all_versions, last_modified = versions.get_many(keys)
+    digest = hashlib.sha1(
+        ','.join(f'{key}={all_versions[key]}' for key in keys).encode()
+    ).hexdigest()[:24]
+    return digest, last_modified
+
+
+def load_month(service_ids, year, month):
+    """{service_id: [day summaries]} for every day of the month"""
+    days = month_days(year, month)
+    start, end = day_bounds(days[0])[0], day_bounds(days[-1])[1]
+    totals = defaultdict(lambda: [0, 0])
+    materialized = set()
+    rows = ServiceSlot.objects.filter(
+        service_id__in=service_ids, datetime__gte=start, datetime__lt=end
+    ).values_list('service_id', 'datetime', 'current_bookings', 'max_capacity', 'is_available')
+    for service_id, slot_datetime, current_bookings, max_capacity, is_available in rows:
+        materialized.add((service_id, slot_datetime))
+        if is_available:
+            day_totals = totals[service_id, timezone.localtime(slot_datetime).date()]
+            day_totals[0] += 1
+            day_totals[1] += max_capacity - current_bookings
+
+    templates = load_templates(service_ids)
+    for service_id in service_ids:
+        for day in days:
+            for slot_datetime, capacity in template_slots(templates[service_id], day):
+                if (service_id, slot_datetime) not in materialized:
+                    day_totals = totals[service_id, day]
+                    day_totals[0] += 1
+                    day_totals[1] += capacity
+
+    return {
+        service_id: [
+            {
+                "date": day,
+                "open_slots": totals[service_id, day][0],
+                "remaining_capacity": totals[service_id, day][1],
+            }
+            for day in days
+        ]
+        for service_id in service_ids
+    }
+
+
+def get_month(service_ids, year, month, digest=None):
+    """
+    Per-day calendars of the services for the month, keyed by service id,
+    or None if one of the services does not exist. Pass the digest from
+    month_versions() when the caller already has it.
+    """
+    service_ids = sorted(set(service_ids))
+    if not versions.is_shared():
+        if Service.objects.filter(id__in=service_ids).count() != len(service_ids):
+            return None
+        return load_month(service_ids, year, month)
+    if digest is None:
+        digest, _ = month_versions(service_ids, year, month)
+    key = f'calendar:{year}-{month:02d}:{digest}'
+    calendars = local_cache.get(key)
+    if calendars is not None:
+        return calendars
+    calendars = cache.get(key)
+    if calendars is None:
+        if Service.objects.filter(id__in=service_ids).count() != len(service_ids):
+            return None
+        calendars = load_month(service_ids, year, month)
+        cache.set(key, calendars, CACHE_TTL)
+    local_cache.put(key, calendars)
+    return calendars
+
+
+def open_slots_between(service_ids, templates, start, end):
+    """[(datetime, service_id, slot_id, current_bookings, max_capacity)] of open slots in [start, end), in order"""
+    rows = ServiceSlot.objects.filter(
+        service_id__in=service_ids, datetime__gte=start, datetime__lt=end
+    ).values_list('service_id', 'id', 'datetime', 'current_bookings', 'max_capacity', 'is_available')
+    materialized = set()
+    slots = []
+    for service_id, slot_id, slot_datetime, current_bookings, max_capacity, is_available in rows:
+        materialized.add((service_id, slot_datetime))
+        if is_available:
+            slots.append((slot_datetime, service_id, slot_id, current_bookings, max_capacity))
+
+    first_day, last_day = timezone.localdate(start), timezone.localdate(end)
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    for service_id in service_ids:
+        if service_id not in templates:
+            continue
+        for day in days:
+            for slot_datetime, capacity in template_slots(templates[service_id], day):
+                if start <= slot_datetime < end and (service_id, slot_datetime) not in materialized:
+                    slots.append((slot_datetime, service_id, None, 0, capacity))
+    slots.sort(key=lambda slot: slot[:2])
+    return slots
+
+
+def next_available(service_ids, after, limit=10, horizon_days=MAX_SEARCH_DAYS):
+    """
+    The first limit open slots of the services starting at or after
+    after and within horizon_days, earliest first, as (datetime,
+    service_id, slot_id, current_bookings, max_capacity) tuples.
+
+    Starts with a SEARCH_WINDOW_DAYS window and doubles it while too few
+    slots were found, so a search costs one range query unless the
+    services are booked out for weeks.
+    """
+    templates = load_templates(service_ids)
+    end = after + timedelta(days=horizon_days)
+    window = timedelta(days=SEARCH_WINDOW_DAYS)
+    start = after
+    found = []
+    while start < end and len(found) < limit:
+        window_end = min(start + window, end)
+        found.extend(open_slots_between(service_ids, templates, start, window_end))
+        start = window_end
+        window *= 2
+    return found[:limit]
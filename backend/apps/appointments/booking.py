@@ -0,0 +1,95 @@
+# apps/appointments/booking.py
+"""
+Group bookings: several appointments for one citizen in one transaction.
+
+The number of queries does not grow with the group size: slots are read
+(and materialized from opening hours) with a fixed number of queries,
+capacity is taken on all of them with one conditional UPDATE,
+appointments are inserted with bulk_create and wait times are predicted
+in one batch. QR codes and the confirmation email are left to a
+single background task queued after commit.
+"""
+from collections import Counter
+from django.db import IntegrityError, transaction
+from apps.ops.prediction import predict_wait_minutes_batch
+from apps.services.models import Service
+from . import counters, hooks
+from .models import Appointment, ServiceSlot
+from .tokens import TOKEN_ATTEMPTS, discard_block
+
+MAX_GROUP_SIZE = 20
+
+
+def book_group(citizen, items):
+    """
+    Book every item for citizen, or none of them.
+
+    items are dicts with service (id), slot_id or datetime, priority and
+    notes; a slot given by datetime is materialized from the service's
+    opening hours if needed. Raises ValueError if a slot is unknown,
+    belongs to another service, is blocked or has no room left. Returns the
+    appointments in item order.
+    """
+    from .tasks import complete_group_booking
+
+    by_id = ServiceSlot.objects.in_bulk({item['slot_id'] for item in items if 'slot_id' in item})
+    by_datetime = ServiceSlot.for_booking_many(
+        (item['service'], item['datetime']) for item in items if 'slot_id' not in item
+    )
+    item_slots = []
+    for item in items:
+        if 'slot_id' in item:
+            slot = by_id.get(item['slot_id'])
+        else:
+            slot = by_datetime.get((item['service'], item['datetime']))
+        if slot is None or slot.service_id != item['service']:
+            raise ValueError(f"Invalid time slot selected: {item.get('slot_id', item.get('datetime'))}.")
+        item_slots.append(slot)
+    # One instance per slot, so the Counter adds up repeated slots
+    unique = {slot.pk: slot for slot in item_slots}
+    item_slots = [unique[slot.pk] for slot in item_slots]
+    needed = Counter(item_slots)
+    services = Service.objects.in_bulk({slot.service_id for slot in item_slots})
+
+    with transaction.atomic():
+        if not ServiceSlot.reserve_many(needed):
+            raise ValueError("One or more time slots are fully booked or not available.")
+
+        for attempt in range(TOKEN_ATTEMPTS):
+            codes = Appointment.generate_token_codes(len(items))
+            try:
+                with transaction.atomic():
+                    appointments = Appointment.objects.bulk_create([
+                        Appointment(
+                            citizen=citizen,
+                            service=services[slot.service_id],
+                            slot=slot,
+                            appointment_datetime=slot.datetime,
+                            token_code=code,
+                            priority=item.get('priority', Appointment.Priority.NORMAL),
+                            notes=item.get('notes', ''),
+                        )
+                        for item, slot, code in zip(items, item_slots, codes)
+                    ])
+                break
+            except IntegrityError:
+                # A code handed out twice (see apps.appointments.tokens): retry with a fresh block
+                if attempt == TOKEN_ATTEMPTS - 1 or not Appointment.objects.filter(token_code__in=codes).exists():
+                    raise
+                discard_block()
+        counters.record_many([(appointment.counter_state(), 1) for appointment in appointments])
+
+        # Predicted after counting, so each prediction sees the whole group in the queue
+        predictions = predict_wait_minutes_batch(appointments)
+        for appointment, (minutes, version) in zip(appointments, predictions):
+            appointment.predicted_wait_minutes = minutes
+            appointment.prediction_model_version = version
+        Appointment.objects.bulk_update(appointments, ['predicted_wait_minutes', 'prediction_model_version'])
+
+        for appointment in appointments:
+            change = appointment.change_summary(previous_status=None)
+            transaction.on_commit(lambda change=change: hooks.appointment_saved(change))
+        appointment_ids = [str(appointment.id) for appointment in appointments]
+        transaction.on_commit(lambda: complete_group_booking.delay(appointment_ids))
+
+    return appointments
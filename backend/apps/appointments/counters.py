@@ -0,0 +1,197 @@
+# apps/appointments/counters.py
+"""
+Queue counters and live queue versions, kept in step with appointment writes.
+
+Appointment.save() and delete() record every change. Writes that bypass
+them, QuerySet.update() and bulk_create/bulk_update/delete on appointments,
+must call record_many() (and bump_queue_versions() for live queues) in the
+same transaction when they add or remove appointments or change their
+service, appointment_datetime or status; otherwise the counters drift
+until reconcile_queue_counters corrects them. Bulk writes of other fields
+(predictions, reminder and QR bookkeeping) need nothing.
+"""
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+from .models import Appointment, QueueCounter, QueueVersion
+
+# QueueCounter columns, one per Appointment.Status
+COUNT_FIELDS = ['scheduled', 'waiting', 'in_progress', 'completed', 'cancelled', 'no_show']
+
+# Statuses that make up the waiting line for predictions
+QUEUED_FIELDS = ('scheduled', 'waiting')
+
+# Statuses held by the live queues of the queue engine
+LIVE_STATUSES = (Appointment.Status.WAITING, Appointment.Status.IN_PROGRESS)
+
+
+def status_field(status):
+    """QueueCounter column holding the count for an Appointment.Status value"""
+    return status.lower()
+
+
+def expected_counts(appointments):
+    """
+    Counts per (service_id, local date, hour) including WHOLE_DAY totals,
+    recounted from an Appointment queryset (also a migration's historical model)
+    """
+    rows = appointments.annotate(
+        day=TruncDate('appointment_datetime'),
+        hour=ExtractHour('appointment_datetime'),
+    ).values('service_id', 'day', 'hour', 'status').annotate(total=Count('id')).order_by()
+
+    expected = {}
+    for row in rows.iterator():
+        field = status_field(row['status'])
+        for hour in (row['hour'], QueueCounter.WHOLE_DAY):
+            counts = expected.setdefault((row['service_id'], row['day'], hour), dict.fromkeys(COUNT_FIELDS, 0))
+            counts[field] += row['total']
+    return expected
+
+
+def bucket_for(appointment_datetime):
+    """(local date, local hour) bucket of an appointment time"""
+    local_dt = timezone.localtime(appointment_datetime)
+    return local_dt.date(), local_dt.hour
+
+
+def _ensure_rows(keys):
+    """Create missing day and hour rows for (service_id, date, hour) keys"""
+    rows = []
+    for service_id, date, hour in keys:
+        rows.append(QueueCounter(service_id=service_id, date=date, hour=QueueCounter.WHOLE_DAY))
+        rows.append(QueueCounter(service_id=service_id, date=date, hour=hour))
+    QueueCounter.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def _apply(service_id, date, hours, deltas):
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if updates:
+        QueueCounter.objects.filter(service_id=service_id, date=date, hour__in=hours).update(**updates)
+
+
+def record_change(previous, current):
+    """
+    Move one appointment between counter buckets.
+
+    previous and current are (service_id, appointment_datetime, status)
+    tuples, or None for a newly created / deleted appointment. Must run in
+    the same transaction as the appointment write.
+    """
+    if previous == current:
+        return
+
+    changes = []
+    if previous is not None:
+        changes.append((previous, -1))
+    if current is not None:
+        changes.append((current, 1))
+    record_many(changes)
+
+
+def record_many(changes):
+    """
+    Apply ((service_id, appointment_datetime, status), delta) changes.
+
+    Changes falling in the same bucket are merged, so a bulk insert of a
+    day's appointments costs one insert plus one update per hour bucket.
+    """
+    per_bucket = {}
+    for (service_id, appointment_datetime, status), delta in changes:
+        date, hour = bucket_for(appointment_datetime)
+        deltas = per_bucket.setdefault((service_id, date, hour), {})
+        field = status_field(status)
+        deltas[field] = deltas.get(field, 0) + delta
+
+    if not per_bucket:
+        return
+    _ensure_rows(per_bucket)
+
+    if len(per_bucket) == 1:
+        # Common case, one appointment: update the day and hour rows together
+        (service_id, date, hour), deltas = next(iter(per_bucket.items()))
+        _apply(service_id, date, [QueueCounter.WHOLE_DAY, hour], deltas)
+        return
+
+    # Day totals are shared by every hour of the day; merge them first
+    per_day = {}
+    for (service_id, date, hour), deltas in per_bucket.items():
+        day_deltas = per_day.setdefault((service_id, date), {})
+        for field, delta in deltas.items():
+            day_deltas[field] = day_deltas.get(field, 0) + delta
+
+    for (service_id, date), deltas in per_day.items():
+        _apply(service_id, date, [QueueCounter.WHOLE_DAY], deltas)
+    for (service_id, date, hour), deltas in per_bucket.items():
+        _apply(service_id, date, [hour], deltas)
+
+
+def queue_length(service_id, date):
+    """SCHEDULED + WAITING appointments of a service on a local date"""
+    counter = QueueCounter.objects.filter(
+        service_id=service_id, date=date, hour=QueueCounter.WHOLE_DAY
+    ).values_list(*QUEUED_FIELDS).first()
+    return sum(counter) if counter else 0
+
+
+def queue_lengths(keys):
+    """SCHEDULED + WAITING counts for many (service_id, date) keys in one query"""
+    keys = set(keys)
+    if not keys:
+        return {}
+    rows = QueueCounter.objects.filter(
+        service_id__in={service_id for service_id, _ in keys},
+        date__in={date for _, date in keys},
+        hour=QueueCounter.WHOLE_DAY,
+    ).values_list('service_id', 'date', *QUEUED_FIELDS)
+    return {
+        (service_id, date): scheduled + waiting
+        for service_id, date, scheduled, waiting in rows
+        if (service_id, date) in keys
+    }
+
+
+def queued_around(service_id, appointment_datetime, hours=1):
+    """SCHEDULED + WAITING appointments in the hour buckets within +-hours"""
+    date, hour = bucket_for(appointment_datetime)
+    totals = QueueCounter.objects.filter(
+        service_id=service_id,
+        date=date,
+        hour__gte=max(0, hour - hours),
+        hour__lte=hour + hours,
+    ).aggregate(**{field: Sum(field) for field in QUEUED_FIELDS})
+    return sum(value or 0 for value in totals.values())
+
+
+def bump_queue_versions(service_ids):
+    """
+    Count a change to the live queues of service_ids; same transaction as
+    the write. Returns the new {service_id: version}.
+    """
+    service_ids = sorted(set(service_ids))
+    if not service_ids:
+        return {}
+    # Create missing rows first: an UPDATE after the insert (or after the
+    # concurrent insert it waited for) can never lose a bump
+    QueueVersion.objects.bulk_create(
+        [QueueVersion(service_id=service_id) for service_id in service_ids], ignore_conflicts=True
+    )
+    QueueVersion.objects.filter(service_id__in=service_ids).update(version=F('version') + 1)
+    return queue_versions(service_ids)
+
+
+def touch_live_queues(previous, current):
+    """
+    bump_queue_versions() for a write moving an appointment from previous
+    to current ((service_id, appointment_datetime, status) or None), when
+    it is in a live queue before or after. Priority edits of a live
+    appointment count as well. Returns the new versions.
+    """
+    return bump_queue_versions(
+        state[0] for state in (previous, current) if state is not None and state[2] in LIVE_STATUSES
+    )
+
+
+def queue_versions(service_ids):
+    """{service_id: version}; services that never had a live queue change are left out"""
+    return dict(QueueVersion.objects.filter(service_id__in=service_ids).values_list('service_id', 'version'))
@@ -0,0 +1,100 @@
+# apps/appointments/events.py
+"""
+Live queue events shared through the Django cache.
+
+Every WAITING / IN_PROGRESS transition is appended to a short log: a
+sequence number incremented with cache.incr() and one key per event that
+expires after EVENT_TTL seconds. Stream subscribers in any process poll
+the sequence number and read only the events they have not seen, so the
+database is not touched per display.
+"""
+from django.core.cache import cache
+from .models import Appointment
+
+SEQUENCE_KEY = 'queue-events:seq'
+EVENT_KEY = 'queue-events:{}'
+EVENT_TTL = 600
+
+# A subscriber further behind than this gets a resync instead of a replay
+MAX_REPLAY = 500
+
+LIVE_STATUSES = (Appointment.Status.WAITING, Appointment.Status.IN_PROGRESS)
+
+# Event type by the status an appointment moved to
+EVENT_TYPES = {
+    Appointment.Status.WAITING: 'enqueued',
+    Appointment.Status.IN_PROGRESS: 'called',
+    Appointment.Status.COMPLETED: 'completed',
+    Appointment.Status.CANCELLED: 'cancelled',
+    Appointment.Status.NO_SHOW: 'cancelled',
+}
+
+
+def current_sequence():
+    return cache.get(SEQUENCE_KEY, 0)
+
+
+def _next_sequence():
+    try:
+        return cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        # Key missing (first event or cache restarted)
+        cache.add(SEQUENCE_KEY, 0, timeout=None)
+        return cache.incr(SEQUENCE_KEY)
+
+
+def publish_change(change):
+    """Publish a queue event for a committed appointment change, if it affects a live queue"""
+    status = change['status']
+    previous_status = change['previous_status']
+    if status == previous_status:
+        return None
+    if status not in LIVE_STATUSES and previous_status not in LIVE_STATUSES:
+        return None
+
+    event = {
+        'type': EVENT_TYPES.get(status, 'removed'),
+        'service_id': change['service_id'],
+        'appointment_id': str(change['appointment_id']),
+        'token_code': change['token_code'],
+        'priority': change['priority'],
+        'status': status,
+        'previous_status': previous_status,
+        'counter': change['counter'],
+    }
+    try:
+        event['seq'] = _next_sequence()
+        cache.set(EVENT_KEY.format(event['seq']), event, EVENT_TTL)
+    except Exception as e:
+        # Displays recover through a resync; never fail the status change
+        print(f"Error publishing queue event: {e}")
+        return None
+    return event
+
+
+def read_since(sequence):
+    """
+    Events after sequence, in order, as (events, last_sequence).
+
+    Returns (None, last_sequence) when the subscriber is too far behind or
+    events have expired, meaning it should reload a snapshot. Reading stops
+    at the first event not yet visible (published concurrently), so it will
+    be picked up on the next call.
+    """
+    last = current_sequence()
+    if last <= sequence:
+        return [], sequence
+    if last - sequence > MAX_REPLAY:
+        return None, last
+
+    keys = [EVENT_KEY.format(n) for n in range(sequence + 1, last + 1)]
+    found = cache.get_many(keys)
+    events = []
+    for key in keys:
+        event = found.get(key)
+        if event is None:
+            break
+        events.append(event)
+    if events:
+        return events, events[-1]['seq']
+    return [], sequence
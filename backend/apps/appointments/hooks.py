@@ -0,0 +1,40 @@
+# apps/appointments/hooks.py
+# Work that follows a committed appointment change. Each function receives
+# the dict built by Appointment.change_summary().
+from django.utils import timezone
+from . import availability, events, versions
+from .queue_engine import queue_engine
+
+
+def appointment_saved(change):
+    queue_engine.update(
+        change['appointment_id'],
+        change['service_id'],
+        change['priority'],
+        change['appointment_datetime'],
+        change['status'],
+        change['queue_version'],
+    )
+    events.publish_change(change)
+    if _affects_queue(change):
+        versions.bump_queue(change['service_id'])
+
+
+def appointment_deleted(change):
+    queue_engine.remove(change['appointment_id'], change['service_id'], change['queue_version'])
+    events.publish_change(dict(change, status=None))
+    if _affects_queue(change):
+        versions.bump_queue(change['service_id'])
+
+
+def slot_changed(service_id, slot_datetime):
+    availability.invalidate(service_id, timezone.localtime(slot_datetime).date())
+    versions.bump_slots(service_id, slot_datetime)
+
+
+def opening_hours_changed(service_id):
+    versions.bump(versions.template_key(service_id))
+
+
+def _affects_queue(change):
+    return change['status'] in events.LIVE_STATUSES or change['previous_status'] in events.LIVE_STATUSES
@@ -0,0 +1,39 @@
+# apps/appointments/management/commands/benchmark_token_codes.py
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from apps.appointments.tokens import SPACE, format_code, get_permutation, parse_code
+
+class Command(BaseCommand):
+    help = 'Generate token codes from consecutive counters, check they are unique and time it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2_000_000)
+        parser.add_argument('--start', type=int, default=0, help='First counter value')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        start = options['start']
+        permutation = get_permutation()
+
+        values = np.empty(count, dtype=np.int64)
+        started = time.perf_counter()
+        for i, number in enumerate(range(start, start + count)):
+            values[i] = permutation.permute(number % SPACE)
+        permute_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        codes = [format_code(int(value)) for value in values[:min(count, 100_000)]]
+        format_elapsed = (time.perf_counter() - started) / max(len(codes), 1) * count
+
+        unique = len(np.unique(values))
+        self.stdout.write(f'{count:,} codes: permutation {permute_elapsed:.2f}s '
+                          f'({count / permute_elapsed:,.0f} codes/s), formatting ~{format_elapsed:.2f}s')
+        self.stdout.write(f'Sample: {", ".join(codes[:5])}')
+
+        if unique != count:
+            raise CommandError(f'{count - unique} duplicate codes')
+        for number, code in zip(range(start, start + len(codes)), codes):
+            if permutation.invert(parse_code(code)) != number % SPACE:
+                raise CommandError(f'Code {code} does not map back to counter {number}')
+        self.stdout.write(self.style.SUCCESS('All codes unique and reversible'))
@@ -0,0 +1,25 @@
+# apps/appointments/management/commands/drain_outbox.py
+from django.core.management.base import BaseCommand
+from apps.appointments import outbox
+from apps.appointments.models import Notification
+
+class Command(BaseCommand):
+    help = 'Send pending outbox notifications in batches, or requeue dead-lettered ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--rate-limit', type=int, default=None, help='Messages per minute (default: NOTIFICATION_RATE_LIMIT)')
+        parser.add_argument('--requeue-dead', action='store_true', help='Give dead notifications new attempts first')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            self.stdout.write(f'Requeued {outbox.requeue_dead()} dead notifications')
+
+        sent, failed, dead = outbox.drain(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            rate_limit=options['rate_limit'],
+        )
+        pending = Notification.objects.filter(status=Notification.Status.PENDING).count()
+        self.stdout.write(f'Sent {sent}, failed {failed} ({dead} dead-lettered), {pending} still pending')
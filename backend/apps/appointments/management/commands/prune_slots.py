@@ -0,0 +1,51 @@
+# apps/appointments/management/commands/prune_slots.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.services.models import OpeningHours
+from apps.appointments.models import ServiceSlot
+
+class Command(BaseCommand):
+    help = (
+        'Delete pre-generated slots that nobody booked or held and that match their service\'s opening hours; '
+        'such slots are served virtually from the opening hours instead'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Count redundant slots without deleting them')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        hours = {}
+        for template in OpeningHours.objects.all():
+            hours.setdefault(template.service_id, []).append(template)
+
+        untouched = ServiceSlot.objects.filter(
+            current_bookings=0, is_available=True, appointments__isnull=True, holds__isnull=True
+        )
+        last_id = 0
+        scanned = redundant_total = 0
+        while True:
+            with transaction.atomic():
+                # Locked so a booking cannot take one of these slots while it is being deleted
+                batch = list(
+                    untouched.filter(id__gt=last_id)
+                    .order_by('id')
+                    .select_for_update(skip_locked=True, of=('self',))
+                    .values_list('id', 'service_id', 'datetime', 'max_capacity')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                # Only slots the template would recreate exactly; anything else was set up by hand
+                redundant = [
+                    slot_id for slot_id, service_id, slot_datetime, max_capacity in batch
+                    if OpeningHours.capacity_at(hours.get(service_id, ()), slot_datetime) == max_capacity
+                ]
+                if redundant and not options['dry_run']:
+                    ServiceSlot.objects.filter(id__in=redundant).delete()
+            scanned += len(batch)
+            redundant_total += len(redundant)
+            self.stdout.write(f'Scanned {scanned} untouched slots, {redundant_total} redundant')
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {redundant_total} of {scanned} untouched slots'))
@@ -0,0 +1,32 @@
+# apps/appointments/management/commands/purge_qr_files.py
+from django.core.management.base import BaseCommand
+from apps.appointments.models import Appointment
+
+class Command(BaseCommand):
+    help = 'Delete QR code PNGs stored by older versions; QR codes are now rendered on demand'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Count stored files without deleting them')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        stored = Appointment.objects.exclude(qr_code__isnull=True).exclude(qr_code='')
+        total = stored.count()
+        if options['dry_run']:
+            self.stdout.write(f'{total} appointments have a stored QR code')
+            return
+
+        storage = Appointment._meta.get_field('qr_code').storage
+        deleted = 0
+        while True:
+            batch = list(stored.values_list('id', 'qr_code')[:options['batch_size']])
+            if not batch:
+                break
+            for _, name in batch:
+                storage.delete(name)
+            # Clear the field with queryset.update(): nothing else about the appointment changes
+            Appointment.objects.filter(id__in=[appointment_id for appointment_id, _ in batch]).update(qr_code=None)
+            deleted += len(batch)
+            self.stdout.write(f'Deleted {deleted}/{total} QR files')
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stored QR codes'))
@@ -0,0 +1,70 @@
+# apps/appointments/management/commands/reconcile_queue_counters.py
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from apps.appointments.counters import COUNT_FIELDS, expected_counts
+from apps.appointments.models import Appointment, QueueCounter
+
+class Command(BaseCommand):
+    help = (
+        'Recount queue counters from the Appointment table, report drift and correct the drifted rows; '
+        'appointment writes wait while it runs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without rewriting counters')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.reconcile(options)
+            return
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Counters change in the same transaction as the appointment
+                # they count; blocking appointment writes (reads go on) until
+                # commit keeps the recount and the corrections consistent
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'LOCK TABLE {connection.ops.quote_name(Appointment._meta.db_table)} IN SHARE MODE'
+                    )
+            self.reconcile(options)
+
+    def reconcile(self, options):
+        expected = expected_counts(Appointment.objects.all())
+        actual = {
+            (row['service_id'], row['date'], row['hour']): {field: row[field] for field in COUNT_FIELDS}
+            for row in QueueCounter.objects.values('service_id', 'date', 'hour', *COUNT_FIELDS).iterator()
+        }
+
+        empty = dict.fromkeys(COUNT_FIELDS, 0)
+        drifted = []
+        total_drift = 0
+        for key in expected.keys() | actual.keys():
+            want = expected.get(key, empty)
+            have = actual.get(key, empty)
+            drift = sum(abs(want[field] - have[field]) for field in COUNT_FIELDS)
+            if drift:
+                drifted.append((key, want, have))
+                total_drift += drift
+
+        for (service_id, date, hour), want, have in sorted(drifted, key=lambda d: d[0])[:10]:
+            bucket = 'day' if hour == QueueCounter.WHOLE_DAY else f'{hour:02d}h'
+            changes = ', '.join(
+                f'{field} {have[field]}->{want[field]}' for field in COUNT_FIELDS if want[field] != have[field]
+            )
+            self.stdout.write(f'  service {service_id} {date} {bucket}: {changes}')
+
+        self.stdout.write(f'{len(drifted)} of {len(expected)} counter rows drifted (total difference {total_drift})')
+
+        if options['dry_run']:
+            return
+
+        missing = []
+        for (service_id, date, hour), want, have in drifted:
+            if (service_id, date, hour) in actual:
+                QueueCounter.objects.filter(service_id=service_id, date=date, hour=hour).update(**want)
+            else:
+                missing.append(QueueCounter(service_id=service_id, date=date, hour=hour, **want))
+        QueueCounter.objects.bulk_create(missing, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Corrected {len(drifted)} counter rows'))
@@ -0,0 +1,88 @@
+# apps/appointments/management/commands/stress_call_next.py
+import threading
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+from apps.services.models import Service
+from apps.appointments import counters
+from apps.appointments.models import Appointment
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = 'Check that concurrent counters calling the next citizen never serve anyone twice (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=2000)
+        parser.add_argument('--counters', type=int, default=16, help='Concurrent counters (threads)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('This check needs PostgreSQL (row locks with SKIP LOCKED)')
+
+        total = options['appointments']
+        service = Service.objects.create(
+            name='Call-next stress test', department='Benchmark', description='Temporary', is_active=False,
+        )
+        citizen = User.objects.create_user(
+            email=f'call-next-{service.id}@example.com', username=f'call-next-{service.id}', password=None,
+        )
+        try:
+            start = timezone.now()
+            priorities = [choice[0] for choice in Appointment.Priority.choices]
+            appointments = Appointment.objects.bulk_create([
+                Appointment(
+                    citizen=citizen,
+                    service=service,
+                    token_code=f'S{service.id % 1000:03d}{i:06d}',
+                    appointment_datetime=start + timedelta(seconds=i),
+                    priority=priorities[i % len(priorities)],
+                    status=Appointment.Status.WAITING,
+                )
+                for i in range(total)
+            ])
+            counters.record_many([(a.counter_state(), 1) for a in appointments])
+
+            claimed = [[] for _ in range(options['counters'])]
+            errors = []
+
+            def work(counter):
+                try:
+                    while True:
+                        appointment = Appointment.claim_next(service.id, counter + 1)
+                        if appointment is None:
+                            return
+                        claimed[counter].append(appointment.id)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    connections.close_all()
+
+            threads = [threading.Thread(target=work, args=(c,)) for c in range(options['counters'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            if errors:
+                raise CommandError(f'{len(errors)} counters failed: {errors[0]}')
+
+            all_claims = [appointment_id for ids in claimed for appointment_id in ids]
+            unique = set(all_claims)
+            in_progress = Appointment.objects.filter(service=service, status=Appointment.Status.IN_PROGRESS).count()
+
+            self.stdout.write(f'{len(all_claims)} claims by {options["counters"]} counters in {elapsed:.2f}s '
+                              f'({len(all_claims) / elapsed:,.0f} claims/s)')
+            if len(all_claims) != len(unique):
+                raise CommandError(f'{len(all_claims) - len(unique)} appointments were served twice')
+            if len(unique) != total or in_progress != total:
+                raise CommandError(f'Expected {total} claims, got {len(unique)} ({in_progress} IN_PROGRESS)')
+            self.stdout.write(self.style.SUCCESS('No appointment was served twice'))
+        finally:
+            service.delete()
+            citizen.delete()
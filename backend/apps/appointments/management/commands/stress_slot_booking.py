@@ -0,0 +1,85 @@
+# apps/appointments/management/commands/stress_slot_booking.py
+import threading
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+from apps.services.models import Service
+from apps.appointments.models import Appointment, ServiceSlot
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = 'Check that concurrent bookings never overbook a slot (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=5000, help='Booking attempts in total')
+        parser.add_argument('--capacity', type=int, default=1000, help='Capacity of the contended slot')
+        parser.add_argument('--clients', type=int, default=32, help='Concurrent clients (threads)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('This check needs PostgreSQL (concurrent row updates)')
+
+        total = options['bookings']
+        capacity = options['capacity']
+        clients = options['clients']
+        service = Service.objects.create(
+            name='Slot booking stress test', department='Benchmark', description='Temporary', is_active=False,
+        )
+        citizen = User.objects.create_user(
+            email=f'slot-booking-{service.id}@example.com', username=f'slot-booking-{service.id}', password=None,
+        )
+        try:
+            slot = ServiceSlot.objects.create(
+                service=service,
+                datetime=timezone.now() + timedelta(days=1),
+                max_capacity=capacity,
+            )
+
+            booked = [0] * clients
+            rejected = [0] * clients
+            errors = []
+
+            def work(client):
+                try:
+                    for _ in range(client, total, clients):
+                        try:
+                            Appointment(citizen=citizen, service=service, slot=slot).save()
+                            booked[client] += 1
+                        except ValueError:
+                            rejected[client] += 1
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    connections.close_all()
+
+            threads = [threading.Thread(target=work, args=(c,)) for c in range(clients)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            if errors:
+                raise CommandError(f'{len(errors)} clients failed: {errors[0]}')
+
+            slot.refresh_from_db()
+            stored = Appointment.objects.filter(slot=slot).count()
+            expected = min(total, capacity)
+            self.stdout.write(f'{total} booking attempts by {clients} clients in {elapsed:.2f}s '
+                              f'({total / elapsed:,.0f} attempts/s): {sum(booked)} booked, {sum(rejected)} rejected')
+            if sum(booked) != expected or stored != expected or slot.current_bookings != expected:
+                raise CommandError(
+                    f'Expected {expected} bookings, got {sum(booked)} '
+                    f'({stored} stored, current_bookings={slot.current_bookings})'
+                )
+            if slot.is_available != (expected < capacity):
+                raise CommandError(f'is_available is {slot.is_available} with {slot.current_bookings}/{capacity} booked')
+            self.stdout.write(self.style.SUCCESS('The slot was never overbooked'))
+        finally:
+            service.delete()
+            citizen.delete()
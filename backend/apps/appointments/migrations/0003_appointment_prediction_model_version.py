@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_appointment_qr_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='prediction_model_version',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0001_initial'),
+        ('appointments', '0003_appointment_prediction_model_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hour', models.SmallIntegerField(default=-1)),
+                ('scheduled', models.IntegerField(default=0)),
+                ('waiting', models.IntegerField(default=0)),
+                ('in_progress', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('no_show', models.IntegerField(default=0)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_counters', to='services.service')),
+            ],
+            options={
+                'unique_together': {('service', 'date', 'hour')},
+            },
+        ),
+    ]
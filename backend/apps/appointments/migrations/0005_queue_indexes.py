@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_queuecounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['service', 'status'], name='appointment_service_status'),
+        ),
+        migrations.AddIndex(
+            model_name='queuecounter',
+            index=models.Index(condition=models.Q(('hour', -1), models.Q(('waiting__gt', 0), ('in_progress__gt', 0), _connector='OR')), fields=['service'], name='queuecounter_live_day'),
+        ),
+    ]
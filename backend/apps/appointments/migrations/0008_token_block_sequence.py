@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:20
+
+from django.db import migrations
+
+
+def create_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE SEQUENCE IF NOT EXISTS appointments_token_block_seq')
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP SEQUENCE IF EXISTS appointments_token_block_seq')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_slothold'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_token_block_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='confirmation_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0002_openinghours'),
+        ('appointments', '0012_appointment_datetime_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueVersion',
+            fields=[
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='queue_version', serialize=False, to='services.service')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:05
+
+from django.db import migrations
+
+
+def backfill_counters(apps, schema_editor):
+    # Counters only follow writes made after 0004; recount what was booked
+    # before (or has drifted since) so they never start below the real queue
+    from apps.appointments.counters import expected_counts
+
+    Appointment = apps.get_model('appointments', 'Appointment')
+    QueueCounter = apps.get_model('appointments', 'QueueCounter')
+    QueueCounter.objects.all().delete()
+    QueueCounter.objects.bulk_create(
+        [
+            QueueCounter(service_id=service_id, date=date, hour=hour, **counts)
+            for (service_id, date, hour), counts in expected_counts(Appointment.objects.all()).items()
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0014_tokenblock'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,19 @@
 # apps/appointments/models.py
 import uuid
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Greatest
+from django.db.models.lookups import LessThan, LessThanOrEqual
 from django.contrib.auth import get_user_model
-from apps.services.models import Service
+from django.utils import timezone
+from apps.services.models import OpeningHours, Service
 
 User = get_user_model()
 
+
+class SlotUnavailable(ValueError):
+    """A booking found its slot full or blocked"""
+
+
 class ServiceSlot(models.Model):
     service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='slots')
     datetime = models.DateTimeField()
@@ -23,6 +31,170 @@ class ServiceSlot(models.Model):
     def is_full(self):
         return self.current_bookings >= self.max_capacity
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._notify_changed()
+
+    @classmethod
+    def for_booking(cls, service_id, slot_datetime):
+        """The slot of the service starting at slot_datetime, or None; see for_booking_many()"""
+        return cls.for_booking_many([(service_id, slot_datetime)]).get((service_id, slot_datetime))
+
+    @classmethod
+    def for_booking_many(cls, keys):
+        """
+        The slots for (service_id, datetime) keys, as a dict by key.
+
+        A slot that only exists in its service's opening hours is
+        materialized here with the template's capacity; concurrent callers
+        end up with the same row. Keys with neither a row nor a template
+        slot are left out. At most four queries, whatever the number of keys.
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        lookup = models.Q()
+        for service_id, slot_datetime in keys:
+            lookup |= models.Q(service_id=service_id, datetime=slot_datetime)
+
+        def fetch():
+            return {(slot.service_id, slot.datetime): slot for slot in cls.objects.filter(lookup)}
+
+        slots = fetch()
+        missing = keys - slots.keys()
+        if not missing:
+            return slots
+        hours = {}
+        for template in OpeningHours.objects.filter(service_id__in={service_id for service_id, _ in missing}):
+            hours.setdefault(template.service_id, []).append(template)
+        new_slots = []
+        for service_id, slot_datetime in missing:
+            capacity = OpeningHours.capacity_at(hours.get(service_id, ()), slot_datetime)
+            if capacity is not None:
+                new_slots.append(
+                    cls(service_id=service_id, datetime=slot_datetime, max_capacity=capacity, is_available=True)
+                )
+        if not new_slots:
+            return slots
+        # No save(): an untouched materialized slot looks the same as the virtual one
+        cls.objects.bulk_create(new_slots, ignore_conflicts=True)
+        return fetch()
+
+    def reserve(self, count=1):
+        """
+        Take count units of capacity with a single conditional UPDATE.
+
+        The row is only changed while the slot is available and
+        current_bookings + count still fits max_capacity, so concurrent
+        bookings can never overbook it and a blocked slot stays blocked.
+        Taking the last unit marks the slot unavailable. Expired slot holds
+        still counted against the slot are released and the update retried
+        once. Returns True if the capacity was taken.
+        """
+        if self._take(count):
+            return True
+        if not SlotHold.release_expired(slot_ids=[self.pk]):
+            return False
+        self.refresh_from_db(fields=['current_bookings', 'is_available'])
+        return self._take(count)
+
+    def _take(self, count):
+        updated = ServiceSlot.objects.filter(
+            pk=self.pk,
+            is_available=True,
+            current_bookings__lte=models.F('max_capacity') - count,
+        ).update(
+            current_bookings=models.F('current_bookings') + count,
+            # SET expressions see the row before the update
+            is_available=models.Case(
+                models.When(current_bookings__lt=models.F('max_capacity') - count, then=models.Value(True)),
+                default=models.Value(False),
+            ),
+        )
+        if updated:
+            self.current_bookings += count
+            self.is_available = self.current_bookings < self.max_capacity
+            self._notify_changed()
+        return bool(updated)
+
+    @classmethod
+    def reserve_many(cls, counts):
+        """
+        Take capacity on several slots at once, all or nothing.
+
+        counts maps ServiceSlot instances to the units needed. One UPDATE
+        covers every slot; if any of them is blocked or lacks room nothing
+        is changed and False is returned. As in reserve(), expired holds on
+        the slots are released first if they are in the way.
+        """
+        if cls._take_many(counts):
+            return True
+        if not SlotHold.release_expired(slot_ids=[slot.pk for slot in counts]):
+            return False
+        stored = cls.objects.in_bulk([slot.pk for slot in counts])
+        for slot in counts:
+            if slot.pk in stored:
+                slot.current_bookings = stored[slot.pk].current_bookings
+                slot.is_available = stored[slot.pk].is_available
+        return cls._take_many(counts)
+
+    @classmethod
+    def _take_many(cls, counts):
+        needed = models.Case(
+            *[models.When(pk=slot.pk, then=models.Value(count)) for slot, count in counts.items()],
+            default=models.Value(0),
+        )
+        with transaction.atomic():
+            updated = cls.objects.filter(
+                LessThanOrEqual(models.F('current_bookings') + needed, models.F('max_capacity')),
+                pk__in=[slot.pk for slot in counts],
+                is_available=True,
+            ).update(
+                current_bookings=models.F('current_bookings') + needed,
+                is_available=models.Case(
+                    models.When(LessThan(models.F('current_bookings') + needed, models.F('max_capacity')),
+                                then=models.Value(True)),
+                    default=models.Value(False),
+                ),
+            )
+            if updated != len(counts):
+                transaction.set_rollback(True)
+                return False
+
+        for slot, count in counts.items():
+            slot.current_bookings += count
+            slot.is_available = slot.current_bookings < slot.max_capacity
+            slot._notify_changed()
+        return True
+
+    def release(self, count=1):
+        """
+        Give back count units of capacity.
+
+        A slot that was closed because it was full opens again. One that is
+        unavailable with room left was blocked by hand and stays blocked;
+        a blocked slot that was also full cannot be told apart from a full
+        one and is reopened.
+        """
+        ServiceSlot.objects.filter(pk=self.pk).update(
+            current_bookings=Greatest(models.F('current_bookings') - count, models.Value(0)),
+            # SET expressions see the row before the update
+            is_available=models.Case(
+                models.When(current_bookings__gte=models.F('max_capacity'), then=models.Value(True)),
+                default=models.F('is_available'),
+            ),
+        )
+        if self.is_full():
+            self.is_available = True
+        self.current_bookings = max(self.current_bookings - count, 0)
+        self._notify_changed()
+
+    def _notify_changed(self):
+        from . import hooks
+
+        service_id, slot_datetime = self.service_id, self.datetime
+        transaction.on_commit(lambda: hooks.slot_changed(service_id, slot_datetime))
+
 
 class Appointment(models.Model):
     class Priority(models.TextChoices):
@@ -47,50 +219,418 @@ class Appointment(models.Model):
     priority = models.CharField(max_length=10, choices=Priority.choices, default=Priority.NORMAL)
     status = models.CharField(max_length=15, choices=Status.choices, default=Status.SCHEDULED)
     predicted_wait_minutes = models.IntegerField(default=0)
+    prediction_model_version = models.CharField(max_length=20, blank=True)
     actual_wait_minutes = models.IntegerField(null=True, blank=True)
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     slot = models.ForeignKey(ServiceSlot, on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments')
+    counter = models.PositiveSmallIntegerField(null=True, blank=True)
+    called_at = models.DateTimeField(null=True, blank=True)
+    # No longer written: QR codes are rendered on demand (see qr.py); purge_qr_files clears old ones
     qr_code = models.ImageField(upload_to="qrcodes/", null=True, blank=True)
+    confirmation_sent_at = models.DateTimeField(null=True, blank=True)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['service', 'status'], name='appointment_service_status'),
+            # Day ranges, as read by the ops analytics
+            models.Index(fields=['appointment_datetime'], name='appointment_datetime'),
+            # Upcoming appointments still owed a reminder, read by reminders.queue_due_reminders()
+            models.Index(
+                fields=['appointment_datetime'],
+                condition=models.Q(status='SCHEDULED', reminder_sent_at__isnull=True),
+                name='appointment_reminder_due',
+            ),
+        ]
 
     def __str__(self):
         return f"#{self.token_code} - {self.citizen.get_full_name()} ({self.service.name})"
 
-    def save(self, *args, **kwargs):
-    # Generate token if not already set
-     if not self.token_code:
-        self.token_code = self.generate_token_code()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred fields are left out (None) rather than loaded here
+        instance._counted_state = (
+            instance.__dict__.get('service_id'),
+            instance.__dict__.get('appointment_datetime'),
+            instance.__dict__.get('status'),
+        )
+        return instance
 
-    # Link appointment time to slot if available
-     if self.slot:
-        self.appointment_datetime = self.slot.datetime
+    def counter_state(self):
+        """(service_id, appointment_datetime, status) as counted in QueueCounter"""
+        return (self.service_id, self.appointment_datetime, self.status)
 
-        # Prevent overbooking
-        if self.slot.is_full() and not self.pk:  # Only check when creating, not updating
-            raise ValueError("This slot is already full.")
+    def stored_counter_state(self):
+        """counter_state() as currently stored in the database, or None"""
+        return Appointment.objects.filter(pk=self.pk).values_list(
+            'service_id', 'appointment_datetime', 'status'
+        ).first()
 
-        # Update slot bookings
-        if not self.pk:  # New appointment
-            self.slot.current_bookings += 1
-            if self.slot.current_bookings >= self.slot.max_capacity:
-                self.slot.is_available = False
-            self.slot.save()
+    def save(self, *args, reserve_slot=True, **kwargs):
+        """
+        Save the appointment and keep slot capacity and queue counters in step.
 
-        super().save(*args, **kwargs)
+        A new (or un-cancelled) appointment with a slot takes one unit of
+        the slot's capacity through ServiceSlot.reserve() and raises
+        SlotUnavailable if the slot is full or blocked; cancelling gives it back. Pass
+        reserve_slot=False when the capacity was already taken (slot holds).
+        """
+        from . import counters, hooks, tokens
+
+        # Generate token if not already set
+        generated_token = not self.token_code
+        if generated_token:
+            self.token_code = self.generate_token_code()
+
+        # Link appointment time to slot if available
+        if self.slot:
+            self.appointment_datetime = self.slot.datetime
+
+        previous = None if self._state.adding else getattr(self, '_counted_state', None)
+        if not self._state.adding and (previous is None or None in previous):
+            # Loaded with deferred fields: read what is stored
+            previous = self.stored_counter_state()
+
+        held_slot = previous is not None and previous[2] != self.Status.CANCELLED
+        holds_slot = self.status != self.Status.CANCELLED
+        with transaction.atomic():
+            if self.slot and holds_slot and not held_slot and reserve_slot:
+                if not self.slot.reserve():
+                    self.slot.refresh_from_db(fields=['current_bookings', 'max_capacity', 'is_available'])
+                    if self.slot.is_full():
+                        raise SlotUnavailable("This time slot is already fully booked.")
+                    raise SlotUnavailable("This time slot is not available.")
+            elif self.slot and held_slot and not holds_slot:
+                self.slot.release()
+
+            if generated_token:
+                for attempt in range(tokens.TOKEN_ATTEMPTS):
+                    try:
+                        with transaction.atomic():
+                            super().save(*args, **kwargs)
+                        break
+                    except IntegrityError:
+                        taken = Appointment.objects.filter(token_code=self.token_code).exists()
+                        if not taken or attempt == tokens.TOKEN_ATTEMPTS - 1:
+                            raise
+                        tokens.discard_block()
+                        self.token_code = self.generate_token_code()
+            else:
+                super().save(*args, **kwargs)
+            counters.record_change(previous, self.counter_state())
+            queue_versions = counters.touch_live_queues(previous, self.counter_state())
+            change = self.change_summary(
+                previous_status=previous[2] if previous else None,
+                queue_version=queue_versions.get(self.service_id),
+            )
+            transaction.on_commit(lambda: hooks.appointment_saved(change))
+        self._counted_state = self.counter_state()
+
+    def delete(self, *args, **kwargs):
+        from . import counters, hooks
+
+        with transaction.atomic():
+            stored = self.stored_counter_state()
+            if self.slot and stored is not None and stored[2] != self.Status.CANCELLED:
+                self.slot.release()
+            counters.record_change(stored, None)
+            queue_versions = counters.touch_live_queues(stored, None)
+            change = self.change_summary(
+                previous_status=stored[2] if stored else None,
+                queue_version=queue_versions.get(stored[0]) if stored else None,
+            )
+            transaction.on_commit(lambda: hooks.appointment_deleted(change))
+            return super().delete(*args, **kwargs)
+
+    def change_summary(self, previous_status, queue_version=None):
+        """
+        Plain values describing this appointment for post-commit hooks.
+        queue_version is the service's QueueVersion after this write, if it bumped it.
+        """
+        return {
+            'appointment_id': self.pk,
+            'token_code': self.token_code,
+            'service_id': self.service_id,
+            'priority': self.priority,
+            'appointment_datetime': self.appointment_datetime,
+            'status': self.status,
+            'previous_status': previous_status,
+            'counter': self.counter,
+            'queue_version': queue_version,
+        }
+
+    @classmethod
+    def claim_next(cls, service_id, counter):
+        """
+        Atomically move the next WAITING appointment of a service to IN_PROGRESS.
+
+        The candidate row is locked with SELECT ... FOR UPDATE SKIP LOCKED,
+        so concurrent counters each get a different appointment instead of
+        waiting on (or double-serving) the same one. Returns the claimed
+        appointment, or None when nobody is waiting.
+        """
+        priority_rank = models.Case(
+            *[models.When(priority=priority, then=models.Value(rank)) for priority, rank in PRIORITY_RANK.items()],
+            default=models.Value(len(PRIORITY_RANK)),
+            output_field=models.IntegerField(),
+        )
+        with transaction.atomic():
+            appointment = cls.objects.select_for_update(skip_locked=True).filter(
+                service_id=service_id,
+                status=cls.Status.WAITING,
+            ).annotate(
+                priority_rank=priority_rank
+            ).order_by('priority_rank', 'appointment_datetime').first()
 
+            if appointment is None:
+                return None
+
+            appointment.status = cls.Status.IN_PROGRESS
+            appointment.counter = counter
+            appointment.called_at = timezone.now()
+            appointment.save()
+            return appointment
 
     def generate_token_code(self):
-        import random, string
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            if not Appointment.objects.filter(token_code=code).exists():
-                return code
+        from .tokens import next_token_code
+        return next_token_code()
+
+    @classmethod
+    def generate_token_codes(cls, count):
+        from .tokens import next_token_codes
+        return next_token_codes(count)
 
     @property
     def estimated_completion_time(self):
         from django.utils import timezone
-        return self.appointment_datetime + timezone.timedelta(minutes=self.predicted_wait_minutes)
\ No newline at end of file
+        return self.appointment_datetime + timezone.timedelta(minutes=self.predicted_wait_minutes)
+
+
+# Serving order of priorities, lower rank first
+PRIORITY_RANK = {
+    Appointment.Priority.EMERGENCY: 0,
+    Appointment.Priority.DISABLED: 1,
+    Appointment.Priority.ELDERLY: 2,
+    Appointment.Priority.NORMAL: 3,
+}
+
+
+class QueueCounter(models.Model):
+    """
+    Appointment counts per status for one service and day.
+
+    hour is the local hour bucket of appointment_datetime, or WHOLE_DAY for
+    the day total. Rows are kept up to date by Appointment.save/delete and
+    by bulk writes that call counters.record_many (see apps.appointments.counters),
+    and can be corrected with the reconcile_queue_counters command.
+    """
+    WHOLE_DAY = -1
+
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='queue_counters')
+    date = models.DateField()
+    hour = models.SmallIntegerField(default=WHOLE_DAY)
+    scheduled = models.IntegerField(default=0)
+    waiting = models.IntegerField(default=0)
+    in_progress = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    no_show = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['service', 'date', 'hour']
+        indexes = [
+            # Day rows of services with a live queue, read by the queue engine
+            models.Index(
+                fields=['service'],
+                condition=models.Q(hour=-1) & (models.Q(waiting__gt=0) | models.Q(in_progress__gt=0)),
+                name='queuecounter_live_day',
+            ),
+        ]
+
+    def __str__(self):
+        bucket = 'day' if self.hour == self.WHOLE_DAY else f'{self.hour:02d}h'
+        return f"{self.service_id} - {self.date} ({bucket})"
+
+    @property
+    def queued(self):
+        return self.scheduled + self.waiting
+
+
+class TokenBlock(models.Model):
+    """
+    Last block of token counter values handed out (apps.appointments.tokens).
+    A single row, used on databases without sequences.
+    """
+    ROW = 1
+
+    last = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"token block {self.last}"
+
+
+class QueueVersion(models.Model):
+    """
+    Change counter of one service's live queue (WAITING and IN_PROGRESS).
+
+    Bumped in the same transaction as every appointment write that puts
+    an appointment in or takes it out of the live queue, or edits one in
+    it, so per-process queues (queue_engine) can tell that another process
+    changed the queue even when the counts stay the same.
+    """
+    service = models.OneToOneField(Service, on_delete=models.CASCADE, primary_key=True, related_name='queue_version')
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.service_id} - v{self.version}"
+
+
+class SlotHold(models.Model):
+    """
+    A short reservation of one unit of a slot's capacity.
+
+    Placing a hold takes the capacity immediately, so a citizen who is
+    filling in the booking form cannot lose the slot at commit time.
+    Confirming turns the hold into an Appointment; an unconfirmed hold
+    gives its capacity back once expires_at has passed, either lazily when
+    a reservation finds the slot full (ServiceSlot.reserve/reserve_many) or
+    through release_expired() run periodically.
+    """
+    DEFAULT_SECONDS = 120
+    MAX_SECONDS = 600
+    MAX_PER_CITIZEN = 3
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    slot = models.ForeignKey(ServiceSlot, on_delete=models.CASCADE, related_name='holds')
+    citizen = models.ForeignKey(User, on_delete=models.CASCADE, related_name='slot_holds')
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['expires_at']
+
+    def __str__(self):
+        return f"{self.slot_id} held by {self.citizen_id} until {self.expires_at:%H:%M:%S}"
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+    @classmethod
+    def place(cls, slot, citizen, seconds=DEFAULT_SECONDS):
+        """Hold one unit of slot for seconds, or return None if the slot is full or blocked"""
+        with transaction.atomic():
+            if not slot.reserve():
+                return None
+            return cls.objects.create(
+                slot=slot,
+                citizen=citizen,
+                expires_at=timezone.now() + timezone.timedelta(seconds=seconds),
+            )
+
+    def confirm(self, **fields):
+        """
+        Turn the hold into an Appointment using the capacity it holds.
+
+        Raises ValueError if the hold has expired or was already used.
+        """
+        with transaction.atomic():
+            # Deleting first makes confirm, cancel and the sweeper mutually exclusive
+            deleted, _ = SlotHold.objects.filter(pk=self.pk, expires_at__gt=timezone.now()).delete()
+            if not deleted:
+                raise ValueError("This hold has expired.")
+            appointment = Appointment(
+                citizen_id=self.citizen_id,
+                service_id=self.slot.service_id,
+                slot=self.slot,
+                **fields
+            )
+            appointment.save(reserve_slot=False)
+        return appointment
+
+    def cancel(self):
+        """Give the held capacity back; returns False if the hold was already gone"""
+        with transaction.atomic():
+            deleted, _ = SlotHold.objects.filter(pk=self.pk).delete()
+            if deleted:
+                self.slot.release()
+        return bool(deleted)
+
+    @classmethod
+    def release_expired(cls, slot_ids=None, batch_size=500):
+        """
+        Delete up to batch_size expired holds and give their capacity back.
+
+        Expired rows are found through the expires_at index and locked with
+        SKIP LOCKED, so concurrent sweepers share the work instead of
+        waiting on each other. Returns the number of holds released.
+        """
+        from collections import Counter
+
+        with transaction.atomic():
+            expired = cls.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                expires_at__lte=timezone.now()
+            )
+            if slot_ids is not None:
+                expired = expired.filter(slot_id__in=slot_ids)
+            rows = list(expired.order_by('expires_at').values_list('id', 'slot_id')[:batch_size])
+            if not rows:
+                return 0
+
+            cls.objects.filter(pk__in=[hold_id for hold_id, _ in rows]).delete()
+            released = Counter(slot_id for _, slot_id in rows)
+            for slot_id, slot in ServiceSlot.objects.in_bulk(list(released)).items():
+                slot.release(released[slot_id])
+        return len(rows)
+
+
+class Notification(models.Model):
+    """
+    An email in the outbox.
+
+    Rows are written in the same transaction as the change they report
+    and sent later in batches by outbox.drain(). dedupe_key makes
+    enqueueing idempotent; a message that keeps failing ends up DEAD
+    after outbox.MAX_ATTEMPTS tries and stays for inspection.
+    """
+    class Kind(models.TextChoices):
+        CONFIRMATION = 'CONFIRMATION', 'Confirmation'
+        REMINDER = 'REMINDER', 'Reminder'
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        SENT = 'SENT', 'Sent'
+        DEAD = 'DEAD', 'Dead'
+
+    kind = models.CharField(max_length=15, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body_text = models.TextField()
+    body_html = models.TextField(blank=True)
+    # Appointments the message is about; their QR codes are attached if attach_qr
+    appointment_ids = models.JSONField(default=list, blank=True)
+    attach_qr = models.BooleanField(default=False)
+    dedupe_key = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='PENDING'),
+                name='notification_pending',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} to {self.to_email} ({self.status})"
@@ -0,0 +1,241 @@
+# apps/appointments/outbox.py
+"""
+Notification outbox: emails are stored as Notification rows and sent in
+batches over one SMTP connection.
+
+drain() claims due PENDING rows with SKIP LOCKED and leases them for
+LEASE_SECONDS, so several workers can drain side by side and a worker
+that dies only delays its batch; a batch that takes longer renews its
+lease as it goes. A refused message is retried on its own; a connection
+failure retries everything in the batch that was not sent yet. Retries
+back off exponentially and a message is dead-lettered (status DEAD)
+after MAX_ATTEMPTS tries.
+
+The sending rate (NOTIFICATION_RATE_LIMIT) is counted in the cache, so
+it holds across every worker and drain when the cache is shared.
+"""
+import smtplib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import models, transaction
+from django.utils import timezone
+from . import qr
+from .models import Appointment, Notification
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 6
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+LEASE_SECONDS = 300
+
+# Failures that concern one message; anything else is treated as a broken connection
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def retry_delay(attempts):
+    return timezone.timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def enqueue(notifications):
+    """
+    Add unsaved Notification instances to the outbox.
+
+    Notifications whose dedupe_key is already present are skipped. A drain
+    is queued once the surrounding transaction commits.
+    """
+    from .tasks import drain_notification_outbox
+
+    Notification.objects.bulk_create(notifications, ignore_conflicts=True)
+    transaction.on_commit(lambda: drain_notification_outbox.delay())
+
+
+class RateLimiter:
+    """
+    Caps wait() at per_minute calls per clock minute across all workers,
+    spaced at least 60 / per_minute seconds apart within this one; 0
+    disables it. The count of the current minute is kept in the default
+    cache, so all drains share one budget.
+    """
+    KEY = 'outbox:rate:{}'
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_at:
+            time.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+        while True:
+            now = time.time()
+            minute = int(now // 60)
+            key = self.KEY.format(minute)
+            cache.add(key, 0, timeout=120)
+            try:
+                if cache.incr(key) <= self.per_minute:
+                    return
+            except ValueError:
+                # Evicted between add() and incr(); count again
+                continue
+            time.sleep((minute + 1) * 60 - now)
+
+
+def batch_size_for(rate_limit, batch_size=BATCH_SIZE):
+    """The largest batch that can be sent at rate_limit messages per minute within one lease"""
+    if not rate_limit:
+        return batch_size
+    return max(1, min(batch_size, rate_limit * LEASE_SECONDS // 60))
+
+
+def renew_lease(notifications):
+    """Extend the lease of claimed notifications that are still pending; returns the new expiry"""
+    leased_until = timezone.now() + timezone.timedelta(seconds=LEASE_SECONDS)
+    Notification.objects.filter(
+        id__in=[notification.id for notification in notifications], status=Notification.Status.PENDING
+    ).update(next_attempt_at=leased_until)
+    return leased_until
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    """Lease up to batch_size due notifications to this worker"""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Notification.objects.select_for_update(skip_locked=True)
+            .filter(status=Notification.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        Notification.objects.filter(id__in=ids).update(
+            next_attempt_at=now + timezone.timedelta(seconds=LEASE_SECONDS)
+        )
+    return list(Notification.objects.filter(id__in=ids).order_by('id'))
+
+
+def build_message(notification, appointments):
+    msg = EmailMultiAlternatives(
+        notification.subject, notification.body_text, settings.DEFAULT_FROM_EMAIL, [notification.to_email]
+    )
+    if notification.body_html:
+        msg.attach_alternative(notification.body_html, "text/html")
+    if notification.attach_qr:
+        for appointment_id in notification.appointment_ids:
+            appointment = appointments.get(appointment_id)
+            if appointment is not None:
+                image, _ = qr.render(appointment, 'png')
+                msg.attach(f"appointment_{appointment.id}.png", image, "image/png")
+    return msg
+
+
+def send_batch(batch, limiter, connection=None):
+    """Send a claimed batch over one connection; returns (sent, failed) with failed as (notification, error)"""
+    appointment_ids = {
+        appointment_id
+        for notification in batch if notification.attach_qr
+        for appointment_id in notification.appointment_ids
+    }
+    appointments = {
+        str(appointment.id): appointment
+        for appointment in Appointment.objects.filter(id__in=appointment_ids).select_related('citizen', 'service')
+    }
+
+    sent, failed = [], []
+    # Claimed just before; other workers shared the rate limit, so the lease may need renewing
+    leased_until = timezone.now() + timezone.timedelta(seconds=LEASE_SECONDS)
+    connection = connection or get_connection()
+    try:
+        connection.open()
+        for index, notification in enumerate(batch):
+            limiter.wait()
+            if timezone.now() > leased_until - timezone.timedelta(seconds=LEASE_SECONDS / 2):
+                leased_until = renew_lease(batch[index:])
+            try:
+                connection.send_messages([build_message(notification, appointments)])
+            except MESSAGE_ERRORS as e:
+                failed.append((notification, e))
+            else:
+                sent.append(notification)
+    except Exception as e:
+        # The connection is unusable; everything not sent yet is retried
+        done = {notification.id for notification in sent} | {notification.id for notification, _ in failed}
+        failed.extend((notification, e) for notification in batch if notification.id not in done)
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def record_results(sent, failed):
+    """Mark sent notifications and reschedule or dead-letter failed ones; returns the number dead-lettered"""
+    now = timezone.now()
+    if sent:
+        Notification.objects.filter(id__in=[notification.id for notification in sent]).update(
+            status=Notification.Status.SENT,
+            sent_at=now,
+            attempts=models.F('attempts') + 1,
+            last_error='',
+        )
+        confirmed = [
+            appointment_id
+            for notification in sent if notification.kind == Notification.Kind.CONFIRMATION
+            for appointment_id in notification.appointment_ids
+        ]
+        Appointment.objects.filter(id__in=confirmed).update(confirmation_sent_at=now)
+
+    dead = 0
+    for notification, error in failed:
+        notification.attempts += 1
+        notification.last_error = f"{type(error).__name__}: {error}"
+        if notification.attempts >= MAX_ATTEMPTS:
+            notification.status = Notification.Status.DEAD
+            dead += 1
+        else:
+            notification.next_attempt_at = now + retry_delay(notification.attempts)
+    Notification.objects.bulk_update(
+        [notification for notification, _ in failed],
+        ['attempts', 'last_error', 'status', 'next_attempt_at'],
+    )
+    return dead
+
+
+def drain(batch_size=BATCH_SIZE, max_batches=None, rate_limit=None, connection=None):
+    """
+    Send due notifications batch by batch until none are left (or max_batches).
+
+    rate_limit is in messages per minute and defaults to the
+    NOTIFICATION_RATE_LIMIT setting; batches are cut to what that rate
+    sends in one lease. Returns (sent, failed, dead) counts.
+    """
+    if rate_limit is None:
+        rate_limit = getattr(settings, 'NOTIFICATION_RATE_LIMIT', 0)
+    limiter = RateLimiter(rate_limit)
+    batch_size = batch_size_for(rate_limit, batch_size)
+    totals = [0, 0, 0]
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = claim_batch(batch_size)
+        if not batch:
+            break
+        sent, failed = send_batch(batch, limiter, connection)
+        totals[0] += len(sent)
+        totals[1] += len(failed)
+        totals[2] += record_results(sent, failed)
+        batches += 1
+        if not sent and failed:
+            # Nothing got through; leave the rest for the next scheduled drain
+            break
+    return tuple(totals)
+
+
+def requeue_dead(ids=None):
+    """Give dead-lettered notifications a fresh set of attempts; returns how many"""
+    dead = Notification.objects.filter(status=Notification.Status.DEAD)
+    if ids is not None:
+        dead = dead.filter(id__in=ids)
+    return dead.update(status=Notification.Status.PENDING, attempts=0, next_attempt_at=timezone.now())
@@ -0,0 +1,106 @@
+# apps/appointments/qr.py
+"""
+QR codes rendered on demand from appointment data.
+
+Images are not stored: the endpoint and the confirmation email render
+them from the payload, and renders are kept in a per-process LRU cache
+keyed by the payload, so a changed appointment never gets a stale image
+and the cache stays bounded at CACHE_SIZE entries per format.
+
+The endpoint URL carries a TimestampSigner signature over the appointment
+id and a digest of the payload, valid for LINK_MAX_AGE seconds. The digest
+doubles as the ETag, so a client that already has the image is answered
+with 304 before the appointment is read; a changed appointment gets a new
+URL from the API.
+"""
+import hashlib
+import json
+from functools import lru_cache
+from io import BytesIO
+import qrcode
+import qrcode.image.svg
+from django.core import signing
+from django.urls import reverse
+
+CACHE_SIZE = 2048
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+SIGNING_SALT = 'appointments.qr'
+# Seconds a signed QR URL stays valid; API responses always carry a fresh one
+LINK_MAX_AGE = 24 * 60 * 60
+
+
+def qr_payload(appointment):
+    # Anyone holding the image can read it, so no personal data
+    data = {
+        "token": str(appointment.id),
+        "service": appointment.service.name,
+        "department": appointment.service.department,
+        "datetime": appointment.appointment_datetime.strftime("%Y-%m-%d %H:%M"),
+        "estimated_wait": appointment.predicted_wait_minutes
+    }
+    return json.dumps(data)  # Encode as JSON
+
+
+def _make_qr(payload):
+    qr = qrcode.QRCode(box_size=8, border=2)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def render_png(payload):
+    img = _make_qr(payload).make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def render_svg(payload):
+    img = _make_qr(payload).make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    return img.to_string()
+
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg,
+}
+
+
+def payload_digest(payload):
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def etag(digest, image_format):
+    return f'{image_format}-{digest}'
+
+
+def render(appointment, image_format='png'):
+    """(image bytes, etag) for the appointment's QR code"""
+    payload = qr_payload(appointment)
+    return RENDERERS[image_format](payload), etag(payload_digest(payload), image_format)
+
+
+def signature(appointment_id, digest):
+    """The sig parameter for the appointment's current payload: 'digest:timestamp:signature'"""
+    signed = signing.TimestampSigner(salt=SIGNING_SALT).sign(f'{appointment_id}:{digest}')
+    return signed.split(':', 1)[1]
+
+
+def verify(appointment_id, sig):
+    """The payload digest sig was issued for, or None if it is forged or older than LINK_MAX_AGE"""
+    try:
+        value = signing.TimestampSigner(salt=SIGNING_SALT).unsign(f'{appointment_id}:{sig}', max_age=LINK_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return value.split(':', 1)[1]
+
+
+def qr_url(appointment, image_format='png'):
+    """Signed, expiring path of the QR endpoint; usable from an <img> tag without a token"""
+    path = reverse('appointment-qr', kwargs={'pk': appointment.id, 'image_format': image_format})
+    return f"{path}?sig={signature(appointment.id, payload_digest(qr_payload(appointment)))}"
@@ -0,0 +1,217 @@
+# apps/appointments/queue_engine.py
+import heapq
+import itertools
+import threading
+from django.db.models import Q
+from .counters import queue_versions
+from .models import PRIORITY_RANK, Appointment, QueueCounter
+
+_REMOVED = object()
+
+
+class ServiceQueue:
+    """
+    WAITING appointments of one service in a binary heap.
+
+    Entries are ordered by (priority rank, appointment time, insertion
+    order). Cancelling marks the entry removed instead of re-heapifying
+    (lazy deletion), so enqueue, dequeue and cancel are all O(log n).
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.in_progress = {}
+        self.removed = 0
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, appointment_id, priority, arrival):
+        self.remove(appointment_id)
+        entry = [PRIORITY_RANK.get(priority, len(PRIORITY_RANK)), arrival, next(self.sequence), appointment_id]
+        self.entries[appointment_id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove(self, appointment_id):
+        entry = self.entries.pop(appointment_id, None)
+        if entry is not None:
+            entry[-1] = _REMOVED
+            self.removed += 1
+            if self.removed > len(self.entries):
+                self._compact()
+
+    def pop(self):
+        """Remove and return the id of the next appointment to serve, or None"""
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[-1] is _REMOVED:
+                self.removed -= 1
+                continue
+            del self.entries[entry[-1]]
+            return entry[-1]
+        return None
+
+    def head(self, limit):
+        """Ids of the next limit appointments in serving order"""
+        entries = heapq.nsmallest(limit + self.removed, self.heap)
+        return [entry[-1] for entry in entries if entry[-1] is not _REMOVED][:limit]
+
+    def _compact(self):
+        self.heap = [entry for entry in self.heap if entry[-1] is not _REMOVED]
+        heapq.heapify(self.heap)
+        self.removed = 0
+
+
+class QueueEngine:
+    """
+    Per-service live queues kept in process memory.
+
+    A service is loaded from the database the first time it is needed and
+    then follows every Appointment save/delete in this process, taking
+    the QueueVersion of each write it applies. Changes made by other
+    processes are picked up by sync(), which compares the version each
+    queue is at with the stored one and reloads services whose version
+    moved.
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self._versions = {}
+        self._service_of = {}
+        self._lock = threading.RLock()
+
+    def update(self, appointment_id, service_id, priority, arrival, status, version=None):
+        """
+        Place an appointment according to its current status.
+
+        version is the service's QueueVersion after the write that made
+        this change, when the write bumped it; see _adopt().
+        """
+        with self._lock:
+            self._forget(appointment_id)
+            queue = self._queues.get(service_id)
+            if queue is None:
+                # Not loaded yet; it will be read from the database when needed
+                return
+            if status == Appointment.Status.WAITING:
+                queue.push(appointment_id, priority, arrival)
+                self._service_of[appointment_id] = service_id
+            elif status == Appointment.Status.IN_PROGRESS:
+                queue.in_progress[appointment_id] = arrival
+                self._service_of[appointment_id] = service_id
+            self._adopt(service_id, version)
+
+    def remove(self, appointment_id, service_id=None, version=None):
+        with self._lock:
+            self._forget(appointment_id)
+            if service_id is not None:
+                self._adopt(service_id, version)
+
+    def pop(self, service_id):
+        """Dequeue the next WAITING appointment id of a service, or None"""
+        with self._lock:
+            appointment_id = self.queue(service_id).pop()
+            self._service_of.pop(appointment_id, None)
+            return appointment_id
+
+    def queue(self, service_id):
+        with self._lock:
+            queue = self._queues.get(service_id)
+            if queue is None:
+                queue = self._load(service_id)
+            return queue
+
+    def snapshot(self, limit, service_ids=None):
+        """
+        {service_id: (waiting_count, head_ids, in_progress_ids)} for every
+        service with a live queue, or only for service_ids.
+        """
+        active = self.sync(service_ids)
+        if service_ids is not None:
+            active = service_ids
+        with self._lock:
+            result = {}
+            for service_id in active:
+                queue = self.queue(service_id)
+                if len(queue) or queue.in_progress:
+                    result[service_id] = (len(queue), queue.head(limit), list(queue.in_progress))
+            return result
+
+    def sync(self, service_ids=None):
+        """
+        Reload services whose queue changed since they were loaded.
+
+        Checks all loaded services and those with a live queue, or only
+        service_ids. Returns the ids of checked services that currently
+        have WAITING or IN_PROGRESS appointments.
+        """
+        counters = QueueCounter.objects.filter(
+            Q(waiting__gt=0) | Q(in_progress__gt=0), hour=QueueCounter.WHOLE_DAY
+        )
+        if service_ids is not None:
+            counters = counters.filter(service_id__in=service_ids)
+        live = set(counters.values_list('service_id', flat=True).distinct().order_by())
+        with self._lock:
+            checked = set(self._queues) if service_ids is None else set(service_ids)
+        candidates = live | checked
+        # Read before any reload, so a change committed meanwhile moves the version again
+        current = queue_versions(candidates)
+        with self._lock:
+            for service_id in candidates:
+                version = current.get(service_id, 0)
+                if service_id not in self._queues or self._versions.get(service_id) != version:
+                    self._load(service_id, version)
+        return sorted(live)
+
+    def clear(self):
+        with self._lock:
+            self._queues.clear()
+            self._versions.clear()
+            self._service_of.clear()
+
+    def _load(self, service_id, version=None):
+        if version is None:
+            version = queue_versions([service_id]).get(service_id, 0)
+        queue = ServiceQueue()
+        rows = Appointment.objects.filter(
+            service_id=service_id,
+            status__in=[Appointment.Status.WAITING, Appointment.Status.IN_PROGRESS],
+        ).values_list('id', 'priority', 'appointment_datetime', 'status').order_by()
+
+        old = self._queues.get(service_id)
+        if old is not None:
+            for appointment_id in itertools.chain(old.entries, old.in_progress):
+                self._service_of.pop(appointment_id, None)
+
+        for appointment_id, priority, arrival, status in rows:
+            if status == Appointment.Status.WAITING:
+                queue.push(appointment_id, priority, arrival)
+            else:
+                queue.in_progress[appointment_id] = arrival
+            self._service_of[appointment_id] = service_id
+        self._queues[service_id] = queue
+        self._versions[service_id] = version
+        return queue
+
+    def _adopt(self, service_id, version):
+        """
+        Move a loaded queue to the version of a write it has just applied,
+        so sync() does not reload it for this process's own change. Only
+        the next version is taken: a gap means another process (or a write
+        whose hook has not run yet) changed the queue, which needs a reload.
+        """
+        if version is not None and service_id in self._queues and self._versions.get(service_id) == version - 1:
+            self._versions[service_id] = version
+
+    def _forget(self, appointment_id):
+        service_id = self._service_of.pop(appointment_id, None)
+        if service_id is not None:
+            queue = self._queues[service_id]
+            queue.remove(appointment_id)
+            queue.in_progress.pop(appointment_id, None)
+
+
+# One engine per process
+queue_engine = QueueEngine()
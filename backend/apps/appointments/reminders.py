@@ -0,0 +1,101 @@
+# apps/appointments/reminders.py
+"""
+Reminder emails for upcoming appointments.
+
+Due appointments are read with one range query on appointment_datetime
+(served by the appointment_reminder_due partial index), batch by batch.
+Each batch is locked with SKIP LOCKED, marked with reminder_sent_at and
+put in the outbox in the same transaction, so overlapping runs never
+remind anyone twice; the outbox dedupe_key is a second guard.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from . import outbox
+from .models import Appointment, Notification
+
+BATCH_SIZE = 1000
+
+
+def reminder_notification(appointment):
+    citizen = appointment.citizen
+    service = appointment.service
+    local_time = timezone.localtime(appointment.appointment_datetime).strftime("%Y-%m-%d %H:%M")
+
+    text_content = f"""
+Hello {citizen.first_name} {citizen.last_name},
+
+This is a reminder of your upcoming appointment.
+
+📅 Date & Time: {local_time}
+📍 Service: {service.name} ({service.department})
+🔑 Token: {appointment.id}
+
+Please arrive at least 15 minutes early and bring the QR code from your confirmation email.
+"""
+
+    html_content = f"""
+<html>
+  <body style="font-family: Arial, sans-serif; line-height: 1.6;">
+    <h2 style="color:#2c3e50;">Appointment Reminder</h2>
+    <p>Dear {citizen.first_name},</p>
+    <p>This is a reminder of your upcoming appointment:</p>
+    <table style="border-collapse: collapse; margin: 15px 0;">
+      <tr><td><b>Date & Time:</b></td><td>{local_time}</td></tr>
+      <tr><td><b>Service:</b></td><td>{service.name} ({service.department})</td></tr>
+      <tr><td><b>Token:</b></td><td>{appointment.id}</td></tr>
+    </table>
+    <p>Please arrive at least 15 minutes early and bring the QR code from your confirmation email.</p>
+    <p style="color:gray; font-size: 12px;">This is an automated email. Please do not reply.</p>
+  </body>
+</html>
+"""
+
+    return Notification(
+        kind=Notification.Kind.REMINDER,
+        to_email=citizen.email,
+        subject="Appointment Reminder",
+        body_text=text_content,
+        body_html=html_content,
+        # No attachment: rendering a QR per reminder would dominate the drain time
+        appointment_ids=[str(appointment.id)],
+        dedupe_key=f"reminder:{appointment.id}",
+    )
+
+
+def due_appointments(now, hours):
+    return Appointment.objects.filter(
+        status=Appointment.Status.SCHEDULED,
+        reminder_sent_at__isnull=True,
+        appointment_datetime__gte=now,
+        appointment_datetime__lt=now + timezone.timedelta(hours=hours),
+    )
+
+
+def queue_due_reminders(hours=None, batch_size=BATCH_SIZE):
+    """
+    Put reminders for appointments starting within hours in the outbox.
+
+    hours defaults to the REMINDER_HOURS_AHEAD setting. Returns the
+    number of reminders queued by this run.
+    """
+    if hours is None:
+        hours = getattr(settings, 'REMINDER_HOURS_AHEAD', 24)
+    now = timezone.now()
+    queued = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                due_appointments(now, hours)
+                .select_for_update(skip_locked=True, of=('self',))
+                .select_related('citizen', 'service')
+                .order_by('appointment_datetime')[:batch_size]
+            )
+            if not batch:
+                return queued
+            # One UPDATE for the batch; save() is not needed as nothing counted changes
+            Appointment.objects.filter(id__in=[appointment.id for appointment in batch]).update(reminder_sent_at=now)
+            outbox.enqueue([reminder_notification(appointment) for appointment in batch])
+        queued += len(batch)
+        if len(batch) < batch_size:
+            return queued
@@ -2,6 +2,7 @@
 from rest_framework import serializers
 from django.utils import timezone
 from .models import Appointment, ServiceSlot
+from .qr import qr_url
 from apps.services.serializers import ServiceListSerializer
 from apps.accounts.serializers import UserSerializer
 
@@ -23,11 +24,21 @@ class AppointmentCreateSerializer(serializers.ModelSerializer):
                 slot = ServiceSlot.objects.get(id=slot_id, service=service, datetime=appointment_datetime)
                 if slot.is_full():
                     raise serializers.ValidationError("This time slot is already fully booked.")
+                if not slot.is_available:
+                    raise serializers.ValidationError("This time slot is not available.")
             except ServiceSlot.DoesNotExist:
                 raise serializers.ValidationError("Invalid time slot selected.")
         else:
+            # A slot that only exists in the service's opening hours is materialized here
+            slot = ServiceSlot.for_booking(service.id, appointment_datetime)
+            if slot is not None:
+                if not slot.is_available and not slot.is_full():
+                    raise serializers.ValidationError("This time slot is not available.")
+                if slot.is_full():
+                    raise serializers.ValidationError("This time slot is already fully booked.")
+                data['slot'] = slot
             # Fallback: Check for any existing appointment at this time
-            if Appointment.objects.filter(
+            elif Appointment.objects.filter(
                 service=service, 
                 appointment_datetime=appointment_datetime
             ).exists():
@@ -36,6 +47,36 @@ class AppointmentCreateSerializer(serializers.ModelSerializer):
         return data
 
 
+class GroupBookingItemSerializer(serializers.Serializer):
+    service = serializers.IntegerField()
+    # A slot that has no id yet is given by its datetime
+    slot_id = serializers.IntegerField(required=False)
+    datetime = serializers.DateTimeField(required=False)
+    priority = serializers.ChoiceField(choices=Appointment.Priority.choices, default=Appointment.Priority.NORMAL)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate(self, attrs):
+        if 'slot_id' not in attrs and 'datetime' not in attrs:
+            raise serializers.ValidationError("Either slot_id or datetime is required.")
+        return attrs
+
+
+class GroupBookingSerializer(serializers.Serializer):
+    appointments = GroupBookingItemSerializer(many=True, allow_empty=False)
+
+    def validate_appointments(self, items):
+        from .booking import MAX_GROUP_SIZE
+        if len(items) > MAX_GROUP_SIZE:
+            raise serializers.ValidationError(f"At most {MAX_GROUP_SIZE} appointments can be booked together.")
+        return items
+
+
+class SlotHoldConfirmSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Appointment
+        fields = ('priority', 'notes')
+
+
 class AppointmentSerializer(serializers.ModelSerializer):
     service = ServiceListSerializer(read_only=True)
     citizen = UserSerializer(read_only=True)
@@ -47,9 +88,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
         fields = '__all__'  # includes qr_code too
 
     def get_qr_code_url(self, obj):
-        if obj.qr_code:
-            return obj.qr_code.url
-        return None
+        return qr_url(obj)
 
 
 class AppointmentListSerializer(serializers.ModelSerializer):
@@ -66,9 +105,7 @@ class AppointmentListSerializer(serializers.ModelSerializer):
         )
 
     def get_qr_code_url(self, obj):
-        if obj.qr_code:
-            return obj.qr_code.url
-        return None
+        return qr_url(obj)
 
 
 class MyAppointmentSerializer(serializers.ModelSerializer):
@@ -85,6 +122,4 @@ class MyAppointmentSerializer(serializers.ModelSerializer):
         )
 
     def get_qr_code_url(self, obj):
-        if obj.qr_code:
-            return obj.qr_code.url
-        return None
+        return qr_url(obj)
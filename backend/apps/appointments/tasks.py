@@ -1,45 +1,161 @@
+import hashlib
 from celery import shared_task
-from django.core.mail import send_mail
-from django.conf import settings
-from .models import Appointment
+from django.utils import timezone
+from .models import Appointment, Notification
+from . import outbox
+
+
+def confirmation_notification(appointment):
+    citizen = appointment.citizen
+    service = appointment.service
+    local_time = timezone.localtime(appointment.appointment_datetime)
+    predicted_wait = appointment.predicted_wait_minutes
+
+    text_content = f"""
+Hello {citizen.first_name} {citizen.last_name},
+
+Your appointment is confirmed.
+
+📅 Date & Time: {local_time.strftime("%Y-%m-%d %H:%M")}
+📍 Service: {service.name} ({service.department})
+⏳ Estimated Wait Time: {predicted_wait} minutes
+🔑 Token: {appointment.id}
+
+Please find your QR code attached for check-in.
+"""
+
+    html_content = f"""
+<html>
+  <body style="font-family: Arial, sans-serif; line-height: 1.6;">
+    <h2 style="color:#2c3e50;">Appointment Confirmation</h2>
+    <p>Dear {citizen.first_name},</p>
+    <p>Your appointment has been successfully booked. Here are the details:</p>
+    <table style="border-collapse: collapse; margin: 15px 0;">
+      <tr><td><b>Date & Time:</b></td><td>{local_time.strftime("%Y-%m-%d %H:%M")}</td></tr>
+      <tr><td><b>Service:</b></td><td>{service.name} ({service.department})</td></tr>
+      <tr><td><b>Estimated Wait:</b></td><td>{predicted_wait} minutes</td></tr>
+      <tr><td><b>Token:</b></td><td>{appointment.id}</td></tr>
+    </table>
+    <p>Please find your QR code attached for check-in at the counter.</p>
+    <p style="color:gray; font-size: 12px;">This is an automated email. Please do not reply.</p>
+  </body>
+</html>
+"""
+
+    return Notification(
+        kind=Notification.Kind.CONFIRMATION,
+        to_email=citizen.email,
+        subject="Appointment Confirmation",
+        body_text=text_content,
+        body_html=html_content,
+        appointment_ids=[str(appointment.id)],
+        attach_qr=True,
+        dedupe_key=f"confirmation:{appointment.id}",
+    )
+
+
+def group_confirmation_notification(appointments):
+    citizen = appointments[0].citizen
+    lines = []
+    rows = []
+    for appointment in appointments:
+        local_time = timezone.localtime(appointment.appointment_datetime).strftime("%Y-%m-%d %H:%M")
+        service = f"{appointment.service.name} ({appointment.service.department})"
+        lines.append(f"- {local_time}  {service}  ~{appointment.predicted_wait_minutes} min  Token: {appointment.id}")
+        rows.append(
+            f"<tr><td>{local_time}</td><td>{service}</td>"
+            f"<td>{appointment.predicted_wait_minutes} minutes</td><td>{appointment.id}</td></tr>"
+        )
+
+    text_content = f"""
+Hello {citizen.first_name} {citizen.last_name},
+
+Your {len(appointments)} appointments are confirmed:
+
+{chr(10).join(lines)}
+
+Please find the QR codes attached for check-in.
+"""
+    html_content = f"""
+<html>
+  <body style="font-family: Arial, sans-serif; line-height: 1.6;">
+    <h2 style="color:#2c3e50;">Appointment Confirmation</h2>
+    <p>Dear {citizen.first_name},</p>
+    <p>Your {len(appointments)} appointments have been successfully booked:</p>
+    <table style="border-collapse: collapse; margin: 15px 0;">
+      <tr><th>Date & Time</th><th>Service</th><th>Estimated Wait</th><th>Token</th></tr>
+      {"".join(rows)}
+    </table>
+    <p>Please find the QR codes attached for check-in at the counter.</p>
+    <p style="color:gray; font-size: 12px;">This is an automated email. Please do not reply.</p>
+  </body>
+</html>
+"""
+    appointment_ids = sorted(str(appointment.id) for appointment in appointments)
+    return Notification(
+        kind=Notification.Kind.CONFIRMATION,
+        to_email=citizen.email,
+        subject="Appointment Confirmation",
+        body_text=text_content,
+        body_html=html_content,
+        appointment_ids=appointment_ids,
+        attach_qr=True,
+        dedupe_key="group-confirmation:" + hashlib.sha256(",".join(appointment_ids).encode()).hexdigest()[:40],
+    )
+
 
 @shared_task
 def send_appointment_confirmation(appointment_id):
-    try:
-        appointment = Appointment.objects.get(id=appointment_id)
-        
-        subject = f'Appointment Confirmation - Token #{appointment.token_code}'
-        message = f"""
-        Dear {appointment.citizen.get_full_name()},
-        
-        Your appointment has been successfully booked!
-        
-        Details:
-        - Token Number: #{appointment.token_code}
-        - Service: {appointment.service.name}
-        - Department: {appointment.service.department}
-        - Scheduled Time: {appointment.appointment_datetime.strftime('%Y-%m-%d %I:%M %p')}
-        - Priority: {appointment.get_priority_display()}
-        - Estimated Wait Time: {appointment.predicted_wait_minutes} minutes
-        - Expected Completion: {appointment.estimated_completion_time.strftime('%Y-%m-%d %I:%M %p')}
-        
-        Please arrive at least 15 minutes before your scheduled time.
-        
-        Thank you!
-        Smart Queue Management System
-        """
-        
-        send_mail(
-            subject,
-            message,
-            settings.EMAIL_HOST_USER,
-            [appointment.citizen.email],
-            fail_silently=False,
-        )
-        
-        return f"Confirmation email sent for appointment {appointment.token_code}"
-        
-    except Appointment.DoesNotExist:
+    """
+    Put the confirmation email for a booked appointment in the outbox.
+
+    Queued after the booking commits. Safe to run more than once: the
+    notification's dedupe_key keeps a second run from adding another.
+    Delivery, retries and the QR attachment are handled by the outbox.
+    """
+    appointment = Appointment.objects.select_related('citizen', 'service').filter(id=appointment_id).first()
+    if appointment is None:
         return f"Appointment with id {appointment_id} not found"
-    except Exception as e:
-        return f"Error sending email: {str(e)}"
\ No newline at end of file
+    outbox.enqueue([confirmation_notification(appointment)])
+    return f"Confirmation queued for appointment {appointment.token_code}"
+
+
+@shared_task
+def release_expired_holds(batch_size=500):
+    """Give the capacity of expired slot holds back, batch by batch"""
+    from .models import SlotHold
+
+    released = 0
+    while True:
+        count = SlotHold.release_expired(batch_size=batch_size)
+        released += count
+        if count < batch_size:
+            return released
+
+
+@shared_task
+def complete_group_booking(appointment_ids):
+    """Put one confirmation email for a group booking, with every QR code, in the outbox"""
+    appointments = list(
+        Appointment.objects.filter(id__in=appointment_ids)
+        .select_related('citizen', 'service')
+        .order_by('appointment_datetime')
+    )
+    if not appointments:
+        return "No appointments to confirm"
+    outbox.enqueue([group_confirmation_notification(appointments)])
+    return f"Group confirmation queued for {len(appointments)} appointments"
+
+
+@shared_task
+def drain_notification_outbox():
+    """Send due outbox notifications in batches over one SMTP connection per batch"""
+    sent, failed, dead = outbox.drain()
+    return f"Sent {sent} notifications, {failed} failed, {dead} dead-lettered"
+
+
+@shared_task
+def send_appointment_reminders(hours=None):
+    """Queue reminders for appointments starting in the next hours (REMINDER_HOURS_AHEAD by default)"""
+    from .reminders import queue_due_reminders
+    return f"Queued {queue_due_reminders(hours)} reminders"
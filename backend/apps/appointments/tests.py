@@ -0,0 +1,826 @@
+import socketserver
+import tempfile
+import threading
+import time as time_module
+from datetime import datetime, time, timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+from django.apps import apps as django_apps
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.accounts.models import User
+from apps.services.models import OpeningHours, Service
+from smart_queue.celery import app as celery_app
+from . import availability, counters, outbox, qr, reminders, tokens
+from .booking import book_group
+from .models import (
+    PRIORITY_RANK, Appointment, Notification, QueueCounter, ServiceSlot, SlotHold, SlotUnavailable,
+)
+from .queue_engine import queue_engine
+
+
+def create_waiting(citizen, service, count, start):
+    priorities = [choice[0] for choice in Appointment.Priority.choices]
+    return [
+        Appointment.objects.create(
+            citizen=citizen,
+            service=service,
+            appointment_datetime=start + timedelta(minutes=i),
+            priority=priorities[i % len(priorities)],
+            status=Appointment.Status.WAITING,
+        )
+        for i in range(count)
+    ]
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() moves the clock instead of waiting"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    """A minimal SMTP server on localhost that records messages and refuses some recipients"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, refuse=()):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.refuse = set(refuse)
+        self.connections = 0
+        self.messages = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        recipients = []
+        self.reply('220 localhost ESMTP')
+        for raw in self.rfile:
+            command = raw.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in self.server.refuse:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for line in self.rfile:
+                    if line == b'.\r\n':
+                        break
+                self.server.messages.append(recipients)
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SlotCapacityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def slot(self, **fields):
+        return ServiceSlot.objects.create(
+            service=self.service, datetime=timezone.now() + timedelta(days=1), max_capacity=2, **fields
+        )
+
+    def book(self, slot):
+        return Appointment.objects.create(
+            citizen=self.citizen, service=self.service, appointment_datetime=slot.datetime, slot=slot,
+        )
+
+    def test_reserve_closes_slot_when_full_and_release_reopens_it(self):
+        slot = self.slot()
+        self.assertTrue(slot.reserve())
+        self.assertTrue(slot.reserve())
+        self.assertFalse(slot.reserve())
+        slot.refresh_from_db()
+        self.assertEqual((slot.current_bookings, slot.is_available), (2, False))
+
+        slot.release()
+        slot.refresh_from_db()
+        self.assertEqual((slot.current_bookings, slot.is_available), (1, True))
+
+    def test_expired_holds_do_not_block_reservations(self):
+        slot, other = self.slot(), self.slot()
+        for held in (slot, slot, other, other):
+            self.assertIsNotNone(SlotHold.place(held, self.citizen))
+        self.assertIsNone(SlotHold.place(slot, self.citizen))
+        SlotHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.book(slot)
+        self.assertTrue(ServiceSlot.reserve_many({slot: 1, other: 2}))
+        for held in (slot, other):
+            held.refresh_from_db()
+            self.assertEqual((held.current_bookings, held.is_available), (2, False))
+        self.assertFalse(SlotHold.objects.exists())
+
+    def test_blocked_slot_cannot_be_booked(self):
+        slot = self.slot(is_available=False)
+        self.assertFalse(slot.reserve())
+        self.assertFalse(ServiceSlot.reserve_many({slot: 1}))
+        with self.assertRaisesMessage(SlotUnavailable, 'not available'):
+            self.book(slot)
+        slot.refresh_from_db()
+        self.assertEqual((slot.current_bookings, slot.is_available), (0, False))
+
+    def test_release_keeps_a_blocked_slot_blocked(self):
+        slot = self.slot()
+        appointment = self.book(slot)
+        ServiceSlot.objects.filter(pk=slot.pk).update(is_available=False)
+
+        appointment.status = Appointment.Status.CANCELLED
+        appointment.save()
+        slot.refresh_from_db()
+        self.assertEqual((slot.current_bookings, slot.is_available), (0, False))
+
+    def test_full_slot_reports_fully_booked(self):
+        slot = self.slot()
+        self.book(slot)
+        self.book(slot)
+        with self.assertRaisesMessage(SlotUnavailable, 'fully booked'):
+            self.book(slot)
+
+
+class BookingConfirmationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def test_booking_sends_confirmation_without_a_broker(self):
+        slot = ServiceSlot.objects.create(
+            service=self.service, datetime=timezone.now() + timedelta(days=1), max_capacity=2,
+        )
+        client = APIClient()
+        client.force_authenticate(self.citizen)
+
+        # The default without CELERY_BROKER_URL, whatever this environment sets
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('create-appointment'), {
+                'service': self.service.id, 'slot_id': slot.id, 'appointment_datetime': slot.datetime.isoformat(),
+            }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual((message.to, message.subject), (['citizen@example.com'], 'Appointment Confirmation'))
+        self.assertEqual(message.attachments[0][2], 'image/png')
+        self.assertEqual(Notification.objects.get().status, Notification.Status.SENT)
+
+
+@override_settings(DEFAULT_FROM_EMAIL='noreply@example.com')
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.server = SmtpServer(refuse={'refused@example.com'})
+        self.addCleanup(self.server.stop)
+        cache.clear()
+
+    def connection(self):
+        return get_connection(
+            'django.core.mail.backends.smtp.EmailBackend',
+            host='127.0.0.1', port=self.server.port, use_tls=False, username='', password='', timeout=5,
+        )
+
+    def enqueue(self, *addresses):
+        Notification.objects.bulk_create([
+            Notification(kind=Notification.Kind.REMINDER, to_email=address, subject='Reminder', body_text='Hello')
+            for address in addresses
+        ])
+
+    def test_sends_each_batch_over_one_connection(self):
+        self.enqueue(*[f'citizen{i}@example.com' for i in range(5)])
+
+        self.assertEqual(outbox.drain(batch_size=2, connection=self.connection()), (5, 0, 0))
+
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertFalse(Notification.objects.exclude(status=Notification.Status.SENT).exists())
+
+    def test_refused_message_backs_off_then_is_dead_lettered(self):
+        self.enqueue('refused@example.com', 'citizen@example.com')
+
+        before = timezone.now()
+        self.assertEqual(outbox.drain(connection=self.connection()), (1, 1, 0))
+        refused = Notification.objects.get(to_email='refused@example.com')
+        self.assertEqual((refused.status, refused.attempts), (Notification.Status.PENDING, 1))
+        self.assertGreaterEqual(refused.next_attempt_at, before + timedelta(seconds=outbox.RETRY_DELAY))
+        # Not due yet
+        self.assertEqual(outbox.drain(connection=self.connection()), (0, 0, 0))
+
+        delays = []
+        for _ in range(outbox.MAX_ATTEMPTS - 1):
+            due = timezone.now()
+            Notification.objects.filter(pk=refused.pk).update(next_attempt_at=due)
+            outbox.drain(connection=self.connection())
+            refused.refresh_from_db()
+            delays.append(refused.next_attempt_at - due)
+        self.assertEqual((refused.status, refused.attempts), (Notification.Status.DEAD, outbox.MAX_ATTEMPTS))
+        self.assertEqual(delays[:-1], sorted(delays[:-1]))
+        self.assertEqual(self.server.messages, [['citizen@example.com']])
+
+    def test_rate_limit_is_shared_by_every_drain(self):
+        clock = FakeClock(60 * 100000)
+        with mock.patch.object(outbox, 'time', clock):
+            first, second = outbox.RateLimiter(2), outbox.RateLimiter(2)
+            first.wait()
+            second.wait()
+            self.assertEqual(clock.now, 60 * 100000)
+            # The minute's budget is spent by the two workers together
+            first.wait()
+            self.assertEqual(clock.now, 60 * 100001)
+
+    def test_batches_fit_in_one_lease(self):
+        self.assertEqual(outbox.batch_size_for(0), outbox.BATCH_SIZE)
+        self.assertEqual(outbox.batch_size_for(6), 6 * outbox.LEASE_SECONDS // 60)
+        self.assertEqual(outbox.batch_size_for(0.1), 1)
+
+        self.enqueue(*[f'citizen{i}@example.com' for i in range(3)])
+        batch = outbox.claim_batch()
+        leased_until = outbox.renew_lease(batch[1:])
+        self.assertEqual(
+            set(Notification.objects.filter(next_attempt_at=leased_until).values_list('pk', flat=True)),
+            {notification.pk for notification in batch[1:]},
+        )
+
+
+class ReminderTests(TestCase):
+    def test_queues_each_due_reminder_once(self):
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        service = Service.objects.create(name='Passports', department='Civil', description='')
+        now = timezone.now()
+        due = [
+            Appointment.objects.create(citizen=citizen, service=service, appointment_datetime=now + timedelta(hours=h))
+            for h in (1, 2, 3)
+        ]
+        for hours, appointment_status in ((30, Appointment.Status.SCHEDULED), (2, Appointment.Status.CANCELLED),
+                                          (-1, Appointment.Status.SCHEDULED)):
+            Appointment.objects.create(
+                citizen=citizen, service=service, appointment_datetime=now + timedelta(hours=hours),
+                status=appointment_status,
+            )
+
+        self.assertEqual(reminders.queue_due_reminders(hours=24, batch_size=2), 3)
+        self.assertEqual(reminders.queue_due_reminders(hours=24, batch_size=2), 0)
+
+        reminded = Notification.objects.filter(kind=Notification.Kind.REMINDER).values_list('appointment_ids', flat=True)
+        self.assertEqual(sorted(ids[0] for ids in reminded), sorted(str(appointment.id) for appointment in due))
+        self.assertFalse(Appointment.objects.filter(id__in=[a.id for a in due], reminder_sent_at__isnull=True).exists())
+
+
+class GroupBookingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def slot(self, hours, max_capacity):
+        start = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), time(9)))
+        return ServiceSlot.objects.create(
+            service=self.service, datetime=start + timedelta(hours=hours), max_capacity=max_capacity,
+        )
+
+    def test_books_every_item_with_its_own_token(self):
+        first, second = self.slot(0, 3), self.slot(1, 1)
+        items = [
+            {'service': self.service.id, 'slot_id': first.id},
+            {'service': self.service.id, 'slot_id': first.id, 'priority': Appointment.Priority.ELDERLY},
+            {'service': self.service.id, 'datetime': second.datetime},
+        ]
+
+        appointments = book_group(self.citizen, items)
+
+        self.assertEqual([a.slot_id for a in appointments], [first.id, first.id, second.id])
+        self.assertEqual(appointments[1].priority, Appointment.Priority.ELDERLY)
+        self.assertEqual(len({a.token_code for a in appointments}), 3)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.current_bookings, second.current_bookings, second.is_available), (2, 1, False))
+        day_row = QueueCounter.objects.get(service=self.service, hour=QueueCounter.WHOLE_DAY)
+        self.assertEqual(day_row.scheduled, 3)
+
+    def test_books_nothing_when_one_slot_is_full(self):
+        first, second = self.slot(0, 3), self.slot(1, 1)
+        items = [
+            {'service': self.service.id, 'slot_id': first.id},
+            {'service': self.service.id, 'slot_id': second.id},
+            {'service': self.service.id, 'slot_id': second.id},
+        ]
+
+        with self.assertRaisesMessage(ValueError, 'fully booked'):
+            book_group(self.citizen, items)
+
+        self.assertFalse(Appointment.objects.exists())
+        first.refresh_from_db()
+        self.assertEqual((first.current_bookings, first.is_available), (0, True))
+
+    def test_rejects_a_slot_of_another_service(self):
+        other = Service.objects.create(name='Licences', department='Transport', description='')
+        slot = self.slot(0, 3)
+        with self.assertRaisesMessage(ValueError, 'Invalid time slot'):
+            book_group(self.citizen, [{'service': other.id, 'slot_id': slot.id}])
+
+
+class TokenCodeTests(TestCase):
+    def setUp(self):
+        self.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        self.service = Service.objects.create(name='Passports', department='Civil', description='')
+        tokens.discard_block()
+        self.addCleanup(tokens.discard_block)
+
+    def book(self):
+        return Appointment.objects.create(
+            citizen=self.citizen, service=self.service, appointment_datetime=timezone.now(),
+        )
+
+    def test_blocks_come_from_the_database(self):
+        self.assertEqual(tokens.next_block() + 1, tokens.next_block())
+
+    def test_taken_code_is_replaced(self):
+        # Block 7 handed out twice, as after a rolled-back allocation
+        blocks = iter([7, 7, 8])
+        with mock.patch.object(tokens.allocator, 'block_source', lambda: next(blocks)):
+            first = self.book()
+            tokens.discard_block()
+            second = self.book()
+
+        self.assertNotEqual(first.token_code, second.token_code)
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.assertEqual(tokens.get_permutation().invert(tokens.parse_code(second.token_code)), 8 * tokens.BLOCK_SIZE)
+
+
+class ReconcileQueueCountersTests(TestCase):
+    def test_corrects_drifted_rows_in_place(self):
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        service = Service.objects.create(name='Passports', department='Civil', description='')
+        noon = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), time(12)))
+        create_waiting(citizen, service, 3, noon)
+        rows = {row.pk: row for row in QueueCounter.objects.all()}
+        day_row = QueueCounter.objects.get(hour=QueueCounter.WHOLE_DAY)
+        # A bulk status change that bypassed the counters
+        Appointment.objects.filter(service=service).update(status=Appointment.Status.SCHEDULED)
+
+        call_command('reconcile_queue_counters', stdout=StringIO())
+
+        day_row.refresh_from_db()
+        self.assertEqual((day_row.scheduled, day_row.waiting), (3, 0))
+        # Rows are corrected, not deleted and recreated
+        self.assertEqual(set(QueueCounter.objects.values_list('pk', flat=True)), set(rows))
+
+        output = StringIO()
+        call_command('reconcile_queue_counters', '--dry-run', stdout=output)
+        self.assertIn('0 of', output.getvalue())
+
+
+    def test_migration_backfills_counters_from_appointments(self):
+        backfill = import_module('apps.appointments.migrations.0015_backfill_queuecounter')
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        service = Service.objects.create(name='Passports', department='Civil', description='')
+        noon = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), time(12)))
+        create_waiting(citizen, service, 3, noon)
+        # Appointments booked before the counters existed
+        QueueCounter.objects.all().delete()
+
+        backfill.backfill_counters(django_apps, None)
+
+        day_row = QueueCounter.objects.get(service=service, hour=QueueCounter.WHOLE_DAY)
+        self.assertEqual(day_row.waiting, 3)
+        Appointment.objects.filter(service=service).first().delete()
+        day_row.refresh_from_db()
+        self.assertEqual(day_row.waiting, 2)
+
+
+class AvailabilityEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.citizen)
+
+    def test_calendar_normalises_month(self):
+        response = self.client.get(
+            reverse('availability-calendar'), {'month': '2026-1', 'service_id': self.service.id}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['month'], '2026-01')
+        self.assertEqual(len(response.data['services'][0]['days']), 31)
+
+    def test_calendar_rejects_months_out_of_range(self):
+        for month in ('0001-01', '9999-12'):
+            response = self.client.get(
+                reverse('availability-calendar'), {'month': month, 'service_id': self.service.id}
+            )
+            self.assertEqual(response.status_code, 400, month)
+
+    def test_next_available_rejects_after_out_of_range(self):
+        for after in ('9999-12-30T00:00:00Z', '0001-01-01T00:00:00Z'):
+            response = self.client.get(
+                reverse('next-available-slots'), {'after': after, 'service_id': self.service.id}
+            )
+            self.assertEqual(response.status_code, 400, after)
+
+    def test_next_available_searches_from_after(self):
+        response = self.client.get(
+            reverse('next-available-slots'), {'after': '2026-11-02T00:00:00Z', 'service_id': self.service.id}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_service_is_bookable_from_default_hours(self):
+        day = timezone.localdate() + timedelta(days=1)
+        response = self.client.get(reverse('available-slots'), {'date': day.isoformat(), 'service_id': self.service.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 18)
+        self.assertEqual(timezone.localtime(response.data[0]['datetime']).time(), OpeningHours.DEFAULT_OPENS)
+
+        response = self.client.post(reverse('create-appointment'), {
+            'service': self.service.id, 'appointment_datetime': response.data[0]['datetime'].isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(Appointment.objects.get().slot_id)
+
+
+class DayCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+        cls.day = timezone.localdate() + timedelta(days=1)
+        OpeningHours.objects.filter(service=cls.service).delete()
+        OpeningHours.objects.create(
+            service=cls.service, weekday=cls.day.weekday(), opens=time(9), closes=time(12),
+            interval_minutes=60, capacity=2,
+        )
+
+    def setUp(self):
+        availability.local_cache.clear()
+        self.addCleanup(availability.local_cache.clear)
+
+    def shared_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name,
+        }})
+
+    def book(self, hour):
+        slot_datetime = timezone.make_aware(datetime.combine(self.day, time(hour)))
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(
+                citizen=self.citizen, service=self.service, appointment_datetime=slot_datetime,
+                slot=ServiceSlot.for_booking(self.service.id, slot_datetime),
+            )
+
+    def bookings(self):
+        return [current_bookings for _, _, current_bookings, _ in availability.get_day(self.service.id, self.day)]
+
+    def test_shared_cache_serves_days_until_a_booking(self):
+        with self.shared_cache():
+            self.assertEqual(self.bookings(), [0, 0, 0])
+            with self.assertNumQueries(0):
+                self.assertEqual(self.bookings(), [0, 0, 0])
+            # Another worker: only the shared cache has the day
+            availability.local_cache.clear()
+            with self.assertNumQueries(0):
+                self.assertEqual(self.bookings(), [0, 0, 0])
+
+            self.book(10)
+            self.assertEqual(self.bookings(), [0, 1, 0])
+
+    def test_reads_the_database_without_a_shared_cache(self):
+        self.assertEqual(self.bookings(), [0, 0, 0])
+        Appointment.objects.create(
+            citizen=self.citizen, service=self.service,
+            slot=ServiceSlot.for_booking(self.service.id, timezone.make_aware(datetime.combine(self.day, time(11)))),
+        )
+        # No hooks ran: another worker's booking still shows
+        self.assertEqual(self.bookings(), [0, 0, 1])
+        self.assertIsNone(availability.get_day(self.service.id + 1000, self.day))
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='x', role=User.UserRole.STAFF,
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def shared_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name,
+        }})
+
+    def test_no_etag_without_a_shared_cache(self):
+        response = self.client.get(reverse('queue-status'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_queue_status_answers_304_until_the_queue_changes(self):
+        url = reverse('queue-status')
+        with self.shared_cache():
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                create_waiting(self.citizen, self.service, 1, timezone.now())
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_available_slots_answers_304_until_a_booking(self):
+        slot = ServiceSlot.objects.create(
+            service=self.service, datetime=timezone.now() + timedelta(days=1), max_capacity=2,
+        )
+        params = {'date': timezone.localtime(slot.datetime).date().isoformat(), 'service_id': self.service.id}
+        url = reverse('available-slots')
+        with self.shared_cache():
+            etag = self.client.get(url, params)['ETag']
+            self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                Appointment.objects.create(
+                    citizen=self.citizen, service=self.service, appointment_datetime=slot.datetime, slot=slot,
+                )
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+
+class QueueStreamTests(TestCase):
+    def test_stream_is_off_without_a_shared_cache(self):
+        staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='x', role=User.UserRole.STAFF,
+        )
+        client = APIClient()
+        client.force_authenticate(staff)
+        with self.settings(QUEUE_STREAM_ENABLED=True):
+            response = client.get(reverse('queue-stream'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 503)
+
+
+class QueueEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='x', role=User.UserRole.STAFF,
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def setUp(self):
+        queue_engine.clear()
+        self.addCleanup(queue_engine.clear)
+
+    def test_own_writes_do_not_reload_the_queue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_waiting(self.citizen, self.service, 3, timezone.now())
+        self.assertEqual(queue_engine.snapshot(10)[self.service.id][0], 3)
+
+        with mock.patch.object(queue_engine, '_load', wraps=queue_engine._load) as load:
+            with self.captureOnCommitCallbacks(execute=True):
+                create_waiting(self.citizen, self.service, 2, timezone.now())
+            with self.captureOnCommitCallbacks(execute=True):
+                Appointment.claim_next(self.service.id, 1)
+            waiting, head, in_progress = queue_engine.snapshot(10)[self.service.id]
+            self.assertEqual(load.call_count, 0)
+            self.assertEqual((waiting, len(head), len(in_progress)), (4, 4, 1))
+
+            # A write from another process: only the version moves here
+            Appointment.objects.filter(pk=head[0]).update(status=Appointment.Status.CANCELLED)
+            counters.bump_queue_versions([self.service.id])
+            self.assertEqual(queue_engine.snapshot(10)[self.service.id][0], 3)
+            self.assertEqual(load.call_count, 1)
+
+    def test_queue_status_limit_is_clamped(self):
+        create_waiting(self.citizen, self.service, 3, timezone.now())
+        client = APIClient()
+        client.force_authenticate(self.staff)
+
+        response = client.get(reverse('queue-status'), {'limit': -1})
+        self.assertEqual(len(response.data['waiting_queue']), 1)
+        self.assertEqual(response.data['total_waiting'], 3)
+        self.assertEqual(client.get(reverse('queue-status'), {'limit': 'x'}).status_code, 400)
+
+
+class AppointmentQrTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Ada', last_name='Lovelace',
+        )
+        service = Service.objects.create(name='Passports', department='Civil', description='')
+        cls.appointment = Appointment.objects.create(
+            citizen=citizen, service=service, appointment_datetime=timezone.now(),
+        )
+
+    def test_payload_has_no_personal_data(self):
+        self.assertNotIn('Lovelace', qr.qr_payload(self.appointment))
+
+    def test_renders_image_and_answers_304_without_queries(self):
+        url = qr.qr_url(self.appointment)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_rejects_forged_and_expired_signatures(self):
+        url = qr.qr_url(self.appointment)
+        self.assertEqual(self.client.get(url + 'x').status_code, 403)
+        with mock.patch('django.core.signing.time.time', return_value=time_module.time() + qr.LINK_MAX_AGE + 1):
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ClaimNextTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def test_claims_by_priority_then_time(self):
+        start = timezone.now()
+        create_waiting(self.citizen, self.service, 8, start)
+
+        claimed = []
+        while (appointment := Appointment.claim_next(self.service.id, 1)) is not None:
+            claimed.append(appointment)
+
+        self.assertEqual(len(claimed), 8)
+        order = [(PRIORITY_RANK[a.priority], a.appointment_datetime) for a in claimed]
+        self.assertEqual(order, sorted(order))
+        self.assertTrue(all(a.status == Appointment.Status.IN_PROGRESS and a.counter == 1 for a in claimed))
+
+
+class UpdateStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='x', role=User.UserRole.STAFF,
+        )
+        cls.service = Service.objects.create(name='Passports', department='Civil', description='')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_calling_by_hand_records_called_at_and_counter(self):
+        appointment, = create_waiting(self.citizen, self.service, 1, timezone.now())
+        url = reverse('update-appointment-status', args=[appointment.pk])
+
+        response = self.client.patch(url, {'status': 'IN_PROGRESS', 'counter': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        appointment.refresh_from_db()
+        self.assertIsNotNone(appointment.called_at)
+        self.assertEqual(appointment.counter, 3)
+
+        called_at = appointment.called_at
+        self.client.patch(url, {'status': 'IN_PROGRESS'}, format='json')
+        self.client.patch(url, {'status': 'COMPLETED'}, format='json')
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.called_at, called_at)
+
+    def test_rejects_invalid_counter(self):
+        appointment, = create_waiting(self.citizen, self.service, 1, timezone.now())
+        url = reverse('update-appointment-status', args=[appointment.pk])
+        response = self.client.patch(url, {'status': 'IN_PROGRESS', 'counter': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL row locks (SELECT ... FOR UPDATE SKIP LOCKED)')
+class ConcurrentClaimNextTests(TransactionTestCase):
+    APPOINTMENTS = 200
+    COUNTERS = 8
+
+    def test_no_appointment_is_claimed_twice(self):
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        service = Service.objects.create(name='Passports', department='Civil', description='')
+        create_waiting(citizen, service, self.APPOINTMENTS, timezone.now())
+
+        claimed = [[] for _ in range(self.COUNTERS)]
+        errors = []
+        barrier = threading.Barrier(self.COUNTERS)
+
+        def work(counter):
+            try:
+                barrier.wait()
+                while (appointment := Appointment.claim_next(service.id, counter + 1)) is not None:
+                    claimed[counter].append(appointment.id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, args=(counter,)) for counter in range(self.COUNTERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        all_claims = [appointment_id for ids in claimed for appointment_id in ids]
+        self.assertEqual(len(all_claims), len(set(all_claims)), 'an appointment was claimed twice')
+        self.assertEqual(len(all_claims), self.APPOINTMENTS)
+        self.assertEqual(
+            Appointment.objects.filter(service=service, status=Appointment.Status.IN_PROGRESS).count(),
+            self.APPOINTMENTS,
+        )
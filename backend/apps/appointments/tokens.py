@@ -0,0 +1,164 @@
+# apps/appointments/tokens.py
+"""
+Unique appointment token codes without a lookup per booking.
+
+A code is an 8-character A-Z0-9 string obtained by passing a counter
+value through a keyed permutation of [0, 36**8). Distinct counter values
+always give distinct codes and consecutive values give unrelated-looking
+ones, so nothing has to be checked against the table.
+
+Counter values are handed out in blocks of BLOCK_SIZE per process. On
+PostgreSQL the block number comes from a sequence (nextval is never
+rolled back, so a block is never reused); elsewhere from the TokenBlock
+row, incremented in the caller's transaction. If that transaction rolls
+back, the block can be handed out again, so a booking whose code turns
+out to be taken (IntegrityError on the unique token_code) drops its
+block with discard_block() and retries with a fresh code.
+"""
+import hashlib
+import os
+import string
+import threading
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+ALPHABET = string.digits + string.ascii_uppercase
+TOKEN_LENGTH = 8
+SPACE = len(ALPHABET) ** TOKEN_LENGTH
+
+HALF_BITS = 21  # 2**42 > 36**8, so cycle-walking needs ~1.6 rounds per code
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+BLOCK_SIZE = 256
+BLOCK_SEQUENCE = 'appointments_token_block_seq'
+# Inserts retried with a fresh code before the IntegrityError is raised
+TOKEN_ATTEMPTS = 3
+
+
+class TokenPermutation:
+    """A keyed bijection on [0, SPACE): a Feistel network with cycle-walking"""
+
+    def __init__(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8 * ROUNDS, person=b'token-codes').digest()
+        words = [int.from_bytes(digest[i:i + 8], 'big') for i in range(0, len(digest), 8)]
+        self.round_keys = [word & HALF_MASK for word in words]
+        # Odd multipliers keep the round function well mixed
+        self.multipliers = [(word >> HALF_BITS) | 1 for word in words]
+
+    def _mix(self, value, round_index):
+        value = ((value ^ self.round_keys[round_index]) * self.multipliers[round_index]) & 0xFFFFFFFFFFFF
+        return (value ^ (value >> 19)) & HALF_MASK
+
+    def _forward(self, value):
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for round_index in range(ROUNDS):
+            left, right = right, left ^ self._mix(right, round_index)
+        return (left << HALF_BITS) | right
+
+    def _backward(self, value):
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for round_index in reversed(range(ROUNDS)):
+            left, right = right ^ self._mix(left, round_index), left
+        return (left << HALF_BITS) | right
+
+    def permute(self, number):
+        value = self._forward(number)
+        while value >= SPACE:
+            value = self._forward(value)
+        return value
+
+    def invert(self, value):
+        number = self._backward(value)
+        while number >= SPACE:
+            number = self._backward(number)
+        return number
+
+
+PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+
+
+def format_code(value):
+    """value as TOKEN_LENGTH base-36 digits, two digits per step"""
+    pairs = []
+    for _ in range(TOKEN_LENGTH // 2):
+        value, pair = divmod(value, len(PAIRS))
+        pairs.append(PAIRS[pair])
+    return ''.join(reversed(pairs))
+
+
+def parse_code(code):
+    return int(code, len(ALPHABET))
+
+
+def next_block():
+    """A block number no other process has been given"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s)', [BLOCK_SEQUENCE])
+            return cursor.fetchone()[0]
+    from .models import TokenBlock
+
+    with transaction.atomic():
+        TokenBlock.objects.bulk_create([TokenBlock(pk=TokenBlock.ROW)], ignore_conflicts=True)
+        # The UPDATE locks the row, so the value read back is this caller's
+        TokenBlock.objects.filter(pk=TokenBlock.ROW).update(last=F('last') + 1)
+        return TokenBlock.objects.values_list('last', flat=True).get(pk=TokenBlock.ROW)
+
+
+class TokenAllocator:
+    """Hands out counter values from per-process blocks"""
+
+    def __init__(self, block_size=BLOCK_SIZE, block_source=next_block):
+        self.block_size = block_size
+        self.block_source = block_source
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def discard(self):
+        """Drop the rest of the current block; the next take() starts a new one"""
+        with self._lock:
+            self._next = self._end = 0
+
+    def take(self, count=1):
+        with self._lock:
+            values = []
+            while len(values) < count:
+                if self._next >= self._end:
+                    block = self.block_source()
+                    self._next, self._end = block * self.block_size, (block + 1) * self.block_size
+                taken = min(count - len(values), self._end - self._next)
+                values.extend(range(self._next, self._next + taken))
+                self._next += taken
+            return values
+
+
+_permutation = None
+allocator = TokenAllocator()
+# A forked worker must not keep using its parent's block
+os.register_at_fork(after_in_child=allocator.reset)
+
+
+def get_permutation():
+    global _permutation
+    if _permutation is None:
+        _permutation = TokenPermutation(settings.SECRET_KEY)
+    return _permutation
+
+
+def next_token_codes(count):
+    permutation = get_permutation()
+    return [format_code(permutation.permute(value % SPACE)) for value in allocator.take(count)]
+
+
+def next_token_code():
+    return next_token_codes(1)[0]
+
+
+def discard_block():
+    """Stop using this process's block, after one of its codes was found taken"""
+    allocator.discard()
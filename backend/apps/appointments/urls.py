@@ -3,10 +3,19 @@ from . import views
 
 urlpatterns = [
     path('create/', views.CreateAppointmentView.as_view(), name='create-appointment'),
+    path('create/group/', views.create_group_booking, name='create-group-booking'),
     path('mine/', views.MyAppointmentsView.as_view(), name='my-appointments'),
     path('all/', views.AllAppointmentsView.as_view(), name='all-appointments'),
     path('<uuid:pk>/', views.AppointmentDetailView.as_view(), name='appointment-detail'),
     path('<uuid:pk>/status/', views.update_appointment_status, name='update-appointment-status'),
+    path('<uuid:pk>/qr.<str:image_format>', views.appointment_qr, name='appointment-qr'),
     path('queue/status/', views.queue_status, name='queue-status'),
+    path('queue/stream/', views.queue_stream, name='queue-stream'),
+    path('queue/<int:service_id>/counters/<int:counter>/call-next/', views.call_next, name='call-next'),
     path('available-slots/', views.available_slots, name='available-slots'),
+    path('available-slots/calendar/', views.availability_calendar, name='availability-calendar'),
+    path('available-slots/next/', views.next_available_slots, name='next-available-slots'),
+    path('holds/', views.place_hold, name='place-hold'),
+    path('holds/<uuid:pk>/', views.cancel_hold, name='cancel-hold'),
+    path('holds/<uuid:pk>/confirm/', views.confirm_hold, name='confirm-hold'),
 ]
\ No newline at end of file
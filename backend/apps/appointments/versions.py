@@ -0,0 +1,103 @@
+# apps/appointments/versions.py
+"""
+Change versions for cached client views, kept in the Django cache.
+
+Each service queue, each service-day slot set and each service's opening
+hours template has a counter that is bumped after every committed
+change. Endpoints derive their ETag from it, so an unchanged poll is
+answered with 304 from two cache reads. A counter
+that is missing (first use or cache flush) is seeded from the current
+time in milliseconds, which keeps versions increasing across cache loss.
+
+Versions only mean something if every worker sees the same counters, so
+callers check is_shared() first: with a per-process cache (the LocMem
+fallback when REDIS_URL is unset) a worker would never see the bumps made
+by the others and would answer 304 for data that changed.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+ALL_SERVICES = 'all'
+
+# Backends whose entries are private to one process
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def is_shared():
+    """Whether the default cache is shared by all workers, so versions can be trusted"""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def queue_key(service_id):
+    return f'version:queue:{service_id}'
+
+
+def slots_key(service_id, date):
+    return f'version:slots:{service_id}:{date.isoformat()}'
+
+
+def template_key(service_id):
+    return f'version:template:{service_id}'
+
+
+def _seed(key):
+    now = time.time()
+    cache.add(key, int(now * 1000), timeout=None)
+    cache.add(key + ':at', now, timeout=None)
+
+
+def bump(key):
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        _seed(key)
+        version = cache.incr(key)
+    cache.set(key + ':at', time.time(), timeout=None)
+    return version
+
+
+def get(key):
+    """(version, last_modified_timestamp) for key"""
+    values = cache.get_many([key, key + ':at'])
+    if key not in values:
+        _seed(key)
+        values = cache.get_many([key, key + ':at'])
+    return values.get(key, 0), values.get(key + ':at', time.time())
+
+
+def get_many(keys):
+    """({key: version}, latest last_modified timestamp) for keys, seeding missing ones"""
+    keys = list(keys)
+    values = cache.get_many(keys + [key + ':at' for key in keys])
+    missing = [key for key in keys if key not in values]
+    if missing:
+        # One write for all of them (a cold month calendar misses hundreds);
+        # unlike add(), set_many() can overwrite a bump made in between, but
+        # the version it writes is the current time, which no client holds
+        now = time.time()
+        seeds = {key: int(now * 1000) for key in missing}
+        seeds.update({key + ':at': now for key in missing})
+        cache.set_many(seeds, timeout=None)
+        values.update(seeds)
+    last_modified = max((values.get(key + ':at', 0) for key in keys), default=0) or time.time()
+    return {key: values.get(key, 0) for key in keys}, last_modified
+
+
+def bump_queue(service_id):
+    bump(queue_key(service_id))
+    bump(queue_key(ALL_SERVICES))
+
+
+def bump_slots(service_id, slot_datetime):
+    bump(slots_key(service_id, timezone.localtime(slot_datetime).date()))
+
+
+def etag(prefix, key, *extra):
+    """(etag, last_modified) for the current version of key"""
+    version, last_modified = get(key)
+    return '-'.join(str(part) for part in (prefix, version) + extra), last_modified
@@ -2,50 +2,54 @@
 import json
 from django.conf import settings
 from rest_framework import generics, status, permissions, serializers
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.core.mail import  EmailMultiAlternatives
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from datetime import datetime
-from io import BytesIO
-import qrcode
-from django.core.files.base import ContentFile
+import time
 from django.utils import timezone
 
 from apps.services.models import Service
-from .models import Appointment, ServiceSlot
+from .models import Appointment, ServiceSlot, SlotHold, SlotUnavailable
+from .queue_engine import PRIORITY_RANK, queue_engine
+from . import availability, events, qr, versions
+from .booking import book_group
 from .serializers import (
     AppointmentCreateSerializer,
     AppointmentSerializer,
     AppointmentListSerializer,
-    MyAppointmentSerializer
+    GroupBookingSerializer,
+    MyAppointmentSerializer,
+    SlotHoldConfirmSerializer,
 )
 from apps.ops.prediction import predict_wait_minutes
-
-# --- QR generator helper ---
-import json
-from io import BytesIO
-from django.core.files.base import ContentFile
-
-
-def generate_qr(appointment):
-    data = {
-        "token": str(appointment.id),
-        "name": f"{appointment.citizen.first_name} {appointment.citizen.last_name}",
-        "service": appointment.service.name,
-        "department": appointment.service.department,
-        "datetime": appointment.appointment_datetime.strftime("%Y-%m-%d %H:%M"),
-        "estimated_wait": appointment.predicted_wait_minutes
-    }
-    
-    qr = qrcode.QRCode(box_size=8, border=2)
-    qr.add_data(json.dumps(data))  # Encode as JSON
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    return ContentFile(buffer.getvalue(), name=f"{appointment.id}.png")
+from .tasks import send_appointment_confirmation
+
+# --- Conditional GET helpers ---
+def not_modified(request, etag, last_modified):
+    """
+    A 304 response if the client already has this version, else None.
+    Always None without a shared cache, whose versions could be stale.
+    """
+    if not versions.is_shared():
+        return None
+    response = get_conditional_response(request, etag=quote_etag(etag), last_modified=int(last_modified))
+    if response is not None:
+        set_version_headers(response, etag, last_modified)
+    return response
+
+
+def set_version_headers(response, etag, last_modified):
+    if versions.is_shared():
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 # --- Available Slots ---
@@ -60,24 +64,123 @@ def available_slots(request):
 
     try:
         date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        service = Service.objects.get(id=service_id)
-    except (ValueError, Service.DoesNotExist):
+        service_id = int(service_id)
+    except ValueError:
+        return Response({"error": "Invalid date or service_id"}, status=400)
+    if not availability.date_in_range(date_obj):
         return Response({"error": "Invalid date or service_id"}, status=400)
 
-    available_slots = ServiceSlot.objects.filter(
-        service=service,
-        datetime__date=date_obj,
-        is_available=True
-    )
-    
-    slots_data = [{
-        "id": slot.id, 
-        "datetime": slot.datetime,
-        "current_bookings": slot.current_bookings,
-        "max_capacity": slot.max_capacity
-    } for slot in available_slots]
-    
-    return Response(slots_data)
+    version, last_modified = availability.day_version(service_id, date_obj)
+    etag = f'slots-{version}'
+    cached = not_modified(request, etag, last_modified)
+    if cached is not None:
+        return cached
+
+    slots = availability.get_day(service_id, date_obj, version)
+    if slots is None:
+        return Response({"error": "Invalid date or service_id"}, status=400)
+
+    return set_version_headers(Response(availability.as_dicts(slots)), etag, last_modified)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def availability_calendar(request):
+    """
+    Per-day open slot counts and remaining capacity for a month.
+
+    ?month=YYYY-MM (default: this month) and one or more service_id
+    parameters, repeated or comma separated.
+    """
+    month_str = request.query_params.get('month') or timezone.localdate().strftime("%Y-%m")
+    raw_ids = [
+        part for value in request.query_params.getlist('service_id') for part in value.split(',') if part
+    ]
+    if not raw_ids:
+        return Response({"error": "service_id query parameter is required"}, status=400)
+
+    try:
+        month_start = datetime.strptime(month_str, "%Y-%m")
+        service_ids = sorted({int(service_id) for service_id in raw_ids})
+    except ValueError:
+        return Response({"error": "Invalid month or service_id"}, status=400)
+    if not availability.date_in_range(month_start.date()):
+        return Response({"error": "month is out of range"}, status=400)
+    if len(service_ids) > availability.MAX_CALENDAR_SERVICES:
+        return Response(
+            {"error": f"At most {availability.MAX_CALENDAR_SERVICES} services per request"}, status=400
+        )
+
+    digest, last_modified = availability.month_versions(service_ids, month_start.year, month_start.month)
+    etag = f'calendar-{digest}'
+    cached = not_modified(request, etag, last_modified)
+    if cached is not None:
+        return cached
+
+    calendars = availability.get_month(service_ids, month_start.year, month_start.month, digest)
+    if calendars is None:
+        return Response({"error": "Invalid month or service_id"}, status=400)
+
+    data = {
+        "month": month_start.strftime("%Y-%m"),
+        "services": [
+            {"service_id": service_id, "days": calendars[service_id]} for service_id in service_ids
+        ],
+    }
+    return set_version_headers(Response(data), etag, last_modified)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def next_available_slots(request):
+    """
+    The earliest open slots across services.
+
+    Scope with service_id (repeated or comma separated) or department;
+    ?after= (ISO datetime, default now) and ?limit= (default 10).
+    """
+    raw_ids = [
+        part for value in request.query_params.getlist('service_id') for part in value.split(',') if part
+    ]
+    department = request.query_params.get('department')
+    if not raw_ids and not department:
+        return Response({"error": "service_id or department query parameter is required"}, status=400)
+
+    try:
+        after_str = request.query_params.get('after')
+        after = serializers.DateTimeField().to_internal_value(after_str) if after_str else timezone.now()
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), availability.MAX_SEARCH_RESULTS)
+        service_ids = {int(service_id) for service_id in raw_ids}
+    except (ValueError, serializers.ValidationError):
+        return Response({"error": "Invalid after, limit or service_id"}, status=400)
+    # The search window runs up to MAX_SEARCH_DAYS past after
+    if not availability.date_in_range(after.date()):
+        return Response({"error": "after is out of range"}, status=400)
+
+    services = Service.objects.filter(is_active=True)
+    if service_ids:
+        services = services.filter(id__in=service_ids)
+    if department:
+        services = services.filter(department=department)
+    services = {service.id: service for service in services.only('id', 'name', 'department')}
+    if service_ids - services.keys():
+        return Response({"error": "Invalid after, limit or service_id"}, status=400)
+    if len(services) > availability.MAX_SEARCH_SERVICES:
+        return Response({"error": f"At most {availability.MAX_SEARCH_SERVICES} services per search"}, status=400)
+
+    slots = availability.next_available(sorted(services), after, limit) if services else []
+    return Response([
+        {
+            "id": slot_id,
+            "service_id": service_id,
+            "service_name": services[service_id].name,
+            "department": services[service_id].department,
+            "datetime": slot_datetime,
+            "current_bookings": current_bookings,
+            "max_capacity": max_capacity,
+        }
+        for slot_datetime, service_id, slot_id, current_bookings, max_capacity in slots
+    ])
 
 
 # --- Create Appointment ---
@@ -90,80 +193,152 @@ class CreateAppointmentView(generics.CreateAPIView):
         appointment_datetime = serializer.validated_data['appointment_datetime']
         service = serializer.validated_data['service']
 
-        # --- Slot-based booking ---
-        slot = None
+        # --- Slot-based booking; slots not booked yet exist only in the opening hours ---
         if slot_id:
             local_datetime = timezone.localtime(appointment_datetime)
             slot = get_object_or_404(ServiceSlot, id=slot_id, service=service, datetime=local_datetime)
-            if slot.is_full():
-                raise serializers.ValidationError("This time slot is already fully booked.")
+        else:
+            # Resolved (and materialized if needed) by the serializer; None off the template
+            slot = serializer.validated_data.get('slot')
 
-            slot.current_bookings += 1
-            if slot.current_bookings >= slot.max_capacity:
-                slot.is_available = False
-            slot.save()
+        # --- Save appointment; takes one unit of slot capacity atomically ---
+        try:
+            with transaction.atomic():
+                appointment = serializer.save(citizen=self.request.user, slot=slot)
+        except SlotUnavailable as e:
+            raise serializers.ValidationError(str(e))
 
-        # --- Save appointment ---
-        appointment = serializer.save(citizen=self.request.user, slot=slot)
+        return complete_booking(appointment)
 
-        # --- Predict wait time ---
-        predicted_wait = predict_wait_minutes(appointment)
-        appointment.predicted_wait_minutes = predicted_wait
 
-        # --- Generate QR code with full booking details ---
-        qr_img = generate_qr(appointment)
-        appointment.qr_code.save(f"appt_{appointment.id}.png", qr_img, save=True)
-        appointment.save()
+def complete_booking(appointment):
+    """
+    Predict the wait for a new appointment and queue its confirmation.
 
-        # --- Send confirmation email ---
-        local_time = timezone.localtime(appointment.appointment_datetime)
-        subject = "Appointment Confirmation"
-        from_email = settings.DEFAULT_FROM_EMAIL
-        to = [self.request.user.email]
+    The QR code and email are produced by the send_appointment_confirmation
+    task once the booking has committed, outside the request.
+    """
+    predicted_wait = predict_wait_minutes(appointment)
+    appointment.predicted_wait_minutes = predicted_wait
+    appointment.save(update_fields=['predicted_wait_minutes', 'prediction_model_version', 'updated_at'])
 
-        text_content = f"""
-Hello {self.request.user.first_name} {self.request.user.last_name},
+    appointment_id = str(appointment.id)
+    transaction.on_commit(lambda: send_appointment_confirmation.delay(appointment_id))
+    return appointment
 
-Your appointment is confirmed.
 
-📅 Date & Time: {local_time.strftime("%Y-%m-%d %H:%M")}
-📍 Service: {service.name} ({service.department})
-⏳ Estimated Wait Time: {predicted_wait} minutes
-🔑 Token: {appointment.id}
+# --- Group Booking ---
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def create_group_booking(request):
+    """Book several slots at once; either every appointment is created or none"""
+    serializer = GroupBookingSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        appointments = book_group(request.user, serializer.validated_data['appointments'])
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    return Response(AppointmentListSerializer(appointments, many=True).data, status=201)
+
+
+# --- Slot Holds ---
+def hold_data(hold):
+    return {
+        "id": str(hold.id),
+        "slot_id": hold.slot_id,
+        "datetime": hold.slot.datetime,
+        "expires_at": hold.expires_at,
+    }
 
-Please find your QR code attached for check-in.
-"""
 
-        html_content = f"""
-<html>
-  <body style="font-family: Arial, sans-serif; line-height: 1.6;">
-    <h2 style="color:#2c3e50;">Appointment Confirmation</h2>
-    <p>Dear {self.request.user.first_name},</p>
-    <p>Your appointment has been successfully booked. Here are the details:</p>
-    <table style="border-collapse: collapse; margin: 15px 0;">
-      <tr><td><b>Date & Time:</b></td><td>{local_time.strftime("%Y-%m-%d %H:%M")}</td></tr>
-      <tr><td><b>Service:</b></td><td>{service.name} ({service.department})</td></tr>
-      <tr><td><b>Estimated Wait:</b></td><td>{predicted_wait} minutes</td></tr>
-      <tr><td><b>Token:</b></td><td>{appointment.id}</td></tr>
-    </table>
-    <p>Please find your QR code attached for check-in at the counter.</p>
-    <p style="color:gray; font-size: 12px;">This is an automated email. Please do not reply.</p>
-  </body>
-</html>
-"""
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def place_hold(request):
+    """
+    Hold a slot for a few minutes while the citizen completes the booking.
 
-        # Create email and attach QR
-        msg = EmailMultiAlternatives(subject, text_content, from_email, to)
-        msg.attach_alternative(html_content, "text/html")
+    The slot is given by slot_id, or by service_id and datetime for a slot
+    that has no id yet.
+    """
+    try:
+        seconds = int(request.data.get('seconds', SlotHold.DEFAULT_SECONDS))
+        if request.data.get('slot_id') is not None:
+            slot = get_object_or_404(ServiceSlot, id=int(request.data['slot_id']))
+        else:
+            slot_datetime = serializers.DateTimeField().to_internal_value(request.data.get('datetime'))
+            slot = ServiceSlot.for_booking(int(request.data.get('service_id')), slot_datetime)
+            if slot is None:
+                return Response({"error": "Invalid time slot selected."}, status=404)
+    except (TypeError, ValueError, serializers.ValidationError):
+        return Response(
+            {"error": "slot_id, or service_id and datetime, are required; seconds must be an integer"}, status=400
+        )
+    seconds = min(max(seconds, 1), SlotHold.MAX_SECONDS)
+
+    active = SlotHold.objects.filter(citizen=request.user, expires_at__gt=timezone.now()).count()
+    if active >= SlotHold.MAX_PER_CITIZEN:
+        return Response({"error": f"At most {SlotHold.MAX_PER_CITIZEN} slots can be held at a time"}, status=429)
+
+    hold = SlotHold.place(slot, request.user, seconds)
+    if hold is None:
+        return Response({"error": "This time slot is fully booked or not available."}, status=409)
+    return Response(hold_data(hold), status=201)
+
+
+@api_view(['DELETE'])
+@permission_classes([permissions.IsAuthenticated])
+def cancel_hold(request, pk):
+    hold = get_object_or_404(SlotHold, pk=pk, citizen=request.user)
+    hold.cancel()
+    return Response(status=204)
 
-        if appointment.qr_code:
-            qr_image = appointment.qr_code.read()
-            msg.attach(f"appointment_{appointment.id}.png", qr_image, "image/png")
 
-        msg.send()
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def confirm_hold(request, pk):
+    """Book the held slot as an appointment"""
+    hold = get_object_or_404(SlotHold.objects.select_related('slot'), pk=pk, citizen=request.user)
+    serializer = SlotHoldConfirmSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
 
-        return appointment
+    try:
+        appointment = hold.confirm(**serializer.validated_data)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=410)
 
+    complete_booking(appointment)
+    return Response(AppointmentSerializer(appointment).data, status=201)
+
+
+# --- QR Codes ---
+QR_MAX_AGE = 3600
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def appointment_qr(request, pk, image_format):
+    """
+    The appointment's QR code as PNG or SVG, rendered on demand.
+
+    Authorised by the expiring signature in the URL from qr.qr_url(), so it
+    works from an <img> tag. The URL names the payload it was issued for,
+    so a client that has that image gets a 304 without a database read.
+    """
+    if image_format not in qr.RENDERERS:
+        return Response({"error": "Unsupported image format"}, status=404)
+    digest = qr.verify(pk, request.query_params.get('sig', ''))
+    if digest is None:
+        return Response({"error": "Invalid or expired signature"}, status=403)
+
+    etag = qr.etag(digest, image_format)
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        appointment = get_object_or_404(Appointment.objects.select_related('service'), pk=pk)
+        image, etag = qr.render(appointment, image_format)
+        response = HttpResponse(image, content_type=qr.CONTENT_TYPES[image_format])
+    response['ETag'] = quote_etag(etag)
+    response['Cache-Control'] = f'private, max-age={QR_MAX_AGE}'
+    return response
 
 
 # --- My Appointments ---
@@ -212,11 +387,39 @@ def update_appointment_status(request, pk):
     if new_status not in [choice[0] for choice in Appointment.Status.choices]:
         return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
 
+    counter = request.data.get('counter')
+    if counter is not None:
+        try:
+            counter = int(counter)
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid counter'}, status=status.HTTP_400_BAD_REQUEST)
+        if counter < 0:
+            return Response({'error': 'Invalid counter'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if new_status == Appointment.Status.IN_PROGRESS and appointment.status != new_status:
+        # Called by hand rather than through call_next: the wait model's
+        # queue length at booking reads called_at
+        appointment.called_at = timezone.now()
+        if counter is not None:
+            appointment.counter = counter
     appointment.status = new_status
     appointment.save()
     return Response(AppointmentSerializer(appointment).data)
 
 
+# --- Call Next ---
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def call_next(request, service_id, counter):
+    if not (request.user.is_admin or request.user.is_staff_member):
+        return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+    appointment = Appointment.claim_next(service_id, counter)
+    if appointment is None:
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(AppointmentSerializer(appointment).data)
+
+
 # --- Queue Status ---
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -224,14 +427,149 @@ def queue_status(request):
     if not (request.user.is_admin or request.user.is_staff_member):
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-    waiting_appointments = Appointment.objects.filter(status='WAITING').order_by('appointment_datetime')
-    in_progress_appointments = Appointment.objects.filter(status='IN_PROGRESS')
-
-    return Response({
-        'waiting_queue': AppointmentListSerializer(waiting_appointments, many=True).data,
-        'in_progress': AppointmentListSerializer(in_progress_appointments, many=True).data,
-        'total_waiting': waiting_appointments.count(),
-        'total_in_progress': in_progress_appointments.count()
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        service_id = request.query_params.get('service_id')
+        service_ids = [int(service_id)] if service_id else None
+    except ValueError:
+        return Response({'error': 'limit and service_id must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    scope = service_ids[0] if service_ids else versions.ALL_SERVICES
+    etag, last_modified = versions.etag('queue', versions.queue_key(scope), scope, limit)
+    cached = not_modified(request, etag, last_modified)
+    if cached is not None:
+        return cached
+
+    # Heads of the in-memory priority queues; only those rows are read
+    snapshot = queue_engine.snapshot(limit, service_ids)
+    waiting_ids = [appointment_id for _, head, _ in snapshot.values() for appointment_id in head]
+    in_progress_ids = [appointment_id for _, _, ids in snapshot.values() for appointment_id in ids]
+    appointments = Appointment.objects.select_related('service', 'citizen').in_bulk(waiting_ids + in_progress_ids)
+
+    waiting_queue = [appointments[i] for i in waiting_ids if i in appointments]
+    waiting_queue.sort(key=lambda a: (PRIORITY_RANK.get(a.priority, len(PRIORITY_RANK)), a.appointment_datetime))
+    in_progress = [appointments[i] for i in in_progress_ids if i in appointments]
+
+    response = Response({
+        'waiting_queue': AppointmentListSerializer(waiting_queue, many=True).data,
+        'in_progress': AppointmentListSerializer(in_progress, many=True).data,
+        'total_waiting': sum(waiting for waiting, _, _ in snapshot.values()),
+        'total_in_progress': len(in_progress_ids),
+        'queues': [
+            {
+                'service_id': service_id,
+                'total_waiting': waiting,
+                'total_in_progress': len(ids),
+                'next': head[0] if head else None,
+            }
+            for service_id, (waiting, head, ids) in sorted(snapshot.items())
+        ],
     })
+    return set_version_headers(response, etag, last_modified)
+
+
+# --- Live Queue Stream (Server-Sent Events) ---
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'txt'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+# Seconds between event-log polls, keep-alive comments, and stream lifetime;
+# clients reconnect with Last-Event-ID after STREAM_LIFETIME
+STREAM_POLL_INTERVAL = 1
+STREAM_KEEPALIVE = 15
+STREAM_LIFETIME = 300
+# Polls without progress over a gap in the log before forcing a resync
+STREAM_MAX_STALLS = 5
+
+
+def sse_message(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def queue_snapshot(service_ids, limit):
+    """Compact per-service queue state for stream clients"""
+    snapshot = queue_engine.snapshot(limit, service_ids)
+    ids = [i for _, head, in_progress in snapshot.values() for i in head + in_progress]
+    tokens = dict(Appointment.objects.filter(id__in=ids).values_list('id', 'token_code'))
+    return {
+        'queues': [
+            {
+                'service_id': service_id,
+                'total_waiting': waiting,
+                'waiting': [{'appointment_id': str(i), 'token_code': tokens.get(i)} for i in head],
+                'in_progress': [{'appointment_id': str(i), 'token_code': tokens.get(i)} for i in in_progress],
+            }
+            for service_id, (waiting, head, in_progress) in sorted(snapshot.items())
+        ]
+    }
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@renderer_classes([EventStreamRenderer, JSONRenderer])
+def queue_stream(request):
+    """
+    Push queue changes to displays: a snapshot, then delta events
+    (enqueued, called, completed, cancelled, removed).
+
+    Off unless settings.QUEUE_STREAM_ENABLED and the cache is shared: the
+    event log is read from the cache, so with a per-process cache a stream
+    would only see the events of its own worker.
+    """
+    if not (request.user.is_admin or request.user.is_staff_member):
+        return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+    if not (settings.QUEUE_STREAM_ENABLED and versions.is_shared()):
+        return Response({'error': 'The live queue stream is not enabled; poll queue/status/ instead'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    try:
+        service_id = request.query_params.get('service_id')
+        service_ids = [int(service_id)] if service_id else None
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('last_event_id')
+        sequence = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return Response({'error': 'service_id, limit and Last-Event-ID must be integers'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    def stream(sequence):
+        yield f"retry: {STREAM_POLL_INTERVAL * 3000}\n\n"
+        if sequence is None:
+            sequence = events.current_sequence()
+            yield sse_message('snapshot', queue_snapshot(service_ids, limit), sequence)
+
+        started = last_sent = time.monotonic()
+        stalls = 0
+        while time.monotonic() - started < STREAM_LIFETIME:
+            new_events, last = events.read_since(sequence)
+            if new_events is None or stalls >= STREAM_MAX_STALLS:
+                sequence = events.current_sequence()
+                stalls = 0
+                yield sse_message('snapshot', queue_snapshot(service_ids, limit), sequence)
+                last_sent = time.monotonic()
+                continue
+
+            stalls = stalls + 1 if not new_events and events.current_sequence() > sequence else 0
+            for event in new_events:
+                if service_ids is None or event['service_id'] in service_ids:
+                    yield sse_message(event['type'], event, event['seq'])
+                    last_sent = time.monotonic()
+            sequence = last
+
+            if time.monotonic() - last_sent >= STREAM_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(STREAM_POLL_INTERVAL)
+
+    response = StreamingHttpResponse(stream(sequence), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
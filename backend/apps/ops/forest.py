@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class CompiledForest:
+    """
+    Pure-NumPy evaluator for a random forest regressor.
+
+    The forest is stored as flat arrays covering the nodes of every tree
+    (see export_forest_arrays in ml/train_model.py). Leaves are rewritten to
+    point at themselves, so each row simply takes max_depth steps down all
+    trees at once and the leaf values are averaged, like sklearn does.
+    """
+
+    # Rows scored per step; bounds the (rows x trees) node matrix
+    CHUNK_SIZE = 8192
+
+    def __init__(self, feature, threshold, children_left, children_right, value, roots, max_depth):
+        is_leaf = children_left < 0
+        nodes = np.arange(len(feature))
+        self.feature = np.where(is_leaf, 0, feature).astype(np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.children_left = np.where(is_leaf, nodes, children_left).astype(np.intp)
+        self.children_right = np.where(is_leaf, nodes, children_right).astype(np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def load(cls, path):
+        """Load a forest exported with export_forest_arrays"""
+        with np.load(path) as data:
+            return cls(
+                data['feature'],
+                data['threshold'],
+                data['children_left'],
+                data['children_right'],
+                data['value'],
+                data['roots'],
+                data['max_depth'],
+            )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def predict(self, X):
+        """Predict one row (1-d) or a batch of rows (2-d); always returns a 1-d array"""
+        # sklearn compares float32 features against float64 thresholds
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        if len(X) <= self.CHUNK_SIZE:
+            return self._predict_chunk(X)
+        return np.concatenate([
+            self._predict_chunk(X[start:start + self.CHUNK_SIZE])
+            for start in range(0, len(X), self.CHUNK_SIZE)
+        ])
+
+    def _predict_chunk(self, X):
+        rows = np.arange(len(X))[:, None]
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.children_left[nodes], self.children_right[nodes])
+        return self.value[nodes].mean(axis=1)
@@ -0,0 +1,124 @@
+import glob
+import json
+import os
+import numpy as np
+from .registry import file_version
+
+
+# Default grid, one entry per feature in FEATURE_COLUMNS order
+DEFAULT_AXES = {
+    'hour': list(range(8, 18)),
+    'weekday': list(range(7)),
+    'service_avg_minutes': list(range(5, 61)),
+    'queue_length': list(range(0, 81)),
+    'counters_active': list(range(1, 7)),
+    'priority': [1, 2, 3, 4],
+}
+
+# Rows evaluated per model call while building
+BUILD_CHUNK_SIZE = 100000
+
+
+def table_path_for(path, stamp):
+    """Path of the table file with the given content stamp, next to the pointer at path"""
+    return f'{os.path.splitext(path)[0]}-{stamp}.npy'
+
+
+class WaitLookupTable:
+    """
+    Precomputed predictions for every point of a discrete feature grid.
+
+    The table is a memory-mapped uint16 array with one axis per feature.
+    Each axis keeps a position array mapping a feature value to its index
+    (-1 for values outside the grid), so a lookup is a handful of array
+    reads. Values are floored model outputs, matching int(prediction).
+    """
+
+    def __init__(self, table, axes, model_version):
+        self.table = table
+        self.axes = axes
+        self.model_version = model_version
+        self.positions = []
+        for values in axes.values():
+            positions = np.full(max(values) + 1, -1, dtype=np.intp)
+            positions[values] = np.arange(len(values))
+            self.positions.append(positions)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map the table the pointer file at path names (see build_lookup_table)"""
+        with open(path) as f:
+            pointer = json.load(f)
+        table = np.load(os.path.join(os.path.dirname(path), pointer['table']), mmap_mode='r')
+        return cls(table, pointer['axes'], pointer['model_version'])
+
+    def lookup(self, row):
+        """Prediction for one feature row, or None when it falls outside the grid"""
+        index = []
+        for value, positions in zip(row, self.positions):
+            value = int(value)
+            if value < 0 or value >= len(positions) or positions[value] < 0:
+                return None
+            index.append(positions[value])
+        return int(self.table[tuple(index)])
+
+    def lookup_many(self, matrix):
+        """Predictions for a feature matrix plus a mask of rows found in the grid"""
+        matrix = np.asarray(matrix, dtype=np.intp)
+        found = np.ones(len(matrix), dtype=bool)
+        axis_indices = []
+        for column, positions in enumerate(self.positions):
+            values = matrix[:, column]
+            in_range = (values >= 0) & (values < len(positions))
+            axis_index = np.where(in_range, positions[np.clip(values, 0, len(positions) - 1)], -1)
+            found &= axis_index >= 0
+            axis_indices.append(axis_index)
+        index = tuple(np.where(found, axis_index, 0) for axis_index in axis_indices)
+        return np.asarray(self.table[index], dtype=np.int64), found
+
+
+def build_lookup_table(predict, model_version, path, axes=None):
+    """
+    Evaluate predict over the whole grid and publish it at path.
+
+    The table goes to its own file named after its content hash and is
+    never modified afterwards. path is a small JSON pointer holding the
+    table's file name, axes and model version, replaced in one os.replace,
+    so a reader always gets a table together with its own axes. The table
+    the previous pointer named is kept for readers that still map it;
+    older ones are removed. Returns the number of grid points.
+    """
+    axes = {name: sorted(set(int(v) for v in values)) for name, values in (axes or DEFAULT_AXES).items()}
+    axis_values = [np.asarray(values, dtype=np.float32) for values in axes.values()]
+    shape = tuple(len(values) for values in axis_values)
+    size = int(np.prod(shape))
+
+    table = np.empty(size, dtype=np.uint16)
+    for start in range(0, size, BUILD_CHUNK_SIZE):
+        flat = np.arange(start, min(start + BUILD_CHUNK_SIZE, size))
+        indices = np.unravel_index(flat, shape)
+        matrix = np.column_stack([values[i] for values, i in zip(axis_values, indices)])
+        predictions = np.floor(predict(matrix))
+        table[start:start + len(flat)] = np.clip(predictions, 0, np.iinfo(np.uint16).max)
+
+    tmp_table_path = table_path_for(path, 'tmp')
+    with open(tmp_table_path, 'wb') as f:
+        np.save(f, table.reshape(shape))
+    table_path = table_path_for(path, file_version(tmp_table_path))
+    os.replace(tmp_table_path, table_path)
+
+    keep = {table_path}
+    try:
+        with open(path) as f:
+            keep.add(os.path.join(os.path.dirname(path), json.load(f)['table']))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'table': os.path.basename(table_path), 'axes': axes, 'model_version': model_version}, f)
+    os.replace(path + '.tmp', path)
+
+    for old_path in glob.glob(table_path_for(path, '*')):
+        if old_path not in keep:
+            os.remove(old_path)
+    return size
@@ -0,0 +1,43 @@
+# apps/ops/management/commands/build_wait_lookup.py
+import time
+from django.core.management.base import BaseCommand, CommandError
+from apps.services.models import Service
+from apps.ops.lookup import DEFAULT_AXES, build_lookup_table
+from apps.ops.prediction import LOOKUP_PATH, get_predictor
+
+class Command(BaseCommand):
+    help = 'Precompute wait predictions over the discrete feature grid'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue-max', type=int, default=max(DEFAULT_AXES['queue_length']),
+                            help='Largest queue length covered by the table')
+        parser.add_argument('--counters-max', type=int, default=max(DEFAULT_AXES['counters_active']),
+                            help='Largest number of active counters covered by the table')
+        parser.add_argument('--all-service-minutes', action='store_true',
+                            help='Cover the full default service-minutes range instead of current services only')
+        parser.add_argument('--output', default=LOOKUP_PATH)
+
+    def handle(self, *args, **options):
+        predictor = get_predictor()
+        if predictor is None:
+            raise CommandError('No trained model found; run ml/train_model.py first')
+        predict, version = predictor
+
+        axes = dict(DEFAULT_AXES)
+        axes['queue_length'] = list(range(0, options['queue_max'] + 1))
+        axes['counters_active'] = list(range(1, options['counters_max'] + 1))
+        if not options['all_service_minutes']:
+            # Only the service durations that exist keep the grid small
+            minutes = set(Service.objects.values_list('avg_service_minutes', flat=True))
+            if minutes:
+                axes['service_avg_minutes'] = sorted(minutes)
+
+        started = time.perf_counter()
+        size = build_lookup_table(predict, version, options['output'], axes)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Built {size} predictions for model {version} in {elapsed:.1f}s -> {options["output"]}'
+            )
+        )
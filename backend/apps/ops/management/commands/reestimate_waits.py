@@ -0,0 +1,30 @@
+# apps/ops/management/commands/reestimate_waits.py
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from apps.ops.prediction import reestimate_day
+
+class Command(BaseCommand):
+    help = 'Re-estimate predicted wait times for all scheduled/waiting appointments of a day'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to refresh as YYYY-MM-DD (default: today)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format')
+        else:
+            day = timezone.localdate()
+
+        started = time.perf_counter()
+        updated = reestimate_day(day, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Re-estimated {updated} appointments for {day} in {elapsed:.2f}s')
+        )
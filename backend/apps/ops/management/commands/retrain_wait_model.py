@@ -0,0 +1,50 @@
+# apps/ops/management/commands/retrain_wait_model.py
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.ops.retraining import publish_model, retrain
+
+class Command(BaseCommand):
+    help = 'Retrain the wait-time model on completed appointments and publish a new version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since-days', type=int,
+                            help='Only learn from appointments of the last N days (default: all history)')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Rows streamed from the database per fitting step')
+        parser.add_argument('--trees-per-chunk', type=int, default=10)
+        parser.add_argument('--max-trees', type=int, default=200,
+                            help='Oldest trees are dropped beyond this size')
+        parser.add_argument('--fresh', action='store_true',
+                            help='Start a new forest instead of extending the published model')
+        parser.add_argument('--dry-run', action='store_true', help='Train but do not publish')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since_days']:
+            since = timezone.now() - timedelta(days=options['since_days'])
+
+        started = time.perf_counter()
+        model, rows_used = retrain(
+            since=since,
+            chunk_size=options['chunk_size'],
+            trees_per_chunk=options['trees_per_chunk'],
+            max_trees=options['max_trees'],
+            warm_start=not options['fresh'],
+            stdout=self.stdout,
+        )
+        elapsed = time.perf_counter() - started
+
+        if model is None:
+            self.stdout.write(self.style.WARNING('No completed appointments to train on; model unchanged'))
+            return
+
+        if options['dry_run']:
+            self.stdout.write(f'Trained on {rows_used} rows in {elapsed:.1f}s (dry run, not published)')
+            return
+
+        version = publish_model(model)
+        self.stdout.write(
+            self.style.SUCCESS(f'Published model {version} trained on {rows_used} rows in {elapsed:.1f}s')
+        )
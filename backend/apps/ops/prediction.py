@@ -1,95 +1,255 @@
 import os
-import joblib
-import pandas as pd
+import numpy as np
 from django.conf import settings
 from datetime import datetime, timedelta
+from apps.appointments import counters
 from apps.appointments.models import Appointment
-from django.db.models import Avg
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Func, IntegerField, Max, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .forest import CompiledForest
+from .lookup import WaitLookupTable
+from .registry import ModelRegistry
 
 
 
 # Path to the trained model
 MODEL_PATH = os.path.join(settings.BASE_DIR, 'ml', 'wait_predictor.joblib')
 
+# Flattened copy of the same model, scored with NumPy only (see ml/train_model.py)
+FOREST_PATH = os.path.join(settings.BASE_DIR, 'ml', 'wait_predictor_forest.npz')
+
+# Pointer to the predictions precomputed over the discrete feature grid (see build_wait_lookup)
+LOOKUP_PATH = os.path.join(settings.BASE_DIR, 'ml', 'wait_lookup.json')
+
+# Version reported for predictions made without the ML model
+FALLBACK_VERSION = 'fallback'
+
+# Feature order the model was trained with (see ml/train_model.py)
+FEATURE_COLUMNS = ['hour', 'weekday', 'service_avg_minutes', 'queue_length', 'counters_active', 'priority']
+
+# Priority mapping
+PRIORITY_LEVELS = {'NORMAL': 1, 'ELDERLY': 2, 'DISABLED': 3, 'EMERGENCY': 4}
+
+# Simulate active counters (could be made dynamic)
+DEFAULT_COUNTERS_ACTIVE = 3
+
+# Statuses that count towards the queue length feature
+QUEUED_STATUSES = ['SCHEDULED', 'WAITING']
+
+# Seconds the dashboard analytics are reused before being recomputed
+ANALYTICS_CACHE_TTL = 30
+
+# One registry per worker process; the model is reloaded only when the file changes
+model_registry = ModelRegistry(MODEL_PATH)
+forest_registry = ModelRegistry(FOREST_PATH, loader=CompiledForest.load)
+lookup_registry = ModelRegistry(LOOKUP_PATH, loader=WaitLookupTable.load)
+
 def load_model():
     """Load the trained ML model"""
-    try:
-        if os.path.exists(MODEL_PATH):
-            return joblib.load(MODEL_PATH)
-        else:
-            print(f"Model file not found at {MODEL_PATH}")
-            return None
-    except Exception as e:
-        print(f"Error loading model: {e}")
+    loaded = model_registry.get()
+    if loaded is None:
+        print(f"Model file not found at {MODEL_PATH}")
         return None
+    return loaded.model
+
+def get_predictor():
+    """
+    Return (predict, version) for the best available model, or None.
+
+    The compiled forest is preferred; the sklearn model is only used when
+    no exported arrays exist. Only the file's version is read here: the
+    model itself is loaded by the first call to predict, so a worker whose
+    rows are all answered by the lookup table never loads it. predict
+    takes a 2-d feature matrix in FEATURE_COLUMNS order and returns one
+    raw prediction per row.
+    """
+    version = forest_registry.version()
+    if version is not None:
+        def predict(matrix):
+            return forest_registry.get().model.predict(matrix)
+        
+        return predict, version
+    
+    version = model_registry.version()
+    if version is not None:
+        def predict(matrix):
+            import pandas as pd
+            return model_registry.get().model.predict(pd.DataFrame(matrix, columns=FEATURE_COLUMNS))
+        
+        return predict, version
+    return None
+
+def get_lookup_table(version):
+    """Return the lookup table if it was built from the given model version"""
+    loaded = lookup_registry.get()
+    if loaded is not None and loaded.model.model_version == version:
+        return loaded.model
+    return None
+
+def predict_rows(predict, version, matrix):
+    """
+    Raw predictions for a feature matrix.
+
+    Rows inside the precomputed grid are answered from the lookup table;
+    only the rest are sent to the model.
+    """
+    table = get_lookup_table(version)
+    if table is None:
+        return predict(matrix)
+    
+    if len(matrix) == 1:
+        prediction = table.lookup(matrix[0])
+        return [prediction] if prediction is not None else predict(matrix)
+    
+    predictions, found = table.lookup_many(matrix)
+    predictions = predictions.astype(np.float64)
+    if not found.all():
+        predictions[~found] = predict(matrix[~found])
+    return predictions
 
 def predict_wait_minutes(appointment):
-    """Predict wait time for an appointment using ML model"""
+    """
+    Predict wait time for an appointment using ML model.
+
+    The version of the model that produced the estimate is recorded on
+    appointment.prediction_model_version (the appointment is not saved).
+    """
+    minutes, version = predict_wait(appointment)
+    appointment.prediction_model_version = version
+    return minutes
+
+def predict_wait(appointment):
+    """Predict wait time, returning (minutes, model_version)"""
     try:
-        model = load_model()
+        predictor = get_predictor()
         
-        if model is None:
+        if predictor is None:
             # Fallback: simple estimation based on service time and queue
-            return estimate_wait_time_fallback(appointment)
+            return estimate_wait_time_fallback(appointment), FALLBACK_VERSION
+        predict, version = predictor
         
-        # Prepare features
-        appt_datetime = appointment.appointment_datetime
-        hour = appt_datetime.hour
-        weekday = appt_datetime.weekday()
-        service_avg = appointment.service.avg_service_minutes
+        appt_date = timezone.localtime(appointment.appointment_datetime).date()
         
-        # Count current queue length for the same service
-        queue_length = Appointment.objects.filter(
-            service=appointment.service,
-            appointment_datetime__date=appt_datetime.date(),
-            status__in=['SCHEDULED', 'WAITING']
-        ).count()
+        # Current queue length for the same service, from the day counter
+        queue_length = counters.queue_length(appointment.service_id, appt_date)
         
-        # Simulate active counters (could be made dynamic)
-        counters_active = 3  # Default assumption
-        
-        # Priority mapping
-        priority_map = {'NORMAL': 1, 'ELDERLY': 2, 'DISABLED': 3, 'EMERGENCY': 4}
-        priority_level = priority_map.get(appointment.priority, 1)
-        
-        # Create feature array
-        features = pd.DataFrame({
-            'hour': [hour],
-            'weekday': [weekday],
-            'service_avg_minutes': [service_avg],
-            'queue_length': [queue_length],
-            'counters_active': [counters_active],
-            'priority': [priority_level]
-        })
+        features = build_feature_matrix([appointment], [queue_length])
         
         # Make prediction
-        prediction = model.predict(features)[0]
-        
-        # Ensure reasonable bounds
-        min_wait = max(5, service_avg // 2)  # Minimum 5 minutes or half service time
-        max_wait = service_avg * 10  # Maximum 10x service time
-        
-        predicted_wait = max(min_wait, min(max_wait, int(prediction)))
+        prediction = predict_rows(predict, version, features)[0]
         
-        return predicted_wait
+        return clamp_prediction(prediction, appointment.service.avg_service_minutes), version
         
     except Exception as e:
         print(f"Error in prediction: {e}")
-        return estimate_wait_time_fallback(appointment)
+        return estimate_wait_time_fallback(appointment), FALLBACK_VERSION
+
+def predict_wait_minutes_batch(appointments):
+    """
+    Predict wait times for many appointments at once.
+
+    Accepts a list or queryset. Queue lengths come from one grouped COUNT
+    and the model is called once for the whole feature matrix. Returns a
+    list of (minutes, model_version) in the same order as the input.
+    """
+    appointments = list(appointments)
+    if not appointments:
+        return []
+    
+    predictor = get_predictor()
+    if predictor is None:
+        return [(estimate_wait_time_fallback(a), FALLBACK_VERSION) for a in appointments]
+    predict, version = predictor
+    
+    try:
+        queue_lengths = get_queue_lengths(appointments)
+        lengths = [
+            queue_lengths.get((a.service_id, timezone.localtime(a.appointment_datetime).date()), 0)
+            for a in appointments
+        ]
+        predictions = predict_rows(predict, version, build_feature_matrix(appointments, lengths))
+    except Exception as e:
+        print(f"Error in batch prediction: {e}")
+        return [(estimate_wait_time_fallback(a), FALLBACK_VERSION) for a in appointments]
+    
+    return [
+        (clamp_prediction(prediction, appointment.service.avg_service_minutes), version)
+        for appointment, prediction in zip(appointments, predictions)
+    ]
+
+def get_queue_lengths(appointments):
+    """Queued appointments per (service_id, local date), read from the day counters in one query"""
+    return counters.queue_lengths(
+        (a.service_id, timezone.localtime(a.appointment_datetime).date()) for a in appointments
+    )
+
+def build_feature_matrix(appointments, queue_lengths):
+    """Build the model's feature matrix (FEATURE_COLUMNS order) for appointments and their queue lengths"""
+    matrix = np.empty((len(appointments), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for row, (appointment, queue_length) in enumerate(zip(appointments, queue_lengths)):
+        local_dt = timezone.localtime(appointment.appointment_datetime)
+        matrix[row] = (
+            local_dt.hour,
+            local_dt.weekday(),
+            appointment.service.avg_service_minutes,
+            queue_length,
+            DEFAULT_COUNTERS_ACTIVE,
+            PRIORITY_LEVELS.get(appointment.priority, 1),
+        )
+    return matrix
+
+def clamp_prediction(prediction, service_avg):
+    """Keep a raw model output within reasonable bounds for the service"""
+    min_wait = max(5, service_avg // 2)  # Minimum 5 minutes or half service time
+    max_wait = service_avg * 10  # Maximum 10x service time
+    return max(min_wait, min(max_wait, int(prediction)))
+
+def reestimate_day(day, batch_size=2000):
+    """
+    Re-predict predicted_wait_minutes for every queued appointment of a day.
+
+    Appointments are scored and written back in batches with bulk_update.
+    Returns the number of appointments updated.
+    """
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    end = start + timedelta(days=1)
+    
+    appointments = Appointment.objects.filter(
+        appointment_datetime__gte=start,
+        appointment_datetime__lt=end,
+        status__in=QUEUED_STATUSES
+    ).select_related('service').order_by('appointment_datetime')
+    
+    updated = 0
+    batch = []
+    for appointment in appointments.iterator(chunk_size=batch_size):
+        batch.append(appointment)
+        if len(batch) >= batch_size:
+            updated += _reestimate_batch(batch)
+            batch = []
+    if batch:
+        updated += _reestimate_batch(batch)
+    return updated
+
+def _reestimate_batch(appointments):
+    for appointment, (minutes, version) in zip(appointments, predict_wait_minutes_batch(appointments)):
+        appointment.predicted_wait_minutes = minutes
+        appointment.prediction_model_version = version
+    Appointment.objects.bulk_update(
+        appointments, ['predicted_wait_minutes', 'prediction_model_version']
+    )
+    return len(appointments)
 
 def estimate_wait_time_fallback(appointment):
     """Fallback estimation when ML model is not available"""
     base_time = appointment.service.avg_service_minutes
     
-    # Count appointments scheduled around the same time
-    start_time = appointment.appointment_datetime - timedelta(hours=1)
-    end_time = appointment.appointment_datetime + timedelta(hours=1)
-    
-    nearby_appointments = Appointment.objects.filter(
-        service=appointment.service,
-        appointment_datetime__range=(start_time, end_time),
-        status__in=['SCHEDULED', 'WAITING']
-    ).count()
+    # Count appointments scheduled around the same time (hour buckets either side)
+    nearby_appointments = counters.queued_around(
+        appointment.service_id, appointment.appointment_datetime, hours=1
+    )
     
     # Simple calculation: base time * queue factor
     queue_factor = max(1, nearby_appointments * 0.5)
@@ -103,36 +263,69 @@ def estimate_wait_time_fallback(appointment):
     
     return min(estimated_wait, base_time * 8)  # Cap at 8x service time
 
-def get_queue_analytics():
-    """Get queue analytics data"""
-    today = datetime.now().date()
-    
-    # Today's appointments by status
-    today_appointments = Appointment.objects.filter(
-        appointment_datetime__date=today
+def _all_time_count():
+    """
+    (SELECT COUNT(*) FROM appointments) as an uncorrelated scalar subquery,
+    so the all-time total comes back with the day's aggregates instead of
+    costing a second query.
+    """
+    return Subquery(
+        Appointment.objects.order_by()
+        .annotate(total=Func(F('pk'), function='COUNT', output_field=IntegerField()))
+        .values('total')
     )
-    
-    status_counts = {}
-    for status_choice in Appointment.Status.choices:
-        status_counts[status_choice[1]] = today_appointments.filter(
-            status=status_choice[0]
-        ).count()
-    
-    # Average wait times by priority
-    priority_wait_times = {}
-    for priority_choice in Appointment.Priority.choices:
-        avg_wait = today_appointments.filter(
-            priority=priority_choice[0]
-        ).aggregate(
-            avg_wait=Avg('predicted_wait_minutes')
-        )['avg_wait'] or 0
-        priority_wait_times[priority_choice[1]] = round(avg_wait, 1)
-    
+
+
+def _compute_queue_analytics(date):
+    start = timezone.make_aware(datetime.combine(date, datetime.min.time()))
+    end = start + timedelta(days=1)
+
+    aggregates = {
+        'total': Count('id'),
+        'queue_length': Count('id', filter=Q(status__in=QUEUED_STATUSES)),
+    }
+    for value, _ in Appointment.Status.choices:
+        aggregates[f'status_{value}'] = Count('id', filter=Q(status=value))
+    for value, _ in Appointment.Priority.choices:
+        aggregates[f'wait_{value}'] = Avg('predicted_wait_minutes', filter=Q(priority=value))
+    # aggregate() only takes aggregate expressions, so the subquery goes in
+    # wrapped in MAX(). It has the same value on every row, so MAX() returns
+    # it unchanged; on a day without appointments there are no rows and MAX()
+    # is NULL, and COALESCE falls back to evaluating the subquery on its own.
+    all_time = _all_time_count()
+    aggregates['all_time'] = Coalesce(Max(all_time), all_time)
+
+    # A range on the column rather than __date, so the appointment_datetime index applies
+    row = Appointment.objects.filter(
+        appointment_datetime__gte=start, appointment_datetime__lt=end
+    ).aggregate(**aggregates)
+
     return {
-        'total_today': today_appointments.count(),
-        'status_breakdown': status_counts,
-        'avg_wait_by_priority': priority_wait_times,
-        'current_queue_length': today_appointments.filter(
-            status__in=['SCHEDULED', 'WAITING']
-        ).count()
+        'total_today': row['total'],
+        'status_breakdown': {
+            label: row[f'status_{value}'] for value, label in Appointment.Status.choices
+        },
+        'avg_wait_by_priority': {
+            label: round(row[f'wait_{value}'] or 0, 1) for value, label in Appointment.Priority.choices
+        },
+        'current_queue_length': row['queue_length'],
+        'completed_today': row[f'status_{Appointment.Status.COMPLETED}'],
+        'total_appointments_all_time': row['all_time'],
     }
+
+
+def get_queue_analytics(date=None):
+    """
+    Appointment counts by status, average predicted wait by priority and
+    queue length for date (default today), plus the all-time total.
+
+    Computed with one aggregate query and cached for
+    ANALYTICS_CACHE_TTL seconds, so dashboards polling together share it.
+    """
+    date = date or timezone.localdate()
+    key = f'analytics:queue:{date.isoformat()}'
+    analytics = cache.get(key)
+    if analytics is None:
+        analytics = _compute_queue_analytics(date)
+        cache.set(key, analytics, ANALYTICS_CACHE_TTL)
+    return analytics
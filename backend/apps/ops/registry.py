@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+
+import joblib
+
+
+class LoadedModel:
+    """A model object together with the file state it was loaded from"""
+
+    def __init__(self, model, path, mtime, size, version):
+        self.model = model
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.version = version
+
+
+def file_version(path):
+    """Short content hash identifying a model file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+class ModelRegistry:
+    """
+    Process-wide cache for a model file.
+
+    The file is loaded once per worker and kept in memory. Every call to
+    get() stats the file; when its mtime or size changed, the content hash
+    is recomputed and the model is reloaded only if the hash differs. The
+    new LoadedModel replaces the old one in a single assignment, so readers
+    always see either the old or the new model, never a half-loaded one.
+    """
+
+    def __init__(self, path, loader=joblib.load):
+        self.path = path
+        self.loader = loader
+        self._current = None
+        self._hashed = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        """
+        Version of the model get() would return, without loading it; None
+        if there is neither a file nor a loaded model. The file is only
+        hashed again when its mtime or size changed.
+        """
+        current = self._current
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return current.version if current is not None else None
+        if current is not None and current.mtime == stat.st_mtime and current.size == stat.st_size:
+            return current.version
+        hashed = self._hashed
+        if hashed is None or hashed[:2] != (stat.st_mtime, stat.st_size):
+            hashed = self._hashed = (stat.st_mtime, stat.st_size, file_version(self.path))
+        return hashed[2]
+
+    def get(self):
+        """Return the current LoadedModel, or None if the file is missing"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self._current
+
+        current = self._current
+        if current is not None and current.mtime == stat.st_mtime and current.size == stat.st_size:
+            return current
+
+        with self._lock:
+            current = self._current
+            if current is not None and current.mtime == stat.st_mtime and current.size == stat.st_size:
+                return current
+            try:
+                version = file_version(self.path)
+                if current is not None and current.version == version:
+                    # Touched but unchanged: remember the new stat, keep the model
+                    current = LoadedModel(current.model, self.path, stat.st_mtime, stat.st_size, version)
+                else:
+                    model = self.loader(self.path)
+                    current = LoadedModel(model, self.path, stat.st_mtime, stat.st_size, version)
+                    print(f"Loaded model {self.path} (version {version})")
+                self._current = current
+            except Exception as e:
+                # Keep serving the previous model if the new file is unreadable
+                # (e.g. caught half-written); the next call will try again.
+                print(f"Error loading model {self.path}: {e}")
+            return self._current
+
+    def clear(self):
+        """Forget the cached model so the next get() reloads from disk"""
+        with self._lock:
+            self._current = None
@@ -0,0 +1,204 @@
+import os
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+import joblib
+import pandas as pd
+from django.conf import settings
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from apps.appointments.models import Appointment
+from .prediction import (
+    DEFAULT_COUNTERS_ACTIVE, FEATURE_COLUMNS, FOREST_PATH, MODEL_PATH, PRIORITY_LEVELS,
+)
+from .registry import file_version
+
+# Every published model is kept here; MODEL_PATH always holds the latest one
+MODELS_DIR = os.path.join(settings.BASE_DIR, 'ml', 'models')
+
+
+def completed_appointments(since=None):
+    """Completed appointments with a recorded actual wait, oldest first"""
+    appointments = Appointment.objects.filter(
+        status=Appointment.Status.COMPLETED,
+        actual_wait_minutes__isnull=False,
+    )
+    if since is not None:
+        appointments = appointments.filter(appointment_datetime__gte=since)
+    return appointments.order_by('appointment_datetime')
+
+
+def iter_training_chunks(since=None, chunk_size=50000):
+    """
+    Yield (features, target) DataFrames built from real appointment outcomes.
+
+    Rows are streamed with QuerySet.iterator(), which uses a server-side
+    cursor on PostgreSQL, so only one chunk is held in memory. queue_length
+    is what serving reads from the day counters when the appointment is
+    booked: the appointments of the same service and day that were queued
+    (SCHEDULED or WAITING) at that moment, see _queued_at_booking().
+    """
+    rows = completed_appointments(since).values_list(
+        'appointment_datetime', 'service_id', 'service__avg_service_minutes',
+        'priority', 'actual_wait_minutes', 'created_at',
+    ).iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _build_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield _build_chunk(chunk)
+
+
+def _build_chunk(rows):
+    local_times = [timezone.localtime(row[0]) for row in rows]
+    queue_lengths = _queued_at_booking(
+        [(row[1], dt.date(), row[5]) for row, dt in zip(rows, local_times)],
+        local_times[0].date(),
+        local_times[-1].date(),
+    )
+
+    features = pd.DataFrame({
+        'hour': [dt.hour for dt in local_times],
+        'weekday': [dt.weekday() for dt in local_times],
+        'service_avg_minutes': [row[2] for row in rows],
+        'queue_length': queue_lengths,
+        'counters_active': DEFAULT_COUNTERS_ACTIVE,
+        'priority': [PRIORITY_LEVELS.get(row[3], 1) for row in rows],
+    }, columns=FEATURE_COLUMNS)
+    target = pd.Series([row[4] for row in rows], name='wait_minutes')
+    return features, target
+
+
+def _queued_at_booking(bookings, first_day, last_day):
+    """
+    Queue length seen by each (service_id, local day, created_at) booking.
+
+    An appointment of the same service and day was queued at moment t if it
+    had been created by then and not yet called to a counter, so the length
+    is (created <= t) - (called <= t), the booking itself included, as the
+    day counter already holds it when the prediction is made. Cancellation
+    times are not recorded, so cancelled appointments are left out. One
+    query covers the chunk's services and days.
+    """
+    start = timezone.make_aware(datetime.combine(first_day, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), datetime.min.time()))
+    rows = Appointment.objects.filter(
+        service_id__in={service_id for service_id, _, _ in bookings},
+        appointment_datetime__gte=start,
+        appointment_datetime__lt=end,
+    ).exclude(
+        status=Appointment.Status.CANCELLED
+    ).annotate(
+        day=TruncDate('appointment_datetime')
+    ).values_list('service_id', 'day', 'created_at', 'called_at')
+
+    created = defaultdict(list)
+    called = defaultdict(list)
+    for service_id, day, created_at, called_at in rows:
+        created[service_id, day].append(created_at)
+        if called_at is not None:
+            called[service_id, day].append(called_at)
+    for times in (*created.values(), *called.values()):
+        times.sort()
+
+    return [
+        bisect_right(created[service_id, day], at) - bisect_right(called[service_id, day], at)
+        for service_id, day, at in bookings
+    ]
+
+
+def last_published():
+    """When the live model was published, or None if there is none"""
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(MODEL_PATH), tz=dt_timezone.utc)
+    except OSError:
+        return None
+
+
+def new_forest():
+    """An empty forest with the same hyperparameters as ml/train_model.py"""
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(
+        n_estimators=0,
+        max_depth=15,
+        min_samples_split=5,
+        min_samples_leaf=2,
+        random_state=42,
+        n_jobs=-1,
+        warm_start=True,
+    )
+
+
+def retrain(since=None, chunk_size=50000, trees_per_chunk=10, max_trees=200,
+            min_chunk_rows=1000, warm_start=True, stdout=None):
+    """
+    Grow the wait-time forest on real appointment outcomes.
+
+    With warm_start the currently published model is extended, otherwise a
+    new forest is started. Each chunk adds trees_per_chunk trees fitted on
+    that chunk only; when the forest exceeds max_trees the oldest trees are
+    dropped, which bounds both model size and training memory. Returns
+    (model, rows_used) or (None, 0) when there was nothing to learn from.
+    """
+    model = None
+    if warm_start and os.path.exists(MODEL_PATH):
+        model = joblib.load(MODEL_PATH)
+        model.set_params(warm_start=True)
+    if model is None:
+        model = new_forest()
+
+    rows_used = 0
+    trained = False
+    for features, target in iter_training_chunks(since, chunk_size):
+        if len(features) < min_chunk_rows:
+            if stdout:
+                stdout.write(f"Skipping final chunk of {len(features)} rows (< {min_chunk_rows})")
+            continue
+
+        model.set_params(n_estimators=len(getattr(model, 'estimators_', [])) + trees_per_chunk)
+        model.fit(features, target)
+        if len(model.estimators_) > max_trees:
+            model.estimators_ = model.estimators_[-max_trees:]
+            model.set_params(n_estimators=max_trees)
+
+        rows_used += len(features)
+        trained = True
+        if stdout:
+            stdout.write(f"Fitted {trees_per_chunk} trees on {len(features)} rows ({len(model.estimators_)} trees total)")
+
+    if not trained:
+        return None, 0
+    return model, rows_used
+
+
+def publish_model(model):
+    """
+    Save a versioned copy of model and make it the live model.
+
+    The versioned file goes to ml/models/; MODEL_PATH and the compiled
+    forest arrays are replaced atomically with os.replace, so the
+    prediction registries pick the new model up on their next lookup.
+    Returns the version string: the content hash of the compiled forest,
+    which is what predictions record in prediction_model_version.
+    """
+    from ml.train_model import export_forest_arrays
+
+    model.set_params(warm_start=False)
+    # np.savez appends .npz to names that lack it
+    tmp_forest_path = os.path.splitext(FOREST_PATH)[0] + '.tmp.npz'
+    export_forest_arrays(model, tmp_forest_path)
+    version = file_version(tmp_forest_path)
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    joblib.dump(model, os.path.join(MODELS_DIR, f'wait_predictor-{version}.joblib'))
+
+    tmp_model_path = MODEL_PATH + '.tmp'
+    joblib.dump(model, tmp_model_path)
+    os.replace(tmp_model_path, MODEL_PATH)
+    os.replace(tmp_forest_path, FOREST_PATH)
+
+    return version
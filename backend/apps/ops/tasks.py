@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+from celery import shared_task
+from django.utils import timezone
+from .prediction import reestimate_day
+
+@shared_task
+def reestimate_day_waits(date_str=None):
+    """Re-estimate predicted wait times for a day (YYYY-MM-DD, default today)"""
+    if date_str:
+        day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    else:
+        day = timezone.localdate()
+    updated = reestimate_day(day)
+    return f"Re-estimated {updated} appointments for {day}"
+
+@shared_task
+def retrain_wait_model(since_days=None):
+    """
+    Nightly retrain: extend the published model with the outcomes since it
+    was published, or with the last since_days of them. Until enough new
+    outcomes have come in for a chunk nothing is published, so the next run
+    looks further back and small sites still retrain every few nights.
+    """
+    from .retraining import last_published, publish_model, retrain
+    since = timezone.now() - timedelta(days=since_days) if since_days else last_published()
+    model, rows_used = retrain(since=since)
+    if model is None:
+        return "No completed appointments to train on"
+    return f"Published model {publish_model(model)} trained on {rows_used} rows"
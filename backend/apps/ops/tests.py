@@ -0,0 +1,314 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from datetime import datetime, time, timedelta
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.appointments.models import Appointment
+from apps.services.models import Service
+from . import prediction
+from .forest import CompiledForest
+from .lookup import WaitLookupTable, build_lookup_table
+from .prediction import get_queue_analytics
+from .registry import ModelRegistry
+from .retraining import iter_training_chunks
+
+
+class QueueAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        service = Service.objects.create(name='Passports', department='Civil', description='')
+        cls.today = timezone.localdate()
+        noon = timezone.make_aware(datetime.combine(cls.today, time(12)))
+        for status, priority, wait in [
+            (Appointment.Status.SCHEDULED, Appointment.Priority.NORMAL, 10),
+            (Appointment.Status.WAITING, Appointment.Priority.NORMAL, 20),
+            (Appointment.Status.COMPLETED, Appointment.Priority.EMERGENCY, 5),
+        ]:
+            Appointment.objects.create(
+                citizen=citizen, service=service, appointment_datetime=noon,
+                status=status, priority=priority, predicted_wait_minutes=wait,
+            )
+        Appointment.objects.create(
+            citizen=citizen, service=service, appointment_datetime=noon - timedelta(days=1),
+            status=Appointment.Status.COMPLETED,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cold_call_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            analytics = get_queue_analytics()
+        self.assertEqual(analytics['total_today'], 3)
+        self.assertEqual(analytics['current_queue_length'], 2)
+        self.assertEqual(analytics['completed_today'], 1)
+        self.assertEqual(analytics['total_appointments_all_time'], 4)
+        self.assertEqual(analytics['avg_wait_by_priority']['Normal'], 15.0)
+
+    def test_cached_call_makes_no_query(self):
+        get_queue_analytics()
+        with self.assertNumQueries(0):
+            get_queue_analytics()
+
+    def test_day_without_appointments_still_counts_all_time(self):
+        with self.assertNumQueries(1):
+            analytics = get_queue_analytics(self.today + timedelta(days=30))
+        self.assertEqual(analytics['total_today'], 0)
+        self.assertEqual(analytics['total_appointments_all_time'], 4)
+
+
+class TrainingQueueLengthTests(TestCase):
+    def test_queue_length_is_what_was_queued_at_booking(self):
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        service = Service.objects.create(name='Passports', department='Civil', description='')
+        day = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=1), time(9)))
+        booked = day - timedelta(days=7)
+
+        appointments = []
+        for i in range(3):
+            appointment = Appointment.objects.create(
+                citizen=citizen, service=service, appointment_datetime=day + timedelta(minutes=i),
+            )
+            appointments.append(appointment)
+        cancelled = Appointment.objects.create(
+            citizen=citizen, service=service, appointment_datetime=day, status=Appointment.Status.CANCELLED,
+        )
+        # Booked a day apart; the first one was called before the third was booked
+        for i, appointment in enumerate(appointments):
+            Appointment.objects.filter(pk=appointment.pk).update(
+                created_at=booked + timedelta(days=i),
+                called_at=booked + timedelta(days=1, hours=12) if i == 0 else day,
+                status=Appointment.Status.COMPLETED,
+                actual_wait_minutes=10,
+            )
+        Appointment.objects.filter(pk=cancelled.pk).update(created_at=booked)
+
+        (features, target), = iter_training_chunks()
+        self.assertEqual(list(features['queue_length']), [1, 2, 2])
+        self.assertEqual(list(target), [10, 10, 10])
+
+
+class WaitLookupTableTests(TestCase):
+    AXES = {
+        'hour': [9, 10],
+        'weekday': [0, 1],
+        'service_avg_minutes': [15],
+        'queue_length': [0, 1, 2],
+        'counters_active': [3],
+        'priority': [1, 4],
+    }
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'wait_lookup.json')
+
+    def build(self, offset, version):
+        return build_lookup_table(lambda matrix: matrix[:, 3] * 10 + offset, version, self.path, self.AXES)
+
+    def test_pointer_names_table_and_axes_together(self):
+        self.assertEqual(self.build(1, 'v1'), 24)
+        table = WaitLookupTable.load(self.path)
+        self.assertEqual(table.model_version, 'v1')
+        self.assertEqual(table.lookup([10, 1, 15, 2, 3, 4]), 21)
+        self.assertIsNone(table.lookup([11, 1, 15, 2, 3, 4]))
+
+        self.build(2, 'v2')
+        self.build(3, 'v3')
+        with open(self.path) as f:
+            pointer = json.load(f)
+        tables = sorted(name for name in os.listdir(self.directory.name) if name.endswith('.npy'))
+        # The new table and the one readers may still map; older ones are gone
+        self.assertEqual(len(tables), 2)
+        self.assertIn(pointer['table'], tables)
+        self.assertEqual(WaitLookupTable.load(self.path).lookup([10, 1, 15, 2, 3, 4]), 23)
+
+    def test_grid_rows_do_not_load_the_model(self):
+        forest_path = os.path.join(self.directory.name, 'forest.npz')
+        np.savez(forest_path, placeholder=np.zeros(1))
+        loader = mock.Mock()
+        forest_registry = ModelRegistry(forest_path, loader=loader)
+        version = forest_registry.version()
+        self.build(0, version)
+
+        with mock.patch.object(prediction, 'forest_registry', forest_registry), \
+                mock.patch.object(prediction, 'lookup_registry', ModelRegistry(self.path, loader=WaitLookupTable.load)):
+            predict, predictor_version = prediction.get_predictor()
+            rows = prediction.predict_rows(predict, predictor_version, np.array([[9, 0, 15, 1, 3, 1]] * 2))
+
+        self.assertEqual(predictor_version, version)
+        self.assertEqual(list(rows), [10, 10])
+        loader.assert_not_called()
+
+
+class ModelRegistryTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'model.txt')
+        self.loads = []
+
+    def loader(self, path):
+        with open(path) as f:
+            content = f.read()
+        if content == 'corrupt':
+            raise ValueError('unreadable model')
+        self.loads.append(content)
+        return content
+
+    def write(self, content, mtime):
+        with open(self.path, 'w') as f:
+            f.write(content)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_loads_once_and_reloads_when_the_file_changes(self):
+        registry = ModelRegistry(self.path, loader=self.loader)
+        self.assertIsNone(registry.get())
+
+        self.write('first', 1000)
+        first = registry.get()
+        self.assertEqual(first.model, 'first')
+        self.assertIs(registry.get(), first)
+
+        self.write('second', 2000)
+        self.assertEqual(registry.get().model, 'second')
+        self.assertEqual(self.loads, ['first', 'second'])
+
+    def test_touched_file_is_not_reloaded(self):
+        registry = ModelRegistry(self.path, loader=self.loader)
+        self.write('same', 1000)
+        version = registry.get().version
+        self.write('same', 2000)
+        self.assertEqual(registry.get().version, version)
+        self.assertEqual(self.loads, ['same'])
+
+    def test_unreadable_file_keeps_the_previous_model(self):
+        registry = ModelRegistry(self.path, loader=self.loader)
+        self.write('good', 1000)
+        registry.get()
+        self.write('corrupt', 2000)
+        self.assertEqual(registry.get().model, 'good')
+        # Serving goes on if the file disappears
+        os.remove(self.path)
+        self.assertEqual(registry.get().model, 'good')
+
+
+def linear_predict(matrix):
+    """Stand-in model: 10 minutes per queued appointment, times the priority level"""
+    matrix = np.asarray(matrix)
+    return matrix[:, 3] * 10 * matrix[:, 5]
+
+
+class BatchPredictionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        citizen = User.objects.create_user(
+            username='citizen', email='citizen@example.com', password='x',
+            first_name='Test', last_name='Citizen',
+        )
+        cls.service = Service.objects.create(
+            name='Passports', department='Civil', description='', avg_service_minutes=20,
+        )
+        cls.day = timezone.localdate() + timedelta(days=1)
+        start = timezone.make_aware(datetime.combine(cls.day, time(10)))
+        priorities = [Appointment.Priority.NORMAL, Appointment.Priority.ELDERLY, Appointment.Priority.EMERGENCY]
+        for i, priority in enumerate(priorities):
+            Appointment.objects.create(
+                citizen=citizen, service=cls.service, appointment_datetime=start + timedelta(minutes=i),
+                priority=priority,
+            )
+        Appointment.objects.create(
+            citizen=citizen, service=cls.service, appointment_datetime=start,
+            status=Appointment.Status.COMPLETED,
+        )
+
+    def setUp(self):
+        patcher = mock.patch.object(prediction, 'get_predictor', return_value=(linear_predict, 'test'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_matches_single_predictions(self):
+        appointments = list(
+            Appointment.objects.filter(status=Appointment.Status.SCHEDULED)
+            .select_related('service').order_by('appointment_datetime')
+        )
+        batch = prediction.predict_wait_minutes_batch(appointments)
+        self.assertEqual(batch, [prediction.predict_wait(appointment) for appointment in appointments])
+        # Three queued appointments: 30 minutes per priority level
+        self.assertEqual(batch, [(30, 'test'), (60, 'test'), (120, 'test')])
+
+    def test_reestimate_day_updates_queued_appointments_only(self):
+        output = StringIO()
+        call_command('reestimate_waits', '--date', self.day.isoformat(), '--batch-size', '2', stdout=output)
+        self.assertIn('Re-estimated 3 appointments', output.getvalue())
+
+        rows = dict(Appointment.objects.values_list('status', 'prediction_model_version').distinct())
+        self.assertEqual(rows[Appointment.Status.SCHEDULED], 'test')
+        self.assertEqual(rows[Appointment.Status.COMPLETED], '')
+
+
+class CompiledForestTests(TestCase):
+    def test_matches_sklearn(self):
+        from sklearn.ensemble import RandomForestRegressor
+        from ml.train_model import export_forest_arrays
+
+        rng = np.random.default_rng(0)
+        features = np.column_stack([
+            rng.integers(8, 18, 2000), rng.integers(0, 7, 2000), rng.integers(5, 60, 2000),
+            rng.integers(0, 40, 2000), rng.integers(1, 6, 2000), rng.integers(1, 5, 2000),
+        ]).astype(np.float32)
+        target = features[:, 2] * features[:, 3] / features[:, 4] + rng.normal(0, 5, 2000)
+        model = RandomForestRegressor(n_estimators=8, max_depth=8, random_state=0).fit(features, target)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = export_forest_arrays(model, os.path.join(directory.name, 'forest.npz'))
+        forest = CompiledForest.load(path)
+
+        self.assertEqual(forest.n_trees, 8)
+        np.testing.assert_allclose(forest.predict(features), model.predict(features), atol=1e-6)
+        self.assertAlmostEqual(forest.predict(features[0])[0], model.predict(features[:1])[0], places=6)
+        # Batches larger than one chunk are scored piecewise
+        with mock.patch.object(CompiledForest, 'CHUNK_SIZE', 300):
+            np.testing.assert_allclose(forest.predict(features), model.predict(features), atol=1e-6)
+
+
+class SyntheticDataTests(TestCase):
+    def test_output_depends_only_on_seed_and_chunk_size(self):
+        from ml.generate_data import COLUMNS, iter_chunks
+
+        serial = pd.concat(list(iter_chunks(2500, chunk_size=1000, seed=7)), ignore_index=True)
+        parallel = pd.concat(list(iter_chunks(2500, chunk_size=1000, seed=7, workers=2)), ignore_index=True)
+        pd.testing.assert_frame_equal(serial, parallel)
+
+        self.assertEqual(list(serial.columns), COLUMNS)
+        self.assertEqual(len(serial), 2500)
+        self.assertTrue(serial['wait_minutes'].between(3, 180).all())
+        self.assertTrue(serial['hour'].between(8, 17).all())
+        self.assertFalse(serial.equals(
+            pd.concat(list(iter_chunks(2500, chunk_size=1000, seed=8)), ignore_index=True)
+        ))
+
+    def test_writes_csv_in_chunks(self):
+        from ml.generate_data import write_synthetic_data
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'data.csv')
+        self.assertEqual(write_synthetic_data(path, 2500, chunk_size=1000), 2500)
+        self.assertEqual(len(pd.read_csv(path)), 2500)
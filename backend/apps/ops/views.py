@@ -4,7 +4,6 @@ from rest_framework.response import Response
 from django.db import models
 from apps.appointments.models import Appointment
 from .prediction import get_queue_analytics
-from datetime import datetime
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def analytics_dashboard(request):
@@ -14,19 +13,6 @@ def analytics_dashboard(request):
         return Response({'error': 'Permission denied'}, status=403)
     
     analytics = get_queue_analytics()
-    today = datetime.now().date()
-    
-    # Additional stats
-    total_appointments = Appointment.objects.count()
-    completed_today = Appointment.objects.filter(
-        appointment_datetime__date=today,
-        status='COMPLETED'
-    ).count()
-    
-    analytics.update({
-        'total_appointments_all_time': total_appointments,
-        'completed_today': completed_today,
-    })
     
     return Response(analytics)
 
@@ -1,9 +1,20 @@
 from django.contrib import admin
-from .models import Service
+from .models import OpeningHours, Service
+
+class OpeningHoursInline(admin.TabularInline):
+    model = OpeningHours
+    extra = 0
 
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ('name', 'department', 'avg_service_minutes', 'is_active', 'created_at')
     list_filter = ('department', 'is_active', 'created_at')
     search_fields = ('name', 'department')
-    list_editable = ('is_active',)
\ No newline at end of file
+    list_editable = ('is_active',)
+    inlines = [OpeningHoursInline]
+
+    def save_related(self, request, form, formsets, change):
+        if not change and any(inline.has_changed() for formset in formsets for inline in formset.forms):
+            # Hours entered with a new service replace the defaults it was created with
+            form.instance.opening_hours.all().delete()
+        super().save_related(request, form, formsets, change)
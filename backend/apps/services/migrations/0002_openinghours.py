@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:02
+
+from django.db import migrations, models
+import datetime
+import django.db.models.deletion
+
+
+def seed_opening_hours(apps, schema_editor):
+    """Give existing services the hours generate_slots used to produce by default"""
+    Service = apps.get_model('services', 'Service')
+    OpeningHours = apps.get_model('services', 'OpeningHours')
+    OpeningHours.objects.bulk_create(
+        OpeningHours(
+            service_id=service_id,
+            weekday=weekday,
+            opens=datetime.time(8, 0),
+            closes=datetime.time(17, 0),
+            interval_minutes=30,
+            capacity=1,
+        )
+        for service_id in Service.objects.values_list('id', flat=True)
+        for weekday in range(7)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('opens', models.TimeField()),
+                ('closes', models.TimeField(help_text='No slot starts at or after this time')),
+                ('interval_minutes', models.PositiveIntegerField(default=30)),
+                ('capacity', models.PositiveIntegerField(default=1)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opening_hours', to='services.service')),
+            ],
+            options={
+                'verbose_name_plural': 'opening hours',
+                'ordering': ['service', 'weekday', 'opens'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='openinghours',
+            constraint=models.CheckConstraint(check=models.Q(('closes__gt', models.F('opens'))), name='opening_hours_closes_after_opens'),
+        ),
+        migrations.AddConstraint(
+            model_name='openinghours',
+            constraint=models.CheckConstraint(check=models.Q(('interval_minutes__gt', 0)), name='opening_hours_interval_positive'),
+        ),
+        migrations.RunPython(seed_opening_hours, migrations.RunPython.noop),
+    ]
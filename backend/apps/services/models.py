@@ -1,4 +1,6 @@
-from django.db import models
+from datetime import datetime, time, timedelta
+from django.db import models, transaction
+from django.utils import timezone
 
 class Service(models.Model):
     name = models.CharField(max_length=100)
@@ -13,4 +15,109 @@ class Service(models.Model):
         ordering = ['department', 'name']
 
     def __str__(self):
-        return f"{self.name} ({self.department})"
\ No newline at end of file
+        return f"{self.name} ({self.department})"
+
+    def save(self, *args, **kwargs):
+        """A new service gets the default opening hours, so it can be booked right away"""
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            OpeningHours.create_defaults(self)
+
+
+class OpeningHours(models.Model):
+    """
+    Weekly slot template of a service: on weekday, a slot every
+    interval_minutes from opens until closes (local time), each taking
+    up to capacity bookings. Slots exist only virtually until a booking
+    or hold materializes them as ServiceSlot rows.
+    """
+    class Weekday(models.IntegerChoices):
+        MONDAY = 0, 'Monday'
+        TUESDAY = 1, 'Tuesday'
+        WEDNESDAY = 2, 'Wednesday'
+        THURSDAY = 3, 'Thursday'
+        FRIDAY = 4, 'Friday'
+        SATURDAY = 5, 'Saturday'
+        SUNDAY = 6, 'Sunday'
+
+    # Template given to new services (the hours generate_slots used to produce)
+    DEFAULT_OPENS = time(8, 0)
+    DEFAULT_CLOSES = time(17, 0)
+    DEFAULT_INTERVAL_MINUTES = 30
+    DEFAULT_CAPACITY = 1
+
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='opening_hours')
+    weekday = models.PositiveSmallIntegerField(choices=Weekday.choices)
+    opens = models.TimeField()
+    closes = models.TimeField(help_text="No slot starts at or after this time")
+    interval_minutes = models.PositiveIntegerField(default=30)
+    capacity = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        ordering = ['service', 'weekday', 'opens']
+        verbose_name_plural = 'opening hours'
+        constraints = [
+            models.CheckConstraint(check=models.Q(closes__gt=models.F('opens')), name='opening_hours_closes_after_opens'),
+            models.CheckConstraint(check=models.Q(interval_minutes__gt=0), name='opening_hours_interval_positive'),
+        ]
+
+    def __str__(self):
+        return f"{self.service.name}: {self.get_weekday_display()} {self.opens:%H:%M}-{self.closes:%H:%M}"
+
+    @classmethod
+    def create_defaults(cls, service):
+        """Open service every day with the default hours"""
+        return cls.objects.bulk_create(
+            cls(
+                service=service,
+                weekday=weekday,
+                opens=cls.DEFAULT_OPENS,
+                closes=cls.DEFAULT_CLOSES,
+                interval_minutes=cls.DEFAULT_INTERVAL_MINUTES,
+                capacity=cls.DEFAULT_CAPACITY,
+            )
+            for weekday in cls.Weekday.values
+        )
+
+    def slot_times(self):
+        """Local start times of the slots on one day"""
+        current = datetime.combine(datetime.min, self.opens)
+        end = datetime.combine(datetime.min, self.closes)
+        times = []
+        while current < end:
+            times.append(current.time())
+            current += timedelta(minutes=self.interval_minutes)
+        return times
+
+    def starts_at(self, local_time):
+        """Whether one of this template's slots starts at local_time"""
+        if not self.opens <= local_time < self.closes:
+            return False
+        offset = datetime.combine(datetime.min, local_time) - datetime.combine(datetime.min, self.opens)
+        return offset % timedelta(minutes=self.interval_minutes) == timedelta(0)
+
+    @staticmethod
+    def capacity_at(hours, slot_datetime):
+        """Capacity of the slot among hours (one service's templates) starting at slot_datetime, or None"""
+        local = timezone.localtime(slot_datetime)
+        for template in hours:
+            if template.weekday == local.weekday() and template.starts_at(local.time()):
+                return template.capacity
+        return None
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._notify_changed()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self._notify_changed()
+        return result
+
+    def _notify_changed(self):
+        from apps.appointments import hooks
+
+        service_id = self.service_id
+        transaction.on_commit(lambda: hooks.opening_hours_changed(service_id))
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import joblib
+
+# Make apps.ops importable when run from the ml/ directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from apps.ops.forest import CompiledForest
+
+FEATURE_COLUMNS = ['hour', 'weekday', 'service_avg_minutes', 'queue_length', 'counters_active', 'priority']
+
+def time_per_call(func, repeats):
+    """Average seconds per call over repeats calls"""
+    started = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - started) / repeats
+
+def benchmark(model_path='wait_predictor.joblib', forest_path='wait_predictor_forest.npz',
+              data_path='training_data.csv', single_repeats=200, tolerance=1e-6):
+    """Compare sklearn and the compiled forest for accuracy and speed"""
+
+    rf_model = joblib.load(model_path)
+    forest = CompiledForest.load(forest_path)
+    df = pd.read_csv(data_path)[FEATURE_COLUMNS]
+    X = df.to_numpy(dtype=np.float32)
+
+    print(f"Forest: {forest.n_trees} trees, {len(forest.feature)} nodes, max depth {forest.max_depth}")
+    print(f"Rows: {len(X)}")
+
+    # Accuracy
+    expected = rf_model.predict(df)
+    actual = forest.predict(X)
+    max_error = float(np.max(np.abs(expected - actual)))
+    print(f"\nMax absolute difference vs sklearn: {max_error:.2e} minutes")
+    if max_error > tolerance:
+        raise SystemExit(f"Compiled forest differs from sklearn by more than {tolerance}")
+
+    # Single-row latency, the booking path
+    row_frame = df.iloc[[0]]
+    row = X[0]
+    sklearn_single = time_per_call(lambda: rf_model.predict(row_frame), single_repeats)
+    compiled_single = time_per_call(lambda: forest.predict(row), single_repeats)
+
+    print("\n=== SINGLE ROW ===")
+    print(f"sklearn:  {sklearn_single * 1000:.3f} ms")
+    print(f"compiled: {compiled_single * 1000:.3f} ms")
+    print(f"speedup:  {sklearn_single / compiled_single:.1f}x")
+
+    # Whole-dataset batch
+    sklearn_batch = time_per_call(lambda: rf_model.predict(df), 3)
+    compiled_batch = time_per_call(lambda: forest.predict(X), 3)
+
+    print(f"\n=== BATCH ({len(X)} rows) ===")
+    print(f"sklearn:  {sklearn_batch * 1000:.1f} ms")
+    print(f"compiled: {compiled_batch * 1000:.1f} ms")
+    print(f"speedup:  {sklearn_batch / compiled_batch:.1f}x")
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,105 +1,194 @@
+import argparse
+import os
+import time
+from collections import deque
+from multiprocessing import Pool
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import random
 
-def generate_synthetic_data(num_records=10000):
+# Define service types and their average times
+SERVICES = [
+    ('License Renewal', 15),
+    ('Passport Application', 30),
+    ('Birth Certificate', 20),
+    ('Tax Payment', 10),
+    ('Vehicle Registration', 25),
+    ('Business Permit', 35),
+    ('ID Card Renewal', 12),
+    ('Marriage Certificate', 18),
+]
+SERVICE_MINUTES = np.array([minutes for _, minutes in SERVICES], dtype=np.int16)
+
+HOURS = np.arange(8, 18, dtype=np.int8)
+HOUR_WEIGHTS = [0.05, 0.08, 0.12, 0.15, 0.15, 0.15, 0.10, 0.10, 0.05, 0.05]  # Business hours bias
+WEEKDAY_WEIGHTS = [0.05, 0.20, 0.20, 0.20, 0.20, 0.10, 0.05]  # Weekday bias
+
+# Number of active counters (typically 2-5)
+COUNTERS = np.array([2, 3, 4, 5], dtype=np.int8)
+COUNTER_WEIGHTS = [0.2, 0.4, 0.3, 0.1]
+
+# NORMAL, ELDERLY, DISABLED, EMERGENCY as 1-4
+PRIORITY_LEVELS = np.array([1, 2, 3, 4], dtype=np.int8)
+PRIORITY_WEIGHTS = [0.7, 0.15, 0.10, 0.05]  # Distribution of priorities
+# Emergency gets served quickly, elderly and disabled get some priority
+PRIORITY_FACTORS = np.array([0.0, 1.0, 0.7, 0.8, 0.3])  # indexed by priority level
+
+PEAK_HOURS = [9, 10, 11, 14, 15]
+MEDIUM_HOURS = [8, 16, 17]
+DELAY_HOURS = [10, 11, 14]
+
+COLUMNS = ['hour', 'weekday', 'service_avg_minutes', 'queue_length', 'counters_active', 'priority', 'wait_minutes']
+
+def generate_chunk(rng, num_records):
+    """Draw num_records rows column by column from a numpy Generator"""
+
+    # Random time features
+    hour = rng.choice(HOURS, size=num_records, p=HOUR_WEIGHTS)
+    weekday = rng.choice(7, size=num_records, p=WEEKDAY_WEIGHTS).astype(np.int8)
+
+    # Service selection
+    service_avg = SERVICE_MINUTES[rng.integers(len(SERVICES), size=num_records)]
+
+    # Queue and counter features
+    # Peak hours and weekdays tend to have longer queues
+    base_queue = 5
+    queue_rate = np.where(np.isin(hour, PEAK_HOURS), 8, np.where(np.isin(hour, MEDIUM_HOURS), 4, 2))
+    queue_length = base_queue + rng.poisson(queue_rate)
+
+    # Weekend adjustment
+    queue_length = np.where(weekday >= 5, (queue_length * 0.6).astype(np.int64), queue_length).astype(np.int16)
+
+    counters_active = rng.choice(COUNTERS, size=num_records, p=COUNTER_WEIGHTS)
+    priority = rng.choice(PRIORITY_LEVELS, size=num_records, p=PRIORITY_WEIGHTS)
+
+    # Calculate actual wait time (target variable)
+    base_wait = service_avg * (queue_length / counters_active)
+
+    # Add randomness and adjustments
+    base_wait *= rng.normal(1.0, 0.3, size=num_records)  # ±30% randomness
+    base_wait *= PRIORITY_FACTORS[priority]
+
+    # Peak hour delays
+    base_wait = np.where(np.isin(hour, DELAY_HOURS), base_wait * 1.2, base_wait)
+
+    # Ensure reasonable bounds
+    wait_minutes = np.clip(np.trunc(base_wait), 3, 180).astype(np.int16)  # 3 min to 3 hours
+
+    return pd.DataFrame({
+        'hour': hour,
+        'weekday': weekday,
+        'service_avg_minutes': service_avg,
+        'queue_length': queue_length,
+        'counters_active': counters_active,
+        'priority': priority,
+        'wait_minutes': wait_minutes,
+    }, columns=COLUMNS)
+
+def chunk_plan(num_records, chunk_size, seed):
+    """
+    Split a dataset into (size, seed_sequence) chunks.
+
+    Each chunk gets its own child SeedSequence, so the output depends only
+    on seed and chunk_size, not on how many processes generate it.
+    """
+    sizes = [chunk_size] * (num_records // chunk_size)
+    if num_records % chunk_size:
+        sizes.append(num_records % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return list(zip(sizes, seeds))
+
+def _generate_planned_chunk(task):
+    size, seed_sequence = task
+    return generate_chunk(np.random.default_rng(seed_sequence), size)
+
+def iter_chunks(num_records, chunk_size=1_000_000, seed=42, workers=1):
+    """
+    Yield the dataset as DataFrames of at most chunk_size rows, in order.
+
+    With workers > 1 chunks are generated in a process pool; at most two
+    chunks per worker are in flight, so memory stays bounded however many
+    rows are requested.
+    """
+    plan = chunk_plan(num_records, chunk_size, seed)
+    if workers <= 1:
+        for task in plan:
+            yield _generate_planned_chunk(task)
+        return
+
+    with Pool(workers) as pool:
+        pending = deque()
+        tasks = iter(plan)
+        for task in tasks:
+            pending.append(pool.apply_async(_generate_planned_chunk, (task,)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            chunk = pending.popleft().get()
+            next_task = next(tasks, None)
+            if next_task is not None:
+                pending.append(pool.apply_async(_generate_planned_chunk, (next_task,)))
+            yield chunk
+
+def generate_synthetic_data(num_records=10000, seed=42):
     """Generate synthetic data for training the wait time prediction model"""
-    
-    np.random.seed(42)
-    random.seed(42)
-    
-    data = []
-    
-    # Define service types and their average times
-    services = [
-        ('License Renewal', 15),
-        ('Passport Application', 30),
-        ('Birth Certificate', 20),
-        ('Tax Payment', 10),
-        ('Vehicle Registration', 25),
-        ('Business Permit', 35),
-        ('ID Card Renewal', 12),
-        ('Marriage Certificate', 18),
-    ]
-    
-    priorities = ['NORMAL', 'ELDERLY', 'DISABLED', 'EMERGENCY']
-    priority_weights = [0.7, 0.15, 0.10, 0.05]  # Distribution of priorities
-    
-    for _ in range(num_records):
-        # Random time features
-        hour = np.random.choice(range(8, 18), p=[0.05, 0.08, 0.12, 0.15, 0.15, 0.15, 0.10, 0.10, 0.05, 0.05])  # Business hours bias
-        weekday = np.random.choice(range(7), p=[0.05, 0.20, 0.20, 0.20, 0.20, 0.10, 0.05])  # Weekday bias
-        
-        # Service selection
-        service_name, service_avg = random.choice(services)
-        
-        # Queue and counter features
-        # Peak hours and weekdays tend to have longer queues
-        base_queue = 5
-        if hour in [9, 10, 11, 14, 15]:  # Peak hours
-            queue_length = base_queue + np.random.poisson(8)
-        elif hour in [8, 16, 17]:  # Medium hours
-            queue_length = base_queue + np.random.poisson(4)
-        else:  # Light hours
-            queue_length = base_queue + np.random.poisson(2)
-            
-        # Weekend adjustment
-        if weekday in [5, 6]:  # Weekend
-            queue_length = int(queue_length * 0.6)
-        
-        # Number of active counters (typically 2-5)
-        counters_active = np.random.choice([2, 3, 4, 5], p=[0.2, 0.4, 0.3, 0.1])
-        
-        # Priority
-        priority = np.random.choice(priorities, p=priority_weights)
-        priority_num = {'NORMAL': 1, 'ELDERLY': 2, 'DISABLED': 3, 'EMERGENCY': 4}[priority]
-        
-        # Calculate actual wait time (target variable)
-        base_wait = service_avg * (queue_length / counters_active)
-        
-        # Add randomness and adjustments
-        randomness_factor = np.random.normal(1.0, 0.3)  # ±30% randomness
-        base_wait *= randomness_factor
-        
-        # Priority adjustments
-        if priority == 'EMERGENCY':
-            base_wait *= 0.3  # Emergency gets served quickly
-        elif priority == 'ELDERLY':
-            base_wait *= 0.7  # Elderly get some priority
-        elif priority == 'DISABLED':
-            base_wait *= 0.8  # Disabled get some priority
-        
-        # Peak hour delays
-        if hour in [10, 11, 14]:
-            base_wait *= 1.2
-        
-        # Ensure reasonable bounds
-        wait_minutes = max(3, min(180, int(base_wait)))  # 3 min to 3 hours
-        
-        data.append({
-            'hour': hour,
-            'weekday': weekday,
-            'service_avg_minutes': service_avg,
-            'queue_length': queue_length,
-            'counters_active': counters_active,
-            'priority': priority_num,
-            'wait_minutes': wait_minutes
-        })
-    
-    df = pd.DataFrame(data)
-    return df
+    return pd.concat(list(iter_chunks(num_records, seed=seed)), ignore_index=True)
+
+def write_synthetic_data(path, num_records, chunk_size=1_000_000, seed=42, workers=1, file_format=None):
+    """
+    Stream a synthetic dataset to CSV or Parquet chunk by chunk.
+
+    The format is taken from the file extension unless given. Parquet
+    output needs pyarrow. Returns the number of rows written.
+    """
+    file_format = file_format or ('parquet' if path.endswith('.parquet') else 'csv')
+    chunks = iter_chunks(num_records, chunk_size=chunk_size, seed=seed, workers=workers)
+    written = 0
+
+    if file_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow)")
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                written += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return written
+
+    with open(path, 'w', newline='') as f:
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=written == 0)
+            written += len(chunk)
+    return written
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic training data')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--output', default='training_data.csv', help='.csv or .parquet file')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=1, help='Generator processes (0 = all CPUs)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
     # Generate and save training data
     print("Generating synthetic training data...")
-    df = generate_synthetic_data(10000)
-    
-    # Save to CSV
-    df.to_csv('training_data.csv', index=False)
-    print(f"Generated {len(df)} records")
-    print("\nData summary:")
-    print(df.describe())
-    print("\nSample data:")
-    print(df.head(10))
-    print("\nData saved to 'training_data.csv'")
\ No newline at end of file
+    started = time.perf_counter()
+    written = write_synthetic_data(
+        args.output,
+        args.rows,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+        workers=args.workers or os.cpu_count(),
+    )
+    elapsed = time.perf_counter() - started
+
+    print(f"Generated {written} records in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} rows/s)")
+    print(f"\nData saved to '{args.output}'")
@@ -6,6 +6,37 @@ from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import joblib
 import os
 
+def export_forest_arrays(rf_model, path='wait_predictor_forest.npz'):
+    """
+    Flatten a trained forest into contiguous NumPy arrays.
+
+    All trees are concatenated into one node table (feature, threshold,
+    children, value) with child indices offset to the global numbering;
+    roots holds the index of each tree's first node. apps.ops.forest loads
+    this file to score rows without sklearn or pandas.
+    """
+    trees = [estimator.tree_ for estimator in rf_model.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+    
+    def offset_children(children, offset):
+        return np.where(children < 0, -1, children + offset)
+    
+    np.savez(
+        path,
+        feature=np.concatenate([tree.feature for tree in trees]).astype(np.int32),
+        threshold=np.concatenate([tree.threshold for tree in trees]).astype(np.float64),
+        children_left=np.concatenate([
+            offset_children(tree.children_left, offset) for tree, offset in zip(trees, offsets)
+        ]).astype(np.int32),
+        children_right=np.concatenate([
+            offset_children(tree.children_right, offset) for tree, offset in zip(trees, offsets)
+        ]).astype(np.int32),
+        value=np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64),
+        roots=offsets.astype(np.int32),
+        max_depth=np.int32(max(tree.max_depth for tree in trees)),
+    )
+    return path
+
 def train_wait_time_model():
     """Train a Random Forest model to predict wait times"""
     
@@ -74,6 +105,10 @@ def train_wait_time_model():
     joblib.dump(rf_model, model_path)
     print(f"\nModel saved to: {model_path}")
     
+    # Export flat arrays for the NumPy evaluator used at request time
+    forest_path = export_forest_arrays(rf_model)
+    print(f"Compiled forest saved to: {forest_path}")
+    
     # Test with sample predictions
     print("\n=== SAMPLE PREDICTIONS ===")
     sample_features = [
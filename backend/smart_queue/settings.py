@@ -79,6 +79,34 @@ DATABASES = {
     }
 }
 
+# Cache (shared between workers when REDIS_URL is set). The LocMem fallback is private to
+# each process, so features that rely on a shared cache are turned off without REDIS_URL:
+# - ETags / 304 on the queue and slot endpoints (apps.appointments.versions)
+# - the availability day and month caches (apps.appointments.availability)
+# - the live queue stream, whose event log lives in the cache (apps.appointments.events)
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            # Slot versions and calendars use one key per service-day; the default 300 culls them
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+
+# Live queue stream (GET /api/appointments/queue/stream/, server-sent events). Each open
+# stream holds a server worker for up to 5 minutes, so enable it only with REDIS_URL set
+# and a server that can keep many connections open (ASGI, or gevent/threaded WSGI workers).
+# Displays otherwise poll /api/appointments/queue/status/, which answers 304 while unchanged.
+QUEUE_STREAM_ENABLED = config('QUEUE_STREAM_ENABLED', default=False, cast=bool)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -147,15 +175,44 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+# Outbox sending rate in messages per minute (0 = unlimited)
+NOTIFICATION_RATE_LIMIT = int(os.getenv('NOTIFICATION_RATE_LIMIT', 0))
+# Reminders go out for appointments starting within this many hours
+REMINDER_HOURS_AHEAD = int(os.getenv('REMINDER_HOURS_AHEAD', 24))
 
 # Celery Configuration
-CELERY_BROKER_URL = 'memory://'   # in-memory broker
+# Deployments need a real broker (e.g. CELERY_BROKER_URL=redis://localhost:6379/0) plus
+# `celery -A smart_queue worker` and `celery -A smart_queue beat`: with a broker, confirmations,
+# the notification outbox and reminders are only sent by those processes.
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'memory://')   # in-memory broker by default
+# Nothing consumes the in-memory broker, so without CELERY_BROKER_URL tasks run eagerly inside
+# the request that queues them (confirmations and their outbox drain included) instead of being
+# dropped. CELERY_TASK_ALWAYS_EAGER overrides this either way.
+CELERY_TASK_ALWAYS_EAGER = os.getenv(
+    'CELERY_TASK_ALWAYS_EAGER', str('CELERY_BROKER_URL' not in os.environ)
+) == 'True'
 CELERY_RESULT_BACKEND = 'django-db'  # stores results in database
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Colombo'
 
+# Periodic tasks (run with `celery -A smart_queue beat`)
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-slot-holds': {
+        'task': 'apps.appointments.tasks.release_expired_holds',
+        'schedule': 30.0,
+    },
+    'drain-notification-outbox': {
+        'task': 'apps.appointments.tasks.drain_notification_outbox',
+        'schedule': 60.0,
+    },
+    'send-appointment-reminders': {
+        'task': 'apps.appointments.tasks.send_appointment_reminders',
+        'schedule': 900.0,
+    },
+}
+
 # Swagger Settings
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
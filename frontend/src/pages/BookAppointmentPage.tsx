@@ -13,7 +13,7 @@ const BookAppointmentPage: React.FC = () => {
   const queryClient = useQueryClient();
 
   const [availableSlots, setAvailableSlots] = useState<AvailableSlot[]>([]);
-  const [selectedSlot, setSelectedSlot] = useState<number | null>(null);
+  const [selectedSlot, setSelectedSlot] = useState<string | null>(null);
   const [selectedDate, setSelectedDate] = useState<Date | null>(null);
   const [currentMonth, setCurrentMonth] = useState(new Date());
 
@@ -100,7 +100,7 @@ const BookAppointmentPage: React.FC = () => {
       return;
     }
 
-    const slotData = availableSlots.find(slot => slot.id === selectedSlot);
+    const slotData = availableSlots.find(slot => slot.datetime === selectedSlot);
     if (!slotData) {
       toast.error('Invalid time slot selected');
       return;
@@ -109,7 +109,7 @@ const BookAppointmentPage: React.FC = () => {
     createAppointmentMutation.mutate({
       ...data,
       appointment_datetime: slotData.datetime,
-      slot_id: selectedSlot,
+      slot_id: slotData.id ?? undefined,
     });
   };
 
@@ -220,11 +220,11 @@ const BookAppointmentPage: React.FC = () => {
               <div className="grid grid-cols-2 gap-3">
                 {availableSlots.map(slot => (
                   <button
-                    key={slot.id}
+                    key={slot.datetime}
                     type="button"
-                    onClick={() => setSelectedSlot(slot.id)}
+                    onClick={() => setSelectedSlot(slot.datetime)}
                     className={`p-3 rounded-lg border transition text-sm font-medium ${
-                      selectedSlot === slot.id ? 'bg-primary-100 border-primary-500 text-primary-700 shadow-md' :
+                      selectedSlot === slot.datetime ? 'bg-primary-100 border-primary-500 text-primary-700 shadow-md' :
                       'border-gray-300 text-gray-700 hover:bg-gray-50'
                     }`}
                   >
@@ -125,7 +125,7 @@ export interface MyAppointment {
   qr_code_url?: string;  
 }
 export interface AvailableSlot {
-  id: number;
+  id: number | null;  // null until the slot is first booked
   datetime: string;
   current_bookings: number;
   max_capacity: number;